@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Build the dms-common-py layer zip for the standalone CloudFormation template.
+
+The CDK constructs bundle src/lambda/dms-common-py/layer/common themselves.
+LOBTruncationAlert_v1.yml cannot, so its DMSCommonLayer layer version is
+created from a zip in the issue resolution bucket (the CommonLayerS3Key
+parameter). This script packs the modules under ``python/``, where the Lambda
+Python runtime looks for layer code, and can upload the zip to that bucket.
+Run it before creating the stack:
+
+    python scripts/build_common_layer.py --bucket my-issue-resolution-bucket
+
+CloudFormation publishes a new layer version only when the layer properties
+change, so after a module change upload under a new key and pass it as
+CommonLayerS3Key when updating the stack:
+
+    python scripts/build_common_layer.py --bucket my-issue-resolution-bucket --key dms-common-layer-2.zip
+"""
+import argparse
+import os
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda')
+COMMON = os.path.join(ROOT, 'dms-common-py', 'layer', 'common')
+
+DEFAULT_KEY = 'dms-common-layer.zip'
+
+
+def build(output):
+    # fixed timestamps keep the zip, and so the layer version, unchanged until a module changes
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as layer:
+        for name in sorted(os.listdir(COMMON)):
+            if name.endswith('.py'):
+                with open(os.path.join(COMMON, name), 'rb') as module:
+                    info = zipfile.ZipInfo('python/' + name, date_time=(1980, 1, 1, 0, 0, 0))
+                    info.external_attr = 0o644 << 16
+                    layer.writestr(info, module.read(), zipfile.ZIP_DEFLATED)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=DEFAULT_KEY, help='zip file to write (default {})'.format(DEFAULT_KEY))
+    parser.add_argument('--bucket', help='upload the zip to this bucket, the S3Bucket parameter of the stack')
+    parser.add_argument('--key', default=DEFAULT_KEY, help='S3 key, the CommonLayerS3Key parameter (default {})'.format(DEFAULT_KEY))
+    args = parser.parse_args()
+
+    build(args.output)
+    print('Built {}'.format(args.output))
+    if args.bucket:
+        import boto3
+        boto3.client('s3').upload_file(args.output, args.bucket, args.key)
+        print('Uploaded to s3://{}/{}'.format(args.bucket, args.key))
+
+
+if __name__ == '__main__':
+    main()
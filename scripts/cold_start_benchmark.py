@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Measure Lambda handler cold-start cost locally.
+
+Each handler module is imported in a fresh interpreter started with
+``python -X importtime`` and the same layer directories on ``PYTHONPATH`` that
+the Lambda runtime would see. For every handler the report shows the wall time
+of the module import (handler init), whether boto3 was already imported by
+then, the cumulative import time of its heaviest top-level dependencies and
+the time taken to build the first DMS client. Handlers import boto3 through
+the clients module on first use; only ``botocore.exceptions``, a few
+milliseconds on top of ``logging`` and ``re``, is imported at init for their
+``except`` clauses. Run it before and after a change to compare init duration:
+
+    python scripts/cold_start_benchmark.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda')
+
+LAYERS = [
+    os.path.join(ROOT, 'dms-common-py', 'layer', 'common'),
+    os.path.join(ROOT, 'dms-switch-py', 'layer', 'utils'),
+]
+
+HANDLERS = {
+    'dms-monitoring': os.path.join(ROOT, 'dms-monitoring'),
+    'dms-issue-notification': os.path.join(ROOT, 'dms-issue-notification'),
+    'get-dms-config': os.path.join(ROOT, 'get-dms-config'),
+    'dms-pre': os.path.join(ROOT, 'dms-switch-py', 'dms_pre'),
+    'dms-post': os.path.join(ROOT, 'dms-switch-py', 'dms_post'),
+    'dms-pre-serverless': os.path.join(ROOT, 'dms-switch-py', 'dms_pre_serverless'),
+    'dms-post-serverless': os.path.join(ROOT, 'dms-switch-py', 'dms_post_serverless'),
+}
+
+# Runs inside the child interpreter; prints one JSON line on stdout.
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+init_ms = (time.perf_counter() - started) * 1000
+boto3_at_init = 'boto3' in sys.modules
+started = time.perf_counter()
+try:
+    import clients
+    clients.get_client('dms')
+except ImportError:
+    import boto3
+    boto3.client('dms')
+client_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({'InitMs': init_ms, 'Boto3AtInit': boto3_at_init, 'FirstClientMs': client_ms}))
+'''
+
+FAKE_ENVIRONMENT = {
+    'AWS_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_LAMBDA_FUNCTION_NAME': 'cold-start-benchmark',
+    'INSTRUMENTATION_MODE': 'off',
+}
+
+
+def parse_importtime(stderr, top):
+    # lines look like "import time:   self [us] | cumulative | imported package"
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # nested imports are indented and already counted in their parent
+        name = name[1:]
+        if not name.startswith(' ') and '.' not in name:
+            cumulative[name] = cumulative.get(name, 0) + int(cumulative_us)
+    heaviest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [(name, us / 1000) for name, us in heaviest]
+
+
+def run_once(name, path):
+    env = dict(os.environ)
+    env.update(FAKE_ENVIRONMENT)
+    env['PYTHONPATH'] = os.pathsep.join([path] + LAYERS)
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                            cwd=path, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'exit {}'.format(result.returncode)
+        return None, error, []
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, None, result.stderr
+
+
+def benchmark(name, path, runs, top):
+    init, first_client, imports, boto3_at_init = [], [], [], False
+    for _ in range(runs):
+        timings, error, stderr = run_once(name, path)
+        if error:
+            return {'Handler': name, 'Error': error}
+        init.append(timings['InitMs'])
+        first_client.append(timings['FirstClientMs'])
+        boto3_at_init = timings['Boto3AtInit']
+        imports = parse_importtime(stderr, top)
+    return {
+        'Handler': name,
+        'InitMs': statistics.median(init),
+        'Boto3AtInit': boto3_at_init,
+        'FirstClientMs': statistics.median(first_client),
+        'HeaviestImports': imports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='cold starts per handler, the median is reported')
+    parser.add_argument('--top', type=int, default=3, help='number of heaviest imports to list')
+    parser.add_argument('--json', action='store_true', help='print the raw results as JSON')
+    parser.add_argument('handlers', nargs='*', help='handlers to measure (default: all of {})'.format(', '.join(HANDLERS)))
+    args = parser.parse_args()
+    unknown = [name for name in args.handlers if name not in HANDLERS]
+    if unknown:
+        parser.error('unknown handler(s): {}'.format(', '.join(unknown)))
+
+    results = [benchmark(name, HANDLERS[name], args.runs, args.top) for name in (args.handlers or HANDLERS)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:<24} {:>10} {:>14} {:>16}  {}'.format('handler', 'init ms', 'boto3 at init', 'first client ms',
+                                                  'heaviest imports (cumulative ms)'))
+    for result in results:
+        if 'Error' in result:
+            print('{:<24} {:>10} {:>14} {:>16}  {}'.format(result['Handler'], '-', '-', '-', result['Error']))
+            continue
+        imports = ', '.join('{} {:.1f}'.format(name, ms) for name, ms in result['HeaviestImports'])
+        print('{:<24} {:>10.1f} {:>14} {:>16.1f}  {}'.format(result['Handler'], result['InitMs'],
+                                                            'yes' if result['Boto3AtInit'] else 'no',
+                                                            result['FirstClientMs'], imports))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Benchmark the multi-pattern log classifier on synthetic DMS task logs.
+
+Generates DMS task log lines in the usual ``<timestamp> [<component> ]<level>:
+<message>`` shape, a configurable share of which carry one of the issue
+signatures, and classifies them with the combined matcher of
+``log_classifier.LogClassifier``. As a baseline every signature is evaluated
+on its own against every line, which is what one filter per issue type costs.
+Both must agree on every line. Signatures come from the issue resolution CSV
+when one is given:
+
+    python scripts/log_classifier_benchmark.py --lines 200000
+    python scripts/log_classifier_benchmark.py --csv Issue_Resolution.csv
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda')
+sys.path.insert(0, os.path.join(ROOT, 'dms-common-py', 'layer', 'common'))
+
+import knowledge_base  # noqa: E402
+import log_classifier  # noqa: E402
+import log_scanner  # noqa: E402
+
+# TRUNCATION is the pattern of the shipped Issue_Resolution.csv; the others stand in for
+# further issue types a knowledge base may hold.
+SIGNATURES = {
+    'TRUNCATION': '?"W:  Truncation" ?truncated ?trimmed',
+    'TABLE_SUSPENDED': '?"Table is suspended" ?"suspended table"',
+    'CONNECTION_LOST': '?"Connection lost" ?"connection reset" ?"Network error"',
+    'OUT_OF_MEMORY': '?"Out of memory" ?"cannot allocate memory"',
+    'PRIMARY_KEY': '"duplicate key" -ignored',
+    'LOG_READER': '?"Cannot read the log" ?"Log sequence number" ?"binlog is purged"',
+    'PERMISSION': '?"permission denied" ?"Access denied" ?"insufficient privileges"',
+    'LOB_LOOKUP': '"LOB lookup" failed',
+}
+
+NOISE = [
+    'I:  Task Server Log (V3.5.2.R1 DMS-REPL-INSTANCE Linux) [1000000]  (datatarget.c:123)',
+    'I:  Load finished for table \'sales\'.\'orders\' (Id = 3). 381203 rows received. 0 rows skipped.',
+    'I:  Bulk apply operation succeeded for table \'sales\'.\'order_items\' [1020101]  (bulk_apply.c:712)',
+    'D:  Going to set the LOB column value for column \'notes\' (odbc_endpoint_imp.c:4121)',
+    'I:  Start processing transaction with id 000003a1 [1000010]  (sorter_transaction.c:2991)',
+    'I:  CDC position updated to \'mysql-bin-changelog.000112:4231\' [1020200]  (source_capture.c:882)',
+    'W:  Table \'inventory\'.\'stock\' has no primary key, using all columns [1022502]  (metadatamanager.c:3391)',
+    'I:  Memory usage 1.2 GB, swap 0 bytes [1000000]  (resource_monitor.c:88)',
+]
+
+COMPONENTS = ['TARGET_APPLY', 'SOURCE_CAPTURE', 'SORTER', 'TARGET_LOAD', 'SOURCE_UNLOAD', 'TASK_MANAGER']
+
+
+def synthetic_messages(signatures, lines, issue_share, seed):
+    rng = random.Random(seed)
+    samples = {}
+    for issue_type, filter_pattern in signatures.items():
+        terms = log_scanner.filter_terms(filter_pattern)
+        if terms is None:
+            continue
+        required, optional, _ = terms
+        samples[issue_type] = [' '.join(required + [term]) for term in optional] or [' '.join(required)]
+    issue_types = sorted(samples)
+    messages = []
+    for i in range(lines):
+        prefix = '2024-05-01T10:{:02d}:{:02d} [{:<14}]'.format(i // 6000 % 60, i // 100 % 60, rng.choice(COMPONENTS))
+        if issue_types and rng.random() < issue_share:
+            sample = rng.choice(samples[rng.choice(issue_types)])
+            messages.append('{}E:  {} for table \'t{}\' [1022517]  (odbc_util.c:{})'.format(prefix, sample, i % 97, i % 4000))
+        else:
+            messages.append('{}{}'.format(prefix, rng.choice(NOISE)))
+    return messages
+
+
+def per_signature_baseline(signatures, messages):
+    # every signature checked separately against every message
+    parsed = {issue_type: log_scanner.filter_terms(pattern) for issue_type, pattern in signatures.items()}
+    parsed = {issue_type: terms for issue_type, terms in parsed.items() if terms is not None and any(terms)}
+    results = []
+    for message in messages:
+        matched = []
+        for issue_type, (required, optional, excluded) in parsed.items():
+            if all(t in message for t in required) and not any(t in message for t in excluded) \
+                    and (not optional or any(t in message for t in optional)):
+                matched.append(issue_type)
+        results.append(matched)
+    return results
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=100000, help='synthetic log lines (default 100000)')
+    parser.add_argument('--issue-share', type=float, default=0.05, help='share of lines carrying a signature')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--csv', help='issue resolution CSV to take the signatures from')
+    args = parser.parse_args()
+
+    signatures = SIGNATURES
+    if args.csv:
+        with open(args.csv, 'rb') as f:
+            signatures = knowledge_base.ResolutionIndex.from_csv(f.read()).signatures()
+
+    messages = synthetic_messages(signatures, args.lines, args.issue_share, args.seed)
+    classifier, compile_seconds = timed(log_classifier.LogClassifier, signatures)
+    combined, combined_seconds = timed(lambda: [classifier.classify_message(m) for m in messages])
+    baseline, baseline_seconds = timed(per_signature_baseline, signatures, messages)
+
+    mismatches = sum(1 for a, b in zip(combined, baseline) if sorted(a) != sorted(b))
+    classified = sum(1 for issue_types in combined if issue_types)
+    print('signatures: {} ({} skipped), lines: {}, classified: {}'.format(
+        len(classifier.issue_types), len(classifier.skipped), len(messages), classified))
+    print('union filter pattern: {}'.format(classifier.filter_pattern))
+    print('{:<24} {:>10} {:>14}'.format('matcher', 'seconds', 'lines / second'))
+    print('{:<24} {:>10.3f} {:>14}'.format('compile', compile_seconds, '-'))
+    for name, seconds in [('combined', combined_seconds), ('per signature', baseline_seconds)]:
+        print('{:<24} {:>10.3f} {:>14,.0f}'.format(name, seconds, len(messages) / seconds))
+    print('mismatches: {}'.format(mismatches))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
 import { Aws, CustomResource, Duration } from 'aws-cdk-lib';
 import { Rule, RuleTargetInput, Schedule } from 'aws-cdk-lib/aws-events';
 import { LambdaFunction } from 'aws-cdk-lib/aws-events-targets';
@@ -10,7 +10,16 @@ import { Construct } from 'constructs';
 export interface DmsDashboardProps {
   readonly collectionInterval?: number;
   readonly replicationInstanceArn: string;
+  /**
+   * Number of most recently created tasks to put on the dashboard, 0 for every task.
+   * Tasks that do not fit on one dashboard are split over linked dashboards.
+   */
   readonly numTasks?: number;
+  /**
+   * Build the task graphs from CloudWatch SEARCH() expressions instead of one metric per task,
+   * so the dashboard stays the same size and picks up new tasks without being regenerated.
+   */
+  readonly useSearchExpressions?: boolean;
 }
 
 export class DmsDashboard extends Construct {
@@ -32,8 +41,8 @@ export class DmsDashboard extends Construct {
       numTasks = 3;
     }
 
-    if (numTasks < 1 || numTasks > 30) {
-      throw new Error('Must be a valid integer between 1 and 30.');
+    if (numTasks < 0 || numTasks > 30) {
+      throw new Error('Must be a valid integer between 0 and 30.');
     }
 
     const rdsAccessPolicy = new PolicyStatement({
@@ -79,6 +88,14 @@ export class DmsDashboard extends Construct {
       inlinePolicies: inlinePolicies,
     });
 
+    const commonLayer = new PythonLayerVersion(this, 'DmsCommonLayer', {
+      entry: 'src/lambda/dms-common-py/layer/common',
+      compatibleRuntimes: [Runtime.PYTHON_3_11],
+      bundling: {
+        outputPathSuffix: '/python',
+      },
+    });
+
     const dmsMonFunction = new PythonFunction(this, 'DmsMonFunction', {
       entry: 'src/lambda/dms-monitoring',
       index: 'index.py',
@@ -87,6 +104,7 @@ export class DmsDashboard extends Construct {
       role: dmsLambdaMonitorRole,
       timeout: Duration.seconds(60),
       reservedConcurrentExecutions: 10,
+      layers: [commonLayer],
     });
 
     new Rule(this, 'DMSMetricCollectionSchedule', {
@@ -134,7 +152,10 @@ export class DmsDashboard extends Construct {
       resources: ['*'], // punting for now
       effect: Effect.ALLOW,
       actions: [
+        'cloudwatch:GetDashboard',
         'cloudwatch:PutDashboard',
+        'cloudwatch:ListDashboards',
+        'cloudwatch:DeleteDashboards',
       ],
     });
 
@@ -169,9 +190,11 @@ export class DmsDashboard extends Construct {
       role: getDmsConfigRole,
       timeout: Duration.seconds(600),
       reservedConcurrentExecutions: 10,
+      layers: [commonLayer],
       environment: {
         RI_ARN: riArn,
         NUM_TASKS: String(numTasks),
+        TASK_METRICS_MODE: props.useSearchExpressions ? 'search' : 'explicit',
         STACK_NAME: Aws.STACK_NAME,
         REGION: Aws.REGION,
       },
@@ -10,7 +10,7 @@ import { CustomResource, Duration, Stack } from "aws-cdk-lib";
 import { join } from "path";
 import { Runtime } from "aws-cdk-lib/aws-lambda";
 import { RetentionDays } from "aws-cdk-lib/aws-logs";
-import { PythonFunction, PythonLayerVersion } from "@aws-cdk/aws-lambda-python-alpha";
+import { PythonFunction, PythonFunctionProps, PythonLayerVersion } from "@aws-cdk/aws-lambda-python-alpha";
 
 export interface DMSReplicatorProps {
   taskSettings: any;
@@ -18,6 +18,13 @@ export interface DMSReplicatorProps {
   target: TargetProps,
   vpc: Vpc,
   serverless: boolean,
+  /**
+   * Return from the pre/post DMS handlers as soon as the stop/start is issued
+   * and let the custom resource provider poll for completion.
+   *
+   * @default false
+   */
+  asyncWait?: boolean,
 }
 
 export interface TargetProps {
@@ -93,6 +100,14 @@ export class KinesisDMSReplicator extends Construct {
         outputPathSuffix: '/python',
       }
     })
+
+    const commonLayer = new PythonLayerVersion(this, 'common-layer', {
+      entry: 'src/lambda/dms-common-py/layer/common',
+      compatibleRuntimes: [Runtime.PYTHON_3_11],
+      bundling: {
+        outputPathSuffix: '/python',
+      }
+    })
     
     var dmsTableMappings = {
       "rules": [
@@ -114,9 +129,23 @@ export class KinesisDMSReplicator extends Construct {
       memorySize: 1028,
       timeout: Duration.minutes(15),
       logRetention: RetentionDays.ONE_DAY,
-      layers: [pythonLayer],
+      layers: [pythonLayer, commonLayer],
     };
 
+    const waitEnvironment: { [key: string]: string } = props.asyncWait ? { WAIT_MODE: 'async' } : {};
+
+    // In async mode the same handler code is deployed a second time with its
+    // is_complete entry point, which the provider polls until DMS settles.
+    const completionProps = (id: string, fnProps: PythonFunctionProps) => props.asyncWait ? {
+      isCompleteHandler: new PythonFunction(this, `${id}-complete`, {
+        ...fnProps,
+        handler: 'is_complete',
+        timeout: Duration.minutes(1),
+      }),
+      queryInterval: Duration.seconds(30),
+      totalTimeout: Duration.hours(2),
+    } : {};
+
     if (!props.serverless) {
       this.replicatorInstance = new CfnReplicationInstance(this, 'DmsInstance', {
         replicationInstanceClass: 'dms.r5.large',
@@ -138,11 +167,12 @@ export class KinesisDMSReplicator extends Construct {
         replicationTaskSettings: JSON.stringify(props.taskSettings),
       });
       
-      const preDmsFn = new PythonFunction(this, `pre-dms`, {
+      const preDmsProps: PythonFunctionProps = {
         ...lambdaProps,
         entry: join(__dirname, "../lambda/dms-switch-py/dms_pre/"),
         environment: {
           STACK_NAME: Stack.of(this).stackName,
+          ...waitEnvironment,
         },        
         initialPolicy: [
           new PolicyStatement({
@@ -160,14 +190,16 @@ export class KinesisDMSReplicator extends Construct {
             resources: ["*"],
           }),
         ],
-      });
+      };
+      const preDmsFn = new PythonFunction(this, `pre-dms`, preDmsProps);
   
-      const postDmsFn = new PythonFunction(this, `post-dms`, {
+      const postDmsProps: PythonFunctionProps = {
         ...lambdaProps,
         entry: join(__dirname, "../lambda/dms-switch-py/dms_post/"),
         environment: {
           STACK_NAME: Stack.of(this).stackName,
           DMS_TASK: this.task.ref,
+          ...waitEnvironment,
         },
         initialPolicy: [
           new PolicyStatement({
@@ -185,10 +217,12 @@ export class KinesisDMSReplicator extends Construct {
             resources: ["*"],
           }),
         ],
-      });
+      };
+      const postDmsFn = new PythonFunction(this, `post-dms`, postDmsProps);
             
       const preProvider = new Provider(this, `pre-dms-provider`, {
         onEventHandler: preDmsFn,
+        ...completionProps(`pre-dms`, preDmsProps),
       });
   
       const preResource = new CustomResource(this, `pre-dms-resource`, {
@@ -198,6 +232,7 @@ export class KinesisDMSReplicator extends Construct {
   
       const postProvider = new Provider(this, `post-dms-provider`, {
         onEventHandler: postDmsFn,
+        ...completionProps(`post-dms`, postDmsProps),
       });
   
       const postResource = new CustomResource(this, `post-dms-resource`, {
@@ -224,11 +259,12 @@ export class KinesisDMSReplicator extends Construct {
         replicationConfigIdentifier: 'dmsKinesisConfig',
       });
 
-      const preDmsServerlessFn = new PythonFunction(this, `pre-dms`, {
+      const preDmsServerlessProps: PythonFunctionProps = {
         ...lambdaProps,
         entry: join(__dirname, "../lambda/dms-switch-py/dms_pre_serverless/"),
         environment: {
           STACK_NAME: Stack.of(this).stackName,
+          ...waitEnvironment,
         },
         initialPolicy: [
           new PolicyStatement({
@@ -246,14 +282,16 @@ export class KinesisDMSReplicator extends Construct {
             resources: ["*"],
           }),
         ],
-      });
+      };
+      const preDmsServerlessFn = new PythonFunction(this, `pre-dms`, preDmsServerlessProps);
   
-      const postDmsServerlessFn = new PythonFunction(this, `post-dms`, {
+      const postDmsServerlessProps: PythonFunctionProps = {
         ...lambdaProps,
-        entry: join(__dirname, "../lambda/dms-switch/dms_post_serverless/"),
+        entry: join(__dirname, "../lambda/dms-switch-py/dms_post_serverless/"),
         environment: {
           STACK_NAME: Stack.of(this).stackName,
           DMS_TASK: this.replicationConfig.ref, // 
+          ...waitEnvironment,
         },
         initialPolicy: [
           new PolicyStatement({
@@ -271,10 +309,12 @@ export class KinesisDMSReplicator extends Construct {
             resources: ["*"],
           }),
         ],
-      });
+      };
+      const postDmsServerlessFn = new PythonFunction(this, `post-dms`, postDmsServerlessProps);
             
       const preProvider = new Provider(this, `pre-dms-provider`, {
         onEventHandler: preDmsServerlessFn,
+        ...completionProps(`pre-dms`, preDmsServerlessProps),
       });
   
       const preResource = new CustomResource(this, `pre-dms-resource`, {
@@ -284,6 +324,7 @@ export class KinesisDMSReplicator extends Construct {
   
       const postProvider = new Provider(this, `post-dms-provider`, {
         onEventHandler: postDmsServerlessFn,
+        ...completionProps(`post-dms`, postDmsServerlessProps),
       });
   
       const postResource = new CustomResource(this, `post-dms-resource`, {
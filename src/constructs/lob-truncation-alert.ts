@@ -1,4 +1,4 @@
-import { PythonFunction } from "@aws-cdk/aws-lambda-python-alpha";
+import { PythonFunction, PythonLayerVersion } from "@aws-cdk/aws-lambda-python-alpha";
 import { Duration, RemovalPolicy } from "aws-cdk-lib";
 import { Alarm, ComparisonOperator, TreatMissingData, Unit } from "aws-cdk-lib/aws-cloudwatch";
 import { Rule } from "aws-cdk-lib/aws-events";
@@ -66,6 +66,10 @@ export class LobTruncationAlert extends Construct {
       effect: Effect.ALLOW,
       actions: [
         'logs:FilterLogEvents',
+        'logs:DescribeLogStreams',
+        'logs:StartQuery',
+        'logs:GetQueryResults',
+        'logs:StopQuery',
       ],
     });
 
@@ -97,8 +101,20 @@ export class LobTruncationAlert extends Construct {
     });
 
     bucket.grantRead(dmsLambdaMonitorRole);
+    // alarm coalescing windows, shared by all containers of the notification function
+    bucket.grantPut(dmsLambdaMonitorRole, 'alarm-coalescer/*');
+    // full reports of notifications cut to the SNS size limit
+    bucket.grantPut(dmsLambdaMonitorRole, 'notification-reports/*');
     topic.grantPublish(dmsLambdaMonitorRole);
 
+    const commonLayer = new PythonLayerVersion(this, 'DmsCommonLayer', {
+      entry: 'src/lambda/dms-common-py/layer/common',
+      compatibleRuntimes: [Runtime.PYTHON_3_11],
+      bundling: {
+        outputPathSuffix: '/python',
+      },
+    });
+
     const dmsIssueCustNotification = new PythonFunction(this, 'dmsIssueCustNotification', {
       entry: 'src/lambda/dms-issue-notification',
       index: 'index.py',
@@ -107,12 +123,16 @@ export class LobTruncationAlert extends Construct {
       role: dmsLambdaMonitorRole,
       timeout: Duration.seconds(60),
       reservedConcurrentExecutions: 10,
+      layers: [commonLayer],
       environment: {
         NotificationSNSTopic: topic.topicArn,
         RiARN: props.riArn,
         S3Bucket: bucket.bucketArn,
         S3Key: 'Issue_Resolution.csv',
-        AlarmName: alarm.alarmArn
+        AlarmName: alarm.alarmArn,
+        COALESCE_STORE: 's3',
+        COALESCE_LOCATION: `s3://${bucket.bucketName}/alarm-coalescer/`,
+        NOTIFICATION_REPORT_LOCATION: `s3://${bucket.bucketName}/notification-reports/`,
       },
     });
 
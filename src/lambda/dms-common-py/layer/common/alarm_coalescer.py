@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+import time
+import clients
+from botocore.exceptions import BotoCoreError, ClientError, ParamValidationError
+
+logger = logging.getLogger(__name__)
+
+# Merges alarms raised for the same replication instance and issue type while one of them
+# is being diagnosed. The first alarm of a window owns it: it runs the diagnosis and sends
+# one digest notification. Alarms arriving before the owner sends are only recorded and
+# listed in its digest. Once the digest is sent, or when the window is older than its
+# length because the owner never completed, the next alarm takes the window over with the
+# alarms not notified yet. An owner whose diagnosis ends early still completes the window
+# and notifies the alarms merged into it. Window state lives in a pluggable store whose
+# put is conditional on the version read, so concurrent invocations cannot both own a
+# window.
+DEFAULT_WINDOW_SECONDS = 300
+# alarms kept per window; further ones are only counted
+MAX_ALARMS_PER_WINDOW = 50
+MAX_UPDATE_ATTEMPTS = 10
+
+
+def coalesce_key(ri_arn, issue_type):
+    return '{}|{}'.format(ri_arn, issue_type)
+
+
+class MemoryCoalesceStore:
+    # Module-level state keeps it warm across invocations of one container, so it only
+    # merges alarms handled by the same container
+
+    _entries = {}
+    _lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            version, state = self._entries.get(key, (None, None))
+            return json.loads(state) if state else None, version
+
+    def put(self, key, state, version):
+        with self._lock:
+            if self._entries.get(key, (None, None))[0] != version:
+                return False
+            self._entries[key] = ((version or 0) + 1, json.dumps(state))
+            return True
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+
+class FileCoalesceStore:
+    # One JSON document for all keys, for tests and local runs of a single process
+
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._read().get(key)
+        return (entry['State'], entry['Version']) if entry else (None, None)
+
+    def put(self, key, state, version):
+        with self._lock:
+            entries = self._read()
+            if entries.get(key, {}).get('Version') != version:
+                return False
+            entries[key] = {'Version': (version or 0) + 1, 'State': state}
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            return True
+
+
+class S3CoalesceStore:
+    # One object per key; the ETag is the version and puts are S3 conditional writes.
+    # botocore releases older than the IfMatch / IfNoneMatch parameters of PutObject
+    # reject them before sending, then windows are kept in memory for the container.
+
+    _memory_fallback = None
+
+    def __init__(self, bucket, prefix='', s3_client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = s3_client or clients.get_client('s3')
+
+    def _key(self, key):
+        return self.prefix + key.replace(':', '_').replace('|', '/')
+
+    def get(self, key):
+        if self._memory_fallback is not None:
+            return self._memory_fallback.get(key)
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+            return json.loads(response['Body'].read()), response['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return None, None
+            raise (e)
+
+    def put(self, key, state, version):
+        if self._memory_fallback is not None:
+            return self._memory_fallback.put(key, state, version)
+        condition = {'IfMatch': version} if version else {'IfNoneMatch': '*'}
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self._key(key),
+                                      Body=json.dumps(state).encode('utf-8'), **condition)
+            return True
+        except ParamValidationError as e:
+            logger.warning('S3 conditional writes are not supported by this botocore, alarms are only coalesced '
+                           'within this container from now on; bundle a newer boto3 with the layer: {}'.format(e))
+            S3CoalesceStore._memory_fallback = MemoryCoalesceStore()
+            # the caller reads the window again, now from memory
+            return False
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['PreconditionFailed', 'ConditionalRequestConflict', '412', '409']:
+                return False
+            raise (e)
+
+
+class DynamoDBCoalesceStore:
+    # One item per key; the table needs a string partition key 'CoalesceKey'. ExpiresAt
+    # can be used as the table's TTL attribute.
+
+    def __init__(self, table_name, window_seconds=DEFAULT_WINDOW_SECONDS, dynamodb_resource=None):
+        self.table = (dynamodb_resource or clients.get_resource('dynamodb')).Table(table_name)
+        self.window_seconds = window_seconds
+
+    def get(self, key):
+        item = self.table.get_item(Key={'CoalesceKey': key}, ConsistentRead=True).get('Item')
+        return (json.loads(item['State']), int(item['Version'])) if item else (None, None)
+
+    def put(self, key, state, version):
+        item = {'CoalesceKey': key, 'Version': (version or 0) + 1, 'State': json.dumps(state),
+                'ExpiresAt': int(state['OpenedAt'] + 2 * self.window_seconds)}
+        if version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(CoalesceKey)'}
+        else:
+            condition = {'ConditionExpression': 'Version = :version', 'ExpressionAttributeValues': {':version': version}}
+        try:
+            self.table.put_item(Item=item, **condition)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise (e)
+
+
+def get_coalesce_store(backend, location=None, window_seconds=DEFAULT_WINDOW_SECONDS):
+    # location: a file path for 'file' (optional), a table name for 'dynamodb' and
+    # s3://bucket[/prefix] for 's3'
+    if backend == 'memory':
+        return MemoryCoalesceStore()
+    if backend == 'file':
+        return FileCoalesceStore(location or '/tmp/alarm_coalescer.json')
+    if backend == 'dynamodb':
+        if not location:
+            raise ValueError('The dynamodb alarm coalesce store needs a table name as its location')
+        return DynamoDBCoalesceStore(location, window_seconds)
+    if backend == 's3':
+        bucket, _, prefix = (location or '').removeprefix('s3://').partition('/')
+        if not bucket:
+            raise ValueError('The s3 alarm coalesce store needs an s3://bucket[/prefix] location, got {!r}'.format(location))
+        return S3CoalesceStore(bucket, prefix)
+    raise ValueError('Unknown alarm coalesce store: {}'.format(backend))
+
+
+class AlarmCoalescer:
+
+    def __init__(self, store, window_seconds=DEFAULT_WINDOW_SECONDS, clock=time.time):
+        self.store = store
+        self.window_seconds = window_seconds
+        self.clock = clock
+
+    def _update(self, key, change):
+        # read, change and write back until no other invocation wrote in between
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            state, version = self.store.get(key)
+            new_state, result = change(state)
+            if new_state is state or self.store.put(key, new_state, version):
+                return result
+        raise RuntimeError('{} was changed concurrently {} times'.format(key, MAX_UPDATE_ATTEMPTS))
+
+    def join(self, key, alarm, owner):
+        # Records the alarm and returns True when this invocation owns the window and
+        # should run the diagnosis, False when the alarm was merged into a window whose
+        # owner has not sent its digest yet.
+        def change(state):
+            now = self.clock()
+            if state is None or state['SentCount'] is not None or now - state['OpenedAt'] >= self.window_seconds:
+                carried = []
+                if state is not None:
+                    # alarms not notified yet, all of them if the owner never completed
+                    carried = state['Carried'] + state['Alarms'][state['SentCount'] or 0:]
+                return {'OpenedAt': now, 'Owner': owner, 'Alarms': [alarm], 'Count': 1,
+                        'SentCount': None, 'Carried': carried[-MAX_ALARMS_PER_WINDOW:]}, True
+            state = dict(state, Count=state['Count'] + 1)
+            if len(state['Alarms']) < MAX_ALARMS_PER_WINDOW:
+                state['Alarms'] = state['Alarms'] + [alarm]
+            return state, False
+
+        try:
+            owned = self._update(key, change)
+        except (BotoCoreError, ClientError, RuntimeError) as e:
+            # a duplicate notification is better than a lost one
+            logger.info('Cannot coalesce alarm, handling it on its own: {}'.format(e))
+            return True
+        logger.info('Alarm {} window {}'.format('opened' if owned else 'merged into the open', key))
+        return owned
+
+    def complete(self, key, owner):
+        # Marks the digest of the owner's window as sent and returns what it covers:
+        # {'Alarms': carried over alarms followed by this window's, 'Count': number of
+        # alarms including the ones only counted}. Called when the owner sends, and also
+        # when its diagnosis ends early, so the alarms merged meanwhile are not left behind.
+        def change(state):
+            if state is None or state['Owner'] != owner or state['SentCount'] is not None:
+                return state, {'Alarms': [], 'Count': 0}
+            covered = {'Alarms': state['Carried'] + state['Alarms'], 'Count': len(state['Carried']) + state['Count']}
+            return dict(state, SentCount=len(state['Alarms']), Carried=[]), covered
+
+        try:
+            return self._update(key, change)
+        except (BotoCoreError, ClientError, RuntimeError) as e:
+            logger.info('Cannot complete coalesced window {}: {}'.format(key, e))
+            return {'Alarms': [], 'Count': 0}
@@ -0,0 +1,64 @@
+import threading
+
+# Process-wide registry of boto3 clients and resources. Each one is created on
+# first use and then reused by every later call and every warm invocation of
+# the container, instead of being rebuilt inside each helper. boto3 itself is
+# only imported when the first client is requested. Hooks added with
+# add_client_hook are applied to every client of the registry, including the
+# client behind each resource, whether it was created before or after.
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_hooks = []
+
+
+def _key(service, config_kwargs):
+    return (service, tuple(sorted((k, repr(v)) for k, v in config_kwargs.items())))
+
+
+def get_client(service, **config_kwargs):
+    # config_kwargs are botocore Config options, e.g. max_pool_connections=16
+    key = _key(service, config_kwargs)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                from botocore.config import Config
+                config = Config(**config_kwargs) if config_kwargs else None
+                client = boto3.client(service, config=config)
+                for hook in _hooks:
+                    hook(client)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service):
+    resource = _resources.get(service)
+    if resource is None:
+        with _lock:
+            resource = _resources.get(service)
+            if resource is None:
+                import boto3
+                resource = boto3.resource(service)
+                for hook in _hooks:
+                    hook(resource.meta.client)
+                _resources[service] = resource
+    return resource
+
+
+def add_client_hook(hook):
+    # hook(client) runs once per client; adding the same hook again does nothing
+    with _lock:
+        if hook in _hooks:
+            return
+        _hooks.append(hook)
+        for client in list(_clients.values()) + [resource.meta.client for resource in _resources.values()]:
+            hook(client)
+
+
+def clear():
+    with _lock:
+        _clients.clear()
+        _resources.clear()
@@ -0,0 +1,60 @@
+import datetime
+import json
+import sys
+
+# CloudWatch Embedded Metric Format allows at most 100 metrics per document
+MAX_METRICS_PER_DOCUMENT = 100
+
+
+def to_epoch_millis(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        return int(timestamp.timestamp() * 1000)
+    return int(timestamp)
+
+
+def format_emf_documents(namespace, metric_data):
+    # Takes the same datums as PutMetricData and groups them into EMF documents
+    # by dimension set and timestamp. Groups, metrics and JSON keys are sorted,
+    # so the same statistics always serialise to the same bytes.
+    groups = {}
+    for datum in metric_data:
+        dimensions = tuple((d['Name'], d['Value']) for d in datum.get('Dimensions', []))
+        key = (dimensions, to_epoch_millis(datum['Timestamp']))
+        groups.setdefault(key, {})[datum['MetricName']] = datum
+
+    documents = []
+    for (dimensions, timestamp) in sorted(groups.keys()):
+        datums = groups[(dimensions, timestamp)]
+        names = sorted(datums.keys())
+        for x in range(0, len(names), MAX_METRICS_PER_DOCUMENT):
+            chunk = names[x:(x + MAX_METRICS_PER_DOCUMENT)]
+            document = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [[name for name, _ in dimensions]],
+                        'Metrics': [{'Name': name, 'Unit': datums[name].get('Unit', 'None')} for name in chunk]
+                    }]
+                }
+            }
+            for name, value in dimensions:
+                document[name] = value
+            for name in chunk:
+                document[name] = datums[name]['Value']
+            documents.append(json.dumps(document, sort_keys=True, separators=(',', ':')))
+
+    return documents
+
+
+def emit_emf(namespace, metric_data, stream=None):
+    # Lambda ships every stdout line to CloudWatch Logs, which extracts the
+    # metrics asynchronously, so publishing costs no API calls.
+    stream = stream or sys.stdout
+    documents = format_emf_documents(namespace, metric_data)
+    for document in documents:
+        stream.write(document + '\n')
+    stream.flush()
+    return {'Documents': len(documents), 'Datums': len(metric_data)}
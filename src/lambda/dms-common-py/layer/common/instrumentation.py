@@ -0,0 +1,157 @@
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+import clients
+import emf
+
+# Records latency, retries, throttles and payload sizes of every AWS call made
+# through the clients registry, using botocore event hooks on each client, and
+# emits one summary per Lambda invocation. INSTRUMENTATION_MODE selects 'log'
+# (structured JSON line, the default), 'emf' (Embedded Metric Format) or 'off'.
+NAMESPACE = 'CustomMetrics/DMS/Lambda'
+THROTTLE_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                   'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'SlowDown')
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _operation(event_name):
+    # e.g. 'before-call.dms.DescribeReplicationTasks' -> 'dms.DescribeReplicationTasks'
+    return '.'.join(event_name.split('.')[1:3])
+
+
+def _record(operation, **values):
+    with _lock:
+        stats = _stats.setdefault(operation, {
+            'Calls': 0, 'Errors': 0, 'Retries': 0, 'Throttles': 0,
+            'TotalMs': 0.0, 'MaxMs': 0.0, 'RequestBytes': 0, 'ResponseBytes': 0
+        })
+        for key, value in values.items():
+            if key == 'MaxMs':
+                stats['MaxMs'] = max(stats['MaxMs'], value)
+            else:
+                stats[key] += value
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, bytearray, str)):
+        return len(body)
+    return 0
+
+
+def _before_call(event_name, context=None, **kwargs):
+    if context is not None:
+        context['instrumentation_start'] = time.perf_counter()
+
+
+def _before_send(event_name, request=None, **kwargs):
+    if request is not None:
+        _record(_operation(event_name), RequestBytes=_body_size(request.body))
+
+
+def _needs_retry(event_name, response=None, attempts=None, **kwargs):
+    if response is None or response[1] is None:
+        return None
+    code = response[1].get('Error', {}).get('Code')
+    if code in THROTTLE_ERRORS:
+        _record(_operation(event_name), Throttles=1)
+    return None
+
+
+def _after_call(event_name, http_response=None, parsed=None, context=None, **kwargs):
+    start = (context or {}).get('instrumentation_start')
+    elapsed_ms = (time.perf_counter() - start) * 1000 if start is not None else 0.0
+    retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    # Content-Length avoids reading streaming bodies such as S3 GetObject
+    response_bytes = 0
+    if http_response is not None:
+        response_bytes = int(http_response.headers.get('Content-Length', 0) or 0)
+    errors = 1 if 'Error' in (parsed or {}) else 0
+    _record(_operation(event_name), Calls=1, Errors=errors, Retries=retries, TotalMs=elapsed_ms, MaxMs=elapsed_ms,
+            ResponseBytes=response_bytes)
+
+
+def _after_call_error(event_name, exception=None, context=None, **kwargs):
+    start = (context or {}).get('instrumentation_start')
+    elapsed_ms = (time.perf_counter() - start) * 1000 if start is not None else 0.0
+    _record(_operation(event_name), Calls=1, Errors=1, TotalMs=elapsed_ms, MaxMs=elapsed_ms)
+
+
+def _register(events):
+    events.register('before-call', _before_call, unique_id='dms-instrumentation-before-call')
+    events.register('before-send', _before_send, unique_id='dms-instrumentation-before-send')
+    events.register('needs-retry', _needs_retry, unique_id='dms-instrumentation-needs-retry')
+    events.register('after-call', _after_call, unique_id='dms-instrumentation-after-call')
+    events.register('after-call-error', _after_call_error, unique_id='dms-instrumentation-after-call-error')
+
+
+def install():
+    # Hooks every client of the clients registry, those created before this call
+    # as well as later ones, so module-level clients are covered too
+    clients.add_client_hook(instrument_client)
+
+
+def instrument_client(client):
+    # For a client created outside the clients registry
+    _register(client.meta.events)
+    return client
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def summary():
+    with _lock:
+        operations = {}
+        for operation, stats in sorted(_stats.items()):
+            operations[operation] = dict(stats)
+            operations[operation]['AvgMs'] = round(stats['TotalMs'] / stats['Calls'], 3) if stats['Calls'] else 0.0
+            operations[operation]['TotalMs'] = round(stats['TotalMs'], 3)
+            operations[operation]['MaxMs'] = round(stats['MaxMs'], 3)
+        return operations
+
+
+def emit_summary(function_name=None, mode=None):
+    mode = mode or os.environ.get('INSTRUMENTATION_MODE', 'log')
+    function_name = function_name or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+    operations = summary()
+    if mode == 'off' or not operations:
+        return operations
+    if mode == 'emf':
+        timestamp = datetime.datetime.utcnow()
+        metric_data = []
+        for operation, stats in operations.items():
+            dimensions = [{'Name': 'FunctionName', 'Value': function_name}, {'Name': 'Operation', 'Value': operation}]
+            for name, unit in (('Calls', 'Count'), ('Errors', 'Count'), ('Retries', 'Count'), ('Throttles', 'Count'),
+                               ('AvgMs', 'Milliseconds'), ('MaxMs', 'Milliseconds'),
+                               ('RequestBytes', 'Bytes'), ('ResponseBytes', 'Bytes')):
+                metric_data.append({'MetricName': name, 'Dimensions': dimensions, 'Timestamp': timestamp,
+                                    'Value': stats[name], 'Unit': unit})
+        emf.emit_emf(NAMESPACE, metric_data)
+    else:
+        print(json.dumps({'AwsCallSummary': {'FunctionName': function_name, 'Operations': operations}},
+                         sort_keys=True))
+    return operations
+
+
+def instrumented(handler):
+    # Decorator for Lambda handlers: starts every invocation with empty stats
+    # and always emits the summary, including when the handler exits early.
+    # Hooks are installed on first invocation so importing stays cheap.
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        install()
+        reset()
+        try:
+            return handler(event, context)
+        finally:
+            emit_summary(getattr(context, 'function_name', None))
+    return wrapper
@@ -0,0 +1,143 @@
+import csv
+import io
+import logging
+import os
+import threading
+import time
+import clients
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# The issue resolution CSV (Issue_Resolution.csv) has one row per known issue with at
+# least the Issue_Type, Log_Filter_Pattern and Resolution columns. It is loaded once per
+# warm container and only downloaded again when its ETag changes.
+DEFAULT_REFRESH_SECONDS = 60
+
+
+class ResolutionIndex:
+    # Rows indexed by issue type and by log signature (the filter pattern). When several
+    # rows share a key the first one wins, as the former "LIMIT 1" S3 Select did.
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_type = {}
+        self.by_signature = {}
+        for row in rows:
+            self.by_type.setdefault(row.get('Issue_Type'), row)
+            if row.get('Log_Filter_Pattern'):
+                self.by_signature.setdefault(row['Log_Filter_Pattern'], row)
+
+    @classmethod
+    def from_csv(cls, body):
+        text = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+        return cls([dict(row) for row in csv.DictReader(io.StringIO(text))])
+
+    def treatment(self, issue_type):
+        return self.by_type.get(issue_type)
+
+    def treatments(self, issue_types):
+        return {issue_type: self.by_type[issue_type] for issue_type in issue_types if issue_type in self.by_type}
+
+    def for_signature(self, log_filter_pattern):
+        return self.by_signature.get(log_filter_pattern)
+
+    def signatures(self):
+        # {issue_type: Log_Filter_Pattern} of every issue type that has a pattern
+        return {issue_type: row['Log_Filter_Pattern'] for issue_type, row in self.by_type.items()
+                if row.get('Log_Filter_Pattern')}
+
+
+class S3Source:
+
+    def __init__(self, bucket, key, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client or clients.get_client('s3')
+
+    def fetch(self, etag=None):
+        # returns (body, etag), body is None when the object still has the given ETag
+        kwargs = {'Bucket': self.bucket, 'Key': self.key}
+        if etag:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            response = self.s3_client.get_object(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['304', 'NotModified']:
+                return None, etag
+            raise (e)
+        return response['Body'].read(), response['ETag']
+
+    def __repr__(self):
+        return 's3://{}/{}'.format(self.bucket, self.key)
+
+
+class FileSource:
+    # Local file backend for tests and local runs; the modification time stands in for the ETag
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, etag=None):
+        version = str(os.stat(self.path).st_mtime_ns)
+        if version == etag:
+            return None, etag
+        with open(self.path, 'rb') as f:
+            return f.read(), version
+
+    def __repr__(self):
+        return self.path
+
+
+class KnowledgeBase:
+
+    def __init__(self, source, refresh_seconds=DEFAULT_REFRESH_SECONDS, clock=time.monotonic):
+        self.source = source
+        self.refresh_seconds = refresh_seconds
+        self.clock = clock
+        self.etag = None
+        self.checked = None
+        self.current = None
+        self.lock = threading.Lock()
+
+    def index(self):
+        # the source is checked at most every refresh_seconds; a check that finds the
+        # same ETag costs a conditional GET without a body
+        with self.lock:
+            now = self.clock()
+            if self.current is None or now - self.checked >= self.refresh_seconds:
+                body, etag = self.source.fetch(self.etag)
+                if body is not None:
+                    self.current = ResolutionIndex.from_csv(body)
+                    self.etag = etag
+                    logger.info('Loaded {} issue resolutions from {} ({})'.format(len(self.current.rows), self.source, etag))
+                self.checked = now
+            return self.current
+
+    def treatment(self, issue_type):
+        return self.index().treatment(issue_type)
+
+    def treatments(self, issue_types):
+        return self.index().treatments(issue_types)
+
+    def signatures(self):
+        return self.index().signatures()
+
+
+# Module-level state keeps the loaded index warm across invocations of one container
+_knowledge_bases = {}
+_lock = threading.Lock()
+
+
+def get_knowledge_base(bucket=None, key=None, path=None, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+    # path selects the local file backend, otherwise the CSV is read from s3://bucket/key
+    location = ('file', path) if path else ('s3', bucket, key)
+    with _lock:
+        if location not in _knowledge_bases:
+            source = FileSource(path) if path else S3Source(bucket, key)
+            _knowledge_bases[location] = KnowledgeBase(source, refresh_seconds)
+        return _knowledge_bases[location]
+
+
+def clear():
+    with _lock:
+        _knowledge_bases.clear()
@@ -0,0 +1,120 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Task ARNs per DescribeReplicationTasks call. The replication-task-arn filter takes a
+# list of values; results are paged, so a batch never needs more than one or two pages.
+TASKS_PER_REQUEST = 20
+DEFAULT_TTL_SECONDS = 300
+
+
+class LobProfile:
+    # The LOB related part of a task's settings and table mappings. Built once from the
+    # DescribeReplicationTasks response so the multi-KB JSON documents are not kept around.
+    def __init__(self, task_arn, support_lobs=False, limited_size_lob_mode=False, full_lob_mode=False,
+                 lob_max_size=0, table_mapping_rule=None, table_mapping_max_size=None):
+        self.task_arn = task_arn
+        self.support_lobs = support_lobs
+        self.limited_size_lob_mode = limited_size_lob_mode
+        self.full_lob_mode = full_lob_mode
+        self.lob_max_size = lob_max_size
+        # the last table mapping rule limiting the LOB size, which is the one DMS applies
+        self.table_mapping_rule = table_mapping_rule
+        self.table_mapping_max_size = table_mapping_max_size
+
+    @classmethod
+    def from_task(cls, task):
+        target = json.loads(task.get('ReplicationTaskSettings') or '{}').get('TargetMetadata', {})
+        profile = cls(task['ReplicationTaskArn'],
+                      support_lobs=target.get('SupportLobs') is True,
+                      limited_size_lob_mode=target.get('LimitedSizeLobMode') is True,
+                      full_lob_mode=target.get('FullLobMode') is True,
+                      lob_max_size=target.get('LobMaxSize', 0))
+        for rule in json.loads(task.get('TableMappings') or '{}').get('rules', []):
+            lob_settings = rule.get('lob-settings', {})
+            if 'bulk-max-size' in lob_settings and lob_settings.get('mode', 'limited') == 'limited':
+                profile.table_mapping_rule = rule
+                profile.table_mapping_max_size = int(lob_settings['bulk-max-size'])
+        return profile
+
+    @property
+    def task_lob_max_size(self):
+        # LobMaxSize only applies in limited LOB mode
+        if self.support_lobs and self.limited_size_lob_mode:
+            return self.lob_max_size
+        return 0
+
+    @property
+    def less_max_lob_in_table_mapping(self):
+        # table mappings override the task setting; flag a smaller limit set there
+        return self.table_mapping_max_size is not None and self.table_mapping_max_size < self.task_lob_max_size
+
+
+class LobProfileCache:
+    # Profiles by task ARN with a time to live. Module-level state keeps it warm across
+    # invocations of one container, so an alarm storm re-reads the settings at most once
+    # per TTL.
+    _entries = {}
+    _lock = threading.Lock()
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+
+    def get(self, task_arns):
+        now = self.clock()
+        with self._lock:
+            return {arn: self._entries[arn][1] for arn in task_arns
+                    if arn in self._entries and self._entries[arn][0] > now}
+
+    def put(self, profiles):
+        expires = self.clock() + self.ttl
+        with self._lock:
+            self._entries.update({arn: (expires, profile) for arn, profile in profiles.items()})
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+
+def describe_tasks(dms_client, task_arns):
+    tasks = []
+    paginator = dms_client.get_paginator('describe_replication_tasks')
+    try:
+        for page in paginator.paginate(Filters=[{'Name': 'replication-task-arn', 'Values': task_arns}],
+                                       WithoutSettings=False):
+            tasks.extend(page['ReplicationTasks'])
+    except ClientError as e:
+        # raised when none of the tasks exist any more
+        if e.response['Error']['Code'] != 'ResourceNotFoundFault':
+            raise (e)
+    return tasks
+
+
+def fetch_lob_profiles(dms_client, task_arns, cache=None, batch_size=TASKS_PER_REQUEST, max_workers=4):
+    # Returns {task ARN: LobProfile}. ARNs missing from the cache are described in
+    # batches of batch_size, concurrently. Tasks that no longer exist are left out and
+    # cached as missing, so they are not described again on every alarm.
+    cache = cache if cache is not None else LobProfileCache()
+    task_arns = list(dict.fromkeys(task_arns))
+    profiles = cache.get(task_arns)
+    missing = [arn for arn in task_arns if arn not in profiles]
+    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            fetched = dict.fromkeys(missing)
+            for tasks in executor.map(lambda batch: describe_tasks(dms_client, batch), batches):
+                for task in tasks:
+                    fetched[task['ReplicationTaskArn']] = LobProfile.from_task(task)
+        cache.put(fetched)
+        profiles.update(fetched)
+    profiles = {arn: profile for arn, profile in profiles.items() if profile is not None}
+    logger.info('LOB profiles: {} cached, {} described in {} calls'.format(
+        len(task_arns) - len(missing), len(missing), len(batches)))
+    return profiles
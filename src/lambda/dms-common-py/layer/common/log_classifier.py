@@ -0,0 +1,105 @@
+import threading
+import log_scanner
+
+# Classifies DMS task log events into issue types in one pass. Every issue type has a
+# term based filter pattern (Log_Filter_Pattern in the issue resolution CSV). The terms of
+# all patterns are merged into one de-duplicated term list with an index from each term
+# to the issue types using it: a message is searched once for every distinct term, and
+# only the issue types of the terms found are evaluated. Terms match as case sensitive
+# substrings of the message.
+#
+# A single regex alternation was measured slower than this: CPython's re has no multi
+# literal search and tries the alternation at every position, while `term in message`
+# runs a fast substring search per term (see scripts/log_classifier_benchmark.py).
+
+
+class LogClassifier:
+
+    def __init__(self, signatures):
+        # signatures: {issue_type: filter pattern}. Patterns that are not term based
+        # (JSON or space delimited) cannot be evaluated here and are skipped.
+        self.signatures = {}
+        self.skipped = []
+        for issue_type, filter_pattern in signatures.items():
+            terms = log_scanner.filter_terms(filter_pattern)
+            if terms is None or not any(terms):
+                self.skipped.append(issue_type)
+                continue
+            self.signatures[issue_type] = tuple(frozenset(group) for group in terms)
+        self.issue_types = list(self.signatures)
+
+        self.by_term = {}
+        # issue types made only of excluded terms match messages without any of the terms
+        self.unanchored = []
+        for issue_type, (required, optional, excluded) in self.signatures.items():
+            for term in required | optional | excluded:
+                self.by_term.setdefault(term, []).append(issue_type)
+            if not required and not optional:
+                self.unanchored.append(issue_type)
+        self.terms = tuple(self.by_term)
+        if len(self.signatures) == 1:
+            # a single issue type is filtered by its own pattern, which returns exactly its events
+            self.filter_pattern = signatures[self.issue_types[0]]
+        else:
+            self.filter_pattern = self._union_filter_pattern()
+        # reading only the first event per stream is safe when every event returned is an
+        # event of the one issue type. The union of several signatures can return events the
+        # classifier rejects (it drops excluded terms and all but one required term), and even
+        # an exact union lets one type's first event in a stream hide another type's event,
+        # so all events are read then.
+        self.first_per_stream = len(self.signatures) == 1
+
+    def _union_filter_pattern(self):
+        # one FilterLogEvents pattern returning every event any signature can match: each
+        # matching event holds all required terms of its signature, so the longest one
+        # stands for them, or else one of its optional terms. A signature made only of
+        # excluded terms matches nearly anything, so there is no filter at all then.
+        alternatives = []
+        for required, optional, _ in self.signatures.values():
+            if not required and not optional:
+                return ''
+            alternatives.extend([max(sorted(required), key=len)] if required else sorted(optional))
+        return ' '.join('?"{}"'.format(term.replace('\\', '\\\\').replace('"', '\\"'))
+                        for term in dict.fromkeys(alternatives))
+
+    def terms_in(self, message):
+        return {term for term in self.terms if term in message}
+
+    def classify_message(self, message):
+        found = self.terms_in(message)
+        if not found and not self.unanchored:
+            return []
+        candidates = set(self.unanchored)
+        for term in found:
+            candidates.update(self.by_term[term])
+        return [issue_type for issue_type in self.issue_types if issue_type in candidates
+                and self._matches(self.signatures[issue_type], found)]
+
+    @staticmethod
+    def _matches(signature, found):
+        required, optional, excluded = signature
+        return required <= found and not (excluded & found) and (not optional or bool(optional & found))
+
+    def classify(self, events):
+        # {issue_type: [events]}, keeping the order of the events; an event matching
+        # several signatures is listed under each of them
+        issues = {}
+        for event in events:
+            for issue_type in self.classify_message(event['message']):
+                issues.setdefault(issue_type, []).append(event)
+        return issues
+
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def compile_signatures(signatures):
+    # classifiers are cached by their signatures, so a warm container compiles the
+    # knowledge base once until the resolution CSV changes
+    key = tuple(sorted(signatures.items()))
+    with _lock:
+        if key not in _compiled:
+            _compiled.clear()
+            _compiled[key] = LogClassifier(signatures)
+        return _compiled[key]
@@ -0,0 +1,284 @@
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# FilterLogEvents accepts at most 100 stream names per request.
+MAX_STREAMS_PER_REQUEST = 100
+
+BACKEND_AUTO = 'auto'
+BACKEND_SCAN = 'scan'
+BACKEND_INSIGHTS = 'insights'
+# windows or stream counts from which a Logs Insights aggregation is cheaper than paging
+# through every matching event with FilterLogEvents
+INSIGHTS_MIN_WINDOW_MINUTES = 60
+INSIGHTS_MIN_STREAMS = 50
+INSIGHTS_POLL_SECONDS = 1
+INSIGHTS_DONE_STATES = ('Complete', 'Failed', 'Cancelled', 'Timeout', 'Unknown')
+
+
+def split_window(start_ms, end_ms, slices):
+    # contiguous sub-ranges covering the window. FilterLogEvents treats both ends as
+    # inclusive, so an event on a boundary may be read twice and is de-duplicated later
+    slices = max(1, min(slices, end_ms - start_ms))
+    step = (end_ms - start_ms) / slices
+    bounds = [start_ms + int(round(step * i)) for i in range(slices)] + [end_ms]
+    return [(bounds[i], bounds[i + 1]) for i in range(slices) if bounds[i] < bounds[i + 1]]
+
+
+def group_streams(streams, groups):
+    # spread the streams over at most `groups` groups of at most 100 names each
+    if not streams:
+        return []
+    size = min(MAX_STREAMS_PER_REQUEST, max(1, -(-len(streams) // max(1, groups))))
+    return [streams[i:i + size] for i in range(0, len(streams), size)]
+
+
+def list_active_streams(logs_client, log_group, stream_prefix, start_ms, end_ms):
+    # streams that may hold events inside the window. lastIngestionTime is used rather
+    # than lastEventTimestamp, which CloudWatch Logs only updates eventually.
+    streams = []
+    kwargs = {'logGroupName': log_group}
+    if stream_prefix:
+        kwargs['logStreamNamePrefix'] = stream_prefix
+    for page in logs_client.get_paginator('describe_log_streams').paginate(**kwargs):
+        for stream in page['logStreams']:
+            if stream.get('firstEventTimestamp', 0) <= end_ms and stream.get('lastIngestionTime', end_ms) >= start_ms:
+                streams.append(stream['logStreamName'])
+    return streams
+
+
+class LogScan:
+    # Shared state of one scan: de-duplicated events, the first example per stream
+    # and the early stop / time budget checks used by every worker.
+    def __init__(self, deadline=None, clock=time.monotonic):
+        self.events = {}
+        self.examples = {}
+        self.deadline = deadline
+        self.clock = clock
+        self.pages = 0
+        self.out_of_time = False
+        self.lock = threading.Lock()
+
+    def add(self, events):
+        with self.lock:
+            self.pages += 1
+            for event in events:
+                key = event.get('eventId') or (event['logStreamName'], event['timestamp'], event['message'])
+                self.events.setdefault(key, event)
+                self.examples.setdefault(event['logStreamName'], event)
+
+    def without_examples(self, streams):
+        with self.lock:
+            return [stream for stream in streams if stream not in self.examples]
+
+    def expired(self):
+        if self.deadline is not None and self.clock() >= self.deadline:
+            self.out_of_time = True
+        return self.out_of_time
+
+    def sorted_events(self):
+        return sorted(self.events.values(), key=lambda e: (e['timestamp'], e['logStreamName'], e.get('eventId', '')))
+
+
+def scan_range(logs_client, scan, log_group, start_ms, end_ms, filter_pattern, streams=None, stream_prefix=None,
+               first_per_stream=True):
+    # One work item: a time range, optionally restricted to a group of streams, read page
+    # by page until nextToken runs out. With first_per_stream, streams that got an example
+    # are dropped from the request, restarting it without them; that is safe because the
+    # remaining streams have had no matching event so far. The item is then done once
+    # every stream has an example.
+    kwargs = {'logGroupName': log_group, 'startTime': start_ms, 'endTime': end_ms, 'filterPattern': filter_pattern}
+    if streams:
+        kwargs['logStreamNames'] = streams
+    elif stream_prefix:
+        kwargs['logStreamNamePrefix'] = stream_prefix
+    while True:
+        if scan.expired():
+            return
+        response = logs_client.filter_log_events(**kwargs)
+        scan.add(response.get('events', []))
+        if 'nextToken' not in response:
+            return
+        if streams and first_per_stream:
+            remaining = scan.without_examples(kwargs['logStreamNames'])
+            if not remaining:
+                return
+            if len(remaining) < len(kwargs['logStreamNames']):
+                kwargs['logStreamNames'] = remaining
+                kwargs.pop('nextToken', None)
+                continue
+        kwargs['nextToken'] = response['nextToken']
+
+
+def scan_log_events(logs_client, log_group, start_ms, end_ms, filter_pattern='', stream_prefix=None,
+                    slices=4, max_workers=8, streams=None, time_budget=None, first_per_stream=True):
+    # Scans start_ms..end_ms of a log group concurrently and returns the events in the
+    # shape of a filter_log_events response, {'events': [...]}, sorted by time, plus a
+    # 'scan' summary. The window is split into `slices` sub-ranges; when the streams
+    # active in the window are known (listed with DescribeLogStreams unless given) the
+    # work is also split by stream group, and a group stops paging once each of its
+    # streams has an example unless first_per_stream is False, which reads every
+    # matching event. time_budget (seconds) bounds the whole scan.
+    if streams is None:
+        try:
+            streams = list_active_streams(logs_client, log_group, stream_prefix, start_ms, end_ms)
+        except ClientError as e:
+            # without DescribeLogStreams the scan falls back to the stream prefix
+            logger.info('Cannot list log streams of {}, scanning by prefix: {}'.format(log_group, e))
+            streams = None
+    if streams == []:
+        return {'events': [], 'scan': {'Streams': 0, 'StreamsWithEvents': 0, 'WorkItems': 0, 'Pages': 0, 'Complete': True}}
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    scan = LogScan(deadline)
+    ranges = split_window(start_ms, end_ms, slices)
+    groups = group_streams(streams, max(1, max_workers // len(ranges))) if streams else [None]
+    work = [(start, end, group) for group in groups for (start, end) in ranges]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(work)))) as executor:
+        futures = [executor.submit(scan_range, logs_client, scan, log_group, start, end, filter_pattern, group, stream_prefix,
+                                   first_per_stream)
+                   for (start, end, group) in work]
+        for future in futures:
+            future.result()
+
+    summary = {
+        'Streams': len(streams) if streams is not None else None,
+        'StreamsWithEvents': len(scan.examples),
+        'WorkItems': len(work),
+        'Pages': scan.pages,
+        'Complete': not scan.out_of_time,
+    }
+    logger.info('Scanned {}: {}'.format(log_group, summary))
+    return {'events': scan.sorted_events(), 'scan': summary}
+
+
+def choose_backend(start_ms, end_ms, stream_count, backend=BACKEND_AUTO):
+    if backend != BACKEND_AUTO:
+        return backend
+    if (end_ms - start_ms) >= INSIGHTS_MIN_WINDOW_MINUTES * 60000 or (stream_count or 0) >= INSIGHTS_MIN_STREAMS:
+        return BACKEND_INSIGHTS
+    return BACKEND_SCAN
+
+
+def filter_terms(filter_pattern):
+    # Splits a term based filter pattern such as '?"W:  Truncation" ?truncated ?trimmed'
+    # into (required, optional, excluded) terms: terms prefixed with ? are alternatives,
+    # - excludes a term and the others are all required. JSON and space delimited
+    # patterns are not term based and return None.
+    pattern = (filter_pattern or '').strip()
+    if pattern[:1] in ('{', '['):
+        return None
+    required, optional, excluded = [], [], []
+    for prefix, quoted, bare in re.findall(r'([?-]?)(?:"((?:[^"\\]|\\.)*)"|(\S+))', pattern):
+        term = re.sub(r'\\(.)', r'\1', quoted) if quoted else bare
+        {'?': optional, '-': excluded}.get(prefix, required).append(term)
+    return required, optional, excluded
+
+
+def insights_filter(filter_pattern):
+    # Translates a term based filter pattern into a Logs Insights condition, None when
+    # the pattern is not term based.
+    terms = filter_terms(filter_pattern)
+    if terms is None:
+        return None
+    required, optional, excluded = [
+        ['@message like "{}"'.format(term.replace('\\', '\\\\').replace('"', '\\"')) for term in group] for group in terms]
+    conditions = required + ['not ' + c for c in excluded]
+    if optional:
+        conditions.append('(' + ' or '.join(optional) + ')')
+    return ' and '.join(conditions) or 'ispresent(@message)'
+
+
+def parse_insights_timestamp(value):
+    return int(datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def query_log_events(logs_client, log_group, start_ms, end_ms, filter_pattern='', stream_prefix=None,
+                     time_budget=None, sleep=time.sleep, clock=time.monotonic, first_per_stream=True):
+    # Runs one Logs Insights aggregation returning the first matching event of every
+    # stream, or the matching events themselves (up to the 10000 row query limit) when
+    # first_per_stream is False, in the same {'events': [...]} shape as scan_log_events.
+    # Returns None when the pattern cannot be translated or the query does not complete
+    # in time.
+    condition = insights_filter(filter_pattern)
+    if condition is None:
+        return None
+    if stream_prefix:
+        condition = '@logStream like /^{}/ and {}'.format(re.escape(stream_prefix), condition)
+    if first_per_stream:
+        query = ('fields @timestamp, @message, @logStream\n| filter {}\n'
+                 '| stats earliest(@timestamp) as firstSeen, earliest(@message) as message, count(*) as matches by @logStream'
+                 .format(condition))
+    else:
+        query = 'fields @timestamp, @message, @logStream\n| filter {}\n| sort @timestamp asc'.format(condition)
+    query_id = logs_client.start_query(logGroupName=log_group, startTime=start_ms // 1000,
+                                       endTime=-(-end_ms // 1000), queryString=query, limit=10000)['queryId']
+    deadline = clock() + time_budget if time_budget else None
+    while True:
+        response = logs_client.get_query_results(queryId=query_id)
+        if response['status'] in INSIGHTS_DONE_STATES:
+            break
+        if deadline is not None and clock() >= deadline:
+            logs_client.stop_query(queryId=query_id)
+            logger.info('Logs Insights query {} did not complete in {} s'.format(query_id, time_budget))
+            return None
+        sleep(INSIGHTS_POLL_SECONDS)
+    if response['status'] != 'Complete':
+        logger.info('Logs Insights query {} ended as {}'.format(query_id, response['status']))
+        return None
+
+    events = []
+    for row in response['results']:
+        fields = {field['field']: field['value'] for field in row}
+        event = {'logStreamName': fields['@logStream'],
+                 'timestamp': parse_insights_timestamp(fields.get('firstSeen') or fields['@timestamp']),
+                 'message': fields.get('message', fields.get('@message'))}
+        if 'matches' in fields:
+            event['matches'] = int(fields['matches'])
+        events.append(event)
+    events.sort(key=lambda e: (e['timestamp'], e['logStreamName']))
+    summary = {'Backend': BACKEND_INSIGHTS, 'StreamsWithEvents': len({e['logStreamName'] for e in events}),
+               'RecordsScanned': response.get('statistics', {}).get('recordsScanned'), 'Complete': True}
+    logger.info('Queried {}: {}'.format(log_group, summary))
+    return {'events': events, 'scan': summary}
+
+
+def find_log_events(logs_client, log_group, start_ms, end_ms, filter_pattern='', stream_prefix=None,
+                    backend=BACKEND_AUTO, slices=4, max_workers=8, time_budget=None, first_per_stream=True):
+    # Picks the Logs Insights backend for wide windows or many active streams and the
+    # FilterLogEvents scan otherwise; falls back to the scan when the query cannot be run.
+    try:
+        streams = list_active_streams(logs_client, log_group, stream_prefix, start_ms, end_ms)
+    except ClientError as e:
+        logger.info('Cannot list log streams of {}: {}'.format(log_group, e))
+        streams = None
+    if streams == []:
+        return {'events': [], 'scan': {'Backend': None, 'Streams': 0, 'StreamsWithEvents': 0, 'Complete': True}}
+
+    chosen = choose_backend(start_ms, end_ms, len(streams) if streams is not None else None, backend)
+    logger.info('Log backend for {}: {} ({} streams, {} minutes)'.format(
+        log_group, chosen, len(streams) if streams is not None else 'unknown', (end_ms - start_ms) // 60000))
+    if chosen == BACKEND_INSIGHTS:
+        started = time.monotonic()
+        try:
+            result = query_log_events(logs_client, log_group, start_ms, end_ms, filter_pattern, stream_prefix, time_budget,
+                                      first_per_stream=first_per_stream)
+        except ClientError as e:
+            logger.info('Logs Insights query failed, scanning instead: {}'.format(e))
+            result = None
+        if result is not None:
+            return result
+        if time_budget:
+            time_budget = max(1, time_budget - (time.monotonic() - started))
+
+    result = scan_log_events(logs_client, log_group, start_ms, end_ms, filter_pattern, stream_prefix,
+                             slices, max_workers, streams if streams is not None else None, time_budget, first_per_stream)
+    result['scan']['Backend'] = BACKEND_SCAN
+    return result
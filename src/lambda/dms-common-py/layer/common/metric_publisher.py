@@ -0,0 +1,121 @@
+import datetime
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# PutMetricData limits: 1000 datums and 1 MB of payload per request. The
+# payload size is estimated from the form encoded body of the query protocol,
+# the largest of the protocols botocore may use for CloudWatch: it repeats the
+# full MetricData.member.N.* parameter name before every value and is about
+# twice the JSON encoding of a datum. The margin covers the Action, Version
+# and Namespace parameters.
+MAX_DATUMS_PER_REQUEST = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+REQUEST_BYTES_MARGIN = 0.9
+
+RETRYABLE_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                    'TooManyRequestsException', 'InternalServiceError', 'ServiceUnavailable')
+
+
+def query_parameters(value, prefix):
+    # flattens a value into query protocol parameters: structure members are joined
+    # with '.', list items are numbered prefix.member.1, prefix.member.2, ...
+    if isinstance(value, dict):
+        for name, item in value.items():
+            yield from query_parameters(item, '{}.{}'.format(prefix, name))
+    elif isinstance(value, (list, tuple)):
+        for index, item in enumerate(value, 1):
+            yield from query_parameters(item, '{}.member.{}'.format(prefix, index))
+    elif isinstance(value, datetime.datetime):
+        yield prefix, value.isoformat()
+    else:
+        yield prefix, value
+
+
+def estimate_datum_size(datum):
+    # bytes the datum adds to the form encoded request body, with the widest member
+    # number a request can have and the '&' joining it to the previous parameter
+    prefix = 'MetricData.member.{}'.format(MAX_DATUMS_PER_REQUEST)
+    return len(urlencode(list(query_parameters(datum, prefix)))) + 1
+
+
+def pack_metric_data(metric_data, max_datums=MAX_DATUMS_PER_REQUEST, max_bytes=MAX_REQUEST_BYTES):
+    byte_budget = int(max_bytes * REQUEST_BYTES_MARGIN)
+    batches = []
+    batch = []
+    batch_bytes = 0
+
+    for datum in metric_data:
+        datum_bytes = estimate_datum_size(datum)
+        if batch and (len(batch) >= max_datums or batch_bytes + datum_bytes > byte_budget):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(datum)
+        batch_bytes += datum_bytes
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # full jitter: uniform between 0 and the capped exponential delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def put_metric_batch(cw_client, namespace, batch, batch_id, max_attempts=5, base_delay=0.2, max_delay=5.0, sleep=time.sleep):
+    report = {'Batch': batch_id, 'Datums': len(batch), 'Attempts': 0, 'Status': 'FAILED'}
+
+    for attempt in range(max_attempts):
+        report['Attempts'] = attempt + 1
+        try:
+            cw_client.put_metric_data(Namespace=namespace, MetricData=batch)
+            report['Status'] = 'SUCCESS'
+            report.pop('Error', None)
+            return report
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code', '')
+            report['Error'] = '{}: {}'.format(code, str(e))
+            if code not in RETRYABLE_ERRORS:
+                break
+            if attempt < max_attempts - 1:
+                sleep(backoff_delay(attempt, base_delay, max_delay))
+        except Exception as e:
+            report['Error'] = str(e)
+            break
+
+    logger.error('PutMetricData batch {} failed after {} attempts: {}'.format(
+        batch_id, report['Attempts'], report.get('Error')))
+    return report
+
+
+def publish_metric_data(cw_client, namespace, metric_data, max_workers=4, max_attempts=5):
+    # A failed batch does not stop the others; the returned report lists the
+    # outcome of every batch along with succeeded / failed datum totals.
+    batches = pack_metric_data(metric_data)
+    report = {'Batches': [], 'SucceededDatums': 0, 'FailedDatums': 0}
+
+    if not batches:
+        return report
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = [executor.submit(put_metric_batch, cw_client, namespace, batch, batch_id, max_attempts)
+                   for batch_id, batch in enumerate(batches)]
+        for future in futures:
+            batch_report = future.result()
+            report['Batches'].append(batch_report)
+            if batch_report['Status'] == 'SUCCESS':
+                report['SucceededDatums'] += batch_report['Datums']
+            else:
+                report['FailedDatums'] += batch_report['Datums']
+
+    logger.info('Published {} datums to {} in {} batches ({} datums failed)'.format(
+        report['SucceededDatums'], namespace, len(batches), report['FailedDatums']))
+    return report
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import time
+import clients
+import metric_publisher
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Remembers the last published value of every (dimensions, metric) pair so
+# that publishers can skip datums whose value has not changed. A datum is
+# still re-sent once its last publish is older than the heartbeat, so alarms
+# and dashboards never see the metric go missing.
+DEFAULT_HEARTBEAT_SECONDS = 3600
+
+
+def metric_key(datum):
+    dimensions = '|'.join('{}={}'.format(d['Name'], d['Value']) for d in datum.get('Dimensions', []))
+    return '{}|{}'.format(dimensions, datum['MetricName'])
+
+
+class MemoryStateStore:
+    # Module-level state keeps it warm across invocations of one container
+    _state = {}
+
+    def load(self, keys):
+        return {key: self._state[key] for key in keys if key in self._state}
+
+    def save(self, entries):
+        self._state.update(entries)
+
+
+class FileStateStore:
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def load(self, keys):
+        state = self._read()
+        return {key: state[key] for key in keys if key in state}
+
+    def save(self, entries):
+        state = self._read()
+        state.update(entries)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class S3StateStore:
+    # The whole state is a single JSON object, read and written once per run
+
+    def __init__(self, bucket, key, s3_client=None):
+        self.bucket = bucket
+        self.key = key
+        self.s3_client = s3_client or clients.get_client('s3')
+
+    def _read(self):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+            return json.loads(response['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['NoSuchKey', '404']:
+                return {}
+            raise (e)
+
+    def load(self, keys):
+        state = self._read()
+        return {key: state[key] for key in keys if key in state}
+
+    def save(self, entries):
+        state = self._read()
+        state.update(entries)
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key,
+                                  Body=json.dumps(state, sort_keys=True).encode('utf-8'))
+
+
+class DynamoDBStateStore:
+    # One item per metric key; the table needs a string partition key 'MetricKey'
+
+    BATCH_GET_SIZE = 100
+    # BatchGetItem returns UnprocessedKeys when the table throttles; they are asked for
+    # again with jittered backoff, and treated as unknown (so republished) if they stay
+    # unprocessed
+    MAX_BATCH_GET_ATTEMPTS = 6
+    BASE_DELAY = 0.1
+    MAX_DELAY = 2.0
+
+    def __init__(self, table_name, dynamodb_resource=None, sleep=time.sleep):
+        self.table_name = table_name
+        self.dynamodb = dynamodb_resource or clients.get_resource('dynamodb')
+        self.table = self.dynamodb.Table(table_name)
+        self.sleep = sleep
+
+    def load(self, keys):
+        keys = list(keys)
+        state = {}
+        for x in range(0, len(keys), self.BATCH_GET_SIZE):
+            request = {self.table_name: {'Keys': [{'MetricKey': key} for key in keys[x:(x + self.BATCH_GET_SIZE)]]}}
+            for attempt in range(self.MAX_BATCH_GET_ATTEMPTS):
+                if attempt:
+                    self.sleep(metric_publisher.backoff_delay(attempt - 1, self.BASE_DELAY, self.MAX_DELAY))
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    state[item['MetricKey']] = {'Value': float(item['Value']), 'PublishedAt': float(item['PublishedAt'])}
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+            else:
+                logger.info('{} metric keys still unprocessed after {} attempts, publishing them'.format(
+                    len(request[self.table_name]['Keys']), self.MAX_BATCH_GET_ATTEMPTS))
+        return state
+
+    def save(self, entries):
+        with self.table.batch_writer(overwrite_by_pkeys=['MetricKey']) as batch:
+            for key, entry in entries.items():
+                batch.put_item(Item={'MetricKey': key, 'Value': str(entry['Value']), 'PublishedAt': str(entry['PublishedAt'])})
+
+
+def get_state_store(backend, location=None):
+    # location: a file path for 'file' (optional), a table name for 'dynamodb' and
+    # s3://bucket[/key] for 's3'
+    if backend == 'memory':
+        return MemoryStateStore()
+    if backend == 'file':
+        return FileStateStore(location or '/tmp/metric_state.json')
+    if backend == 'dynamodb':
+        if not location:
+            raise ValueError('The dynamodb metric state store needs a table name as its location')
+        return DynamoDBStateStore(location)
+    if backend == 's3':
+        bucket, _, key = (location or '').removeprefix('s3://').partition('/')
+        if not bucket:
+            raise ValueError('The s3 metric state store needs an s3://bucket[/key] location, got {!r}'.format(location))
+        return S3StateStore(bucket, key or 'metric_state.json')
+    raise ValueError('Unknown metric state store: {}'.format(backend))
+
+
+def filter_changed(metric_data, store, heartbeat_seconds=DEFAULT_HEARTBEAT_SECONDS, now=None):
+    # Returns the datums to publish and the state entries to save once they
+    # have been published successfully.
+    now = time.time() if now is None else now
+    keyed = [(metric_key(datum), datum) for datum in metric_data]
+    previous = store.load(set(key for key, _ in keyed))
+
+    changed = []
+    entries = {}
+    for key, datum in keyed:
+        last = previous.get(key)
+        if last is None or float(last['Value']) != float(datum['Value']) or now - last['PublishedAt'] >= heartbeat_seconds:
+            changed.append(datum)
+            entries[key] = {'Value': float(datum['Value']), 'PublishedAt': now}
+
+    return (changed, entries)
@@ -0,0 +1,176 @@
+import json
+import logging
+import clients
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# SNS rejects messages over 256 KB and subjects over 100 characters. The message budget
+# leaves room for the subject and the message attributes SNS counts in the same limit.
+SNS_MAX_MESSAGE_BYTES = 256 * 1024
+SNS_MAX_SUBJECT_CHARS = 100
+DEFAULT_BUDGET_BYTES = SNS_MAX_MESSAGE_BYTES - 4 * 1024
+MAX_EXAMPLE_BYTES = 1024
+MAX_TASK_BYTES = 4 * 1024
+MAX_DIGEST_BYTES = 8 * 1024
+# share of the space left after the fixed sections that log examples may use, so task
+# sections are not crowded out by hundreds of examples
+EXAMPLES_SHARE = 0.5
+TRUNCATED = '... (truncated)'
+
+HEAD_TEMPLATE = ('You are receiving this email because your Amazon CloudWatch Alarm "{alarm_name}" in the {alarm_region} '
+                 'region has entered the {alarm_state} state, because "{alarm_reason}" at {alarm_timestamp}.\n'
+                 '\nView DMS tasks associated with this alarm in the AWS Management Console: \n'
+                 'https://{alarm_region}.console.aws.amazon.com/dms/v2/home?region={alarm_region}#replicationInstanceDetails/{ri_name}\n')
+TASK_TEMPLATE = '\nTask ARN: {task_arn}:\nIf LOB is enabled for task: {SupportLobs}\n'
+TASK_LOB_TEMPLATE = 'If LimitedSizeLobMode is used: {LimitedSizeLobMode}\nLobMaxSize used: {LobMaxSize} KB\n'
+TASK_MAPPING_TEMPLATE = 'Individual LOB setting in table mapping rules:\n{rule}\n'
+TASK_LESS_MAX_LOB = ('Note: If both task setting and table mapping specified, table mapping overrides tasks setting. '
+                     'Note that the max LOB is smaller than the LobMaxSize in task setting, to which LOB is truncated to.\n')
+OMITTED_TEMPLATE = '\n{tasks} more tasks and {examples} more log examples are not shown in this notification.\n'
+REPORT_TEMPLATE = '\nFull report: {link}\n'
+DIGEST_TEMPLATE = '\nThis notification covers {count} alarms for this replication instance:\n'
+UNDIAGNOSED_TEMPLATE = ('\nThis notification covers {count} alarms for this replication instance. The diagnosis '
+                        'ended without findings to report, check the task logs around these alarms:\n')
+
+
+def byte_size(text):
+    return len(text.encode('utf-8'))
+
+
+def truncate_bytes(text, max_bytes, marker=TRUNCATED):
+    # cuts text to at most max_bytes UTF-8 bytes, marker included, on a character boundary
+    if byte_size(text) <= max_bytes:
+        return text
+    room = max(0, max_bytes - byte_size(marker))
+    return text.encode('utf-8')[:room].decode('utf-8', 'ignore') + marker
+
+
+def bounded_subject(subject):
+    subject = ' '.join(subject.split())
+    if len(subject) <= SNS_MAX_SUBJECT_CHARS:
+        return subject
+    return subject[:SNS_MAX_SUBJECT_CHARS - 3] + '...'
+
+
+class MessageBuilder:
+    # Collects the message parts in order and keeps count of their size, so each part is
+    # encoded once and the message is joined once at the end.
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.parts = []
+        self.size = 0
+
+    def remaining(self):
+        return float('inf') if self.budget is None else self.budget - self.size
+
+    def add(self, text, reserve=0):
+        # adds the text if it fits next to the reserved bytes, returns whether it did
+        size = byte_size(text)
+        if self.budget is not None and self.size + size + reserve > self.budget:
+            return False
+        self.parts.append(text)
+        self.size += size
+        return True
+
+    def render(self):
+        return ''.join(self.parts)
+
+
+def render_examples(examples, max_example_bytes, budget):
+    # the examples as the indented JSON object they used to be dumped as, each message
+    # cut to max_example_bytes; returns (text, number of examples left out)
+    builder = MessageBuilder(budget)
+    closing = '\n}\n'
+    shown = 0
+    if not builder.add('\nLog examples:\n{\n', reserve=byte_size(closing)):
+        return '', len(examples)
+    for stream, message in examples.items():
+        entry = ('' if shown == 0 else ',\n') + '    ' + json.dumps(stream) + ': ' + \
+            json.dumps(truncate_bytes(message, max_example_bytes))
+        if not builder.add(entry, reserve=byte_size(closing)):
+            break
+        shown += 1
+    builder.add(closing)
+    return builder.render(), len(examples) - shown
+
+
+def render_task(task, max_task_bytes):
+    settings = task['task_settings']
+    section = TASK_TEMPLATE.format(task_arn=task['task_arn'], SupportLobs=settings['SupportLobs'])
+    if settings['SupportLobs']:
+        section += TASK_LOB_TEMPLATE.format(LimitedSizeLobMode=settings.get('LimitedSizeLobMode'),
+                                            LobMaxSize=settings.get('LobMaxSize'))
+    if 'lob_setting_in_table_mapping' in task:
+        section += TASK_MAPPING_TEMPLATE.format(rule=json.dumps(task['lob_setting_in_table_mapping'], indent=4))
+        if settings.get('less_max_lob_in_table_mapping'):
+            section += TASK_LESS_MAX_LOB
+    if byte_size(section) > max_task_bytes:
+        section = truncate_bytes(section, max_task_bytes - 1) + '\n'
+    return section
+
+
+def render_digest(coalesced, max_bytes=MAX_DIGEST_BYTES, heading=DIGEST_TEMPLATE):
+    if not coalesced or coalesced['Count'] <= 1:
+        return ''
+    builder = MessageBuilder(max_bytes)
+    builder.add(heading.format(count=coalesced['Count']))
+    listed = 0
+    for alarm in coalesced['Alarms']:
+        if not builder.add('- "{}" at {}: {}\n'.format(alarm['AlarmName'], alarm['Time'], alarm['Reason']), reserve=64):
+            break
+        listed += 1
+    if coalesced['Count'] > listed:
+        builder.add('- and {} more\n'.format(coalesced['Count'] - listed))
+    return builder.render()
+
+
+def render_alarms_notice(parameters, coalesced):
+    # the notification for alarms merged into a window whose diagnosis ended early: the
+    # head and the list of alarms, without log examples or task sections
+    return HEAD_TEMPLATE.format(**parameters) + render_digest(coalesced, heading=UNDIAGNOSED_TEMPLATE)
+
+
+def render_message(parameters, resolution='', coalesced=None, report_link=None, budget=DEFAULT_BUDGET_BYTES,
+                   max_example_bytes=MAX_EXAMPLE_BYTES, max_task_bytes=MAX_TASK_BYTES):
+    # Renders the notification for sns_message_parameters in one pass within budget bytes
+    # (None for no limit). The head, the recommendation, the alarm digest and the report
+    # link are always included; log examples and task sections fill the space left, with
+    # a summary of what did not fit. Returns (message, {'tasks': n, 'examples': n} left out).
+    if budget is None:
+        # the complete report, nothing is cut
+        max_example_bytes = max_task_bytes = float('inf')
+    head = HEAD_TEMPLATE.format(**parameters)
+    tail = (resolution or '') + render_digest(coalesced) + \
+        (REPORT_TEMPLATE.format(link=report_link) if report_link else '')
+    tasks = parameters.get('tasks', {})
+    examples = parameters.get('logs_examples_truncated', {})
+    summary_reserve = byte_size(OMITTED_TEMPLATE.format(tasks=len(tasks), examples=len(examples)))
+
+    builder = MessageBuilder(budget)
+    builder.add(head)
+    body_budget = builder.remaining() - byte_size(tail) - summary_reserve
+    examples_text, examples_left = render_examples(
+        examples, max_example_bytes, None if budget is None else max(0, int(body_budget * EXAMPLES_SHARE)))
+    builder.add(examples_text)
+
+    tasks_left = 0
+    reserve = byte_size(tail) + summary_reserve
+    for task in tasks.values():
+        if tasks_left or not builder.add(render_task(task, max_task_bytes), reserve=reserve):
+            tasks_left += 1
+
+    if tasks_left or examples_left:
+        builder.add(OMITTED_TEMPLATE.format(tasks=tasks_left, examples=examples_left))
+    builder.add(tail)
+    return builder.render(), {'tasks': tasks_left, 'examples': examples_left}
+
+
+def upload_report(location, name, report, region, s3_client=None):
+    # stores the complete report under s3://bucket/prefix/name and returns its console link
+    bucket, _, prefix = location.removeprefix('s3://').partition('/')
+    key = prefix + name
+    (s3_client or clients.get_client('s3')).put_object(
+        Bucket=bucket, Key=key, Body=report.encode('utf-8'), ContentType='text/plain; charset=utf-8')
+    logger.info('Full report stored at s3://{}/{}'.format(bucket, key))
+    return 'https://s3.console.aws.amazon.com/s3/object/{}?region={}&prefix={}'.format(bucket, region, quote(key))
@@ -1,9 +1,47 @@
-import boto3
-import json
-from botocore.exceptions import ClientError
+import clients
+from botocore.exceptions import ClientError, ConnectTimeoutError, ReadTimeoutError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
+import emf
+import instrumentation
 import logging
+import metric_publisher
+import metric_state
 import sys
+import time
+
+# Number of tasks whose table statistics are collected concurrently, and the
+# time budget (seconds) for paginating a single task. Both can be overridden
+# per invocation through the 'max_workers' and 'task_timeout' event keys, and
+# 'sample_size' keeps up to that many table names per state for debug logs.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_TASK_TIMEOUT = 30
+
+# The budget is also split over the attempts of each DescribeTableStatistics
+# call through the client read and connect timeouts, so a single page that
+# hangs cannot hold a worker beyond it between two deadline checks.
+TABLE_STATISTICS_ATTEMPTS = 2
+MAX_CONNECT_TIMEOUT = 5
+
+# Task and Replication Instance metadata used as metric dimensions, cached at
+# module level so it stays warm across invocations of the same container.
+# Entries expire after METADATA_CACHE_TTL seconds; an event with
+# 'refresh_metadata': true drops the whole cache before collection starts.
+METADATA_CACHE_TTL = 900
+
+# Metrics are published with PutMetricData by default. An event with
+# 'output_mode': 'emf' writes them to stdout as Embedded Metric Format
+# documents instead, which CloudWatch Logs turns into the same metrics.
+OUTPUT_MODE_API = 'api'
+OUTPUT_MODE_EMF = 'emf'
+
+# Delta publishing is enabled by naming a 'state_store' backend in the event
+# (memory, file, dynamodb or s3, with 'state_location' as the file path, table
+# name or s3://bucket/key). Unchanged values are then only re-sent every
+# 'heartbeat_seconds'.
+
+task_metadata_cache = {}
+ri_name_cache = {}
 
 # -----------------------------------------------------------------------------------------------------------
 
@@ -54,10 +92,73 @@ def exit_program(msg):
 
 # -----------------------------------------------------------------------------------------------------------
 
+def cache_get(cache, key):
+    # -----------------------------------------------------------------------------------------------------------
+
+    entry = cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+# -----------------------------------------------------------------------------------------------------------
+
+def cache_put(cache, key, value, ttl=METADATA_CACHE_TTL):
+    # -----------------------------------------------------------------------------------------------------------
+
+    cache[key] = (time.monotonic() + ttl, value)
+
+# -----------------------------------------------------------------------------------------------------------
+
+def invalidate_metadata_cache(task_arn=None):
+    # -----------------------------------------------------------------------------------------------------------
+
+    if task_arn is None:
+        logger.debug("Invalidating all cached Task and Replication Instance metadata")
+        task_metadata_cache.clear()
+        ri_name_cache.clear()
+    else:
+        task_metadata_cache.pop(task_arn, None)
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_replication_instance_name(dms_client, ri_arn):
+    # -----------------------------------------------------------------------------------------------------------
+
+    ri_name = cache_get(ri_name_cache, ri_arn)
+    if ri_name is None:
+        response = dms_client.describe_replication_instances(
+            Filters=[{'Name': 'replication-instance-arn', 'Values': [ri_arn]}]
+        )
+        ri_name = response['ReplicationInstances'][0]['ReplicationInstanceIdentifier']
+        cache_put(ri_name_cache, ri_arn, ri_name)
+
+    return (ri_name)
+
+# -----------------------------------------------------------------------------------------------------------
+
+def cache_task_metadata(dms_client, task):
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Build the metadata published as metric dimensions from a ReplicationTasks
+    # entry, so the listing call in get_tasks_by_replication_istance warms the
+    # cache and publish_custom_metrics needs no per-task describe calls.
+    task_arn = task['ReplicationTaskArn']
+    task_metadata = {
+        "TaskID": task_arn.split(':')[6],
+        "TaskName": task['ReplicationTaskIdentifier'],
+        "TaskStatus": task['Status'],
+        "ReplicationInstName": get_replication_instance_name(dms_client, task['ReplicationInstanceArn'])
+    }
+    cache_put(task_metadata_cache, task_arn, task_metadata)
+
+    return (task_metadata)
+
+# -----------------------------------------------------------------------------------------------------------
+
 def get_tasks_by_replication_istance(ri_arn_list):
     # -----------------------------------------------------------------------------------------------------------
 
-    dms_client = boto3.client('dms')
+    dms_client = clients.get_client('dms')
     task_list = []
 
     for ri_arn in ri_arn_list:
@@ -65,13 +166,17 @@ def get_tasks_by_replication_istance(ri_arn_list):
 
             logger.debug(
                 "Collecting Task details for Replication Instance : {}".format(ri_arn))
-            response = dms_client.describe_replication_tasks(Filters= [{'Name': 'replication-instance-arn', 'Values': [ri_arn]}], WithoutSettings = True)
-            logger.debug(
-                "Task details for Replication Instance : {}".format(response))
+            dms_paginator = dms_client.get_paginator('describe_replication_tasks')
+            page_iterator = dms_paginator.paginate(Filters= [{'Name': 'replication-instance-arn', 'Values': [ri_arn]}], WithoutSettings = True)
+
+            for response in page_iterator:
+                logger.debug(
+                    "Task details for Replication Instance : {}".format(response))
 
-            for task in response['ReplicationTasks']:
-                if task['Status'] in ["running", "failed"]:
-                    task_list.append(task['ReplicationTaskArn'])
+                for task in response['ReplicationTasks']:
+                    cache_task_metadata(dms_client, task)
+                    if task['Status'] in ["running", "failed"]:
+                        task_list.append(task['ReplicationTaskArn'])
 
         except ClientError as e:
             if e.response['Error']['Code'] in ['ResourceNotFoundFault', 'InvalidParameterValueException']:
@@ -85,10 +190,15 @@ def get_tasks_by_replication_istance(ri_arn_list):
 
 # -----------------------------------------------------------------------------------------------------------
 
-def get_task_metadata(task_arn):
+def get_task_metadata(task_arn, dms_client=None):
     # -----------------------------------------------------------------------------------------------------------
 
-    dms_client = boto3.client('dms')
+    task_metadata = cache_get(task_metadata_cache, task_arn)
+    if task_metadata is not None:
+        return (task_metadata)
+
+    if dms_client is None:
+        dms_client = clients.get_client('dms')
 
     try:
         # Get DMS Replication Instance Name and Replication Task ID
@@ -96,139 +206,210 @@ def get_task_metadata(task_arn):
             Filters = [{'Name': 'replication-task-arn', 'Values': [task_arn]}], WithoutSettings=True
         )
 
-        task_status = response['ReplicationTasks'][0]['Status']
-        ri_arn = response['ReplicationTasks'][0]['ReplicationInstanceArn']
-        task_id = task_arn.split(':')[6]
-        task_name = response['ReplicationTasks'][0]['ReplicationTaskIdentifier']
-
-        response = dms_client.describe_replication_instances(
-            Filters=[{'Name': 'replication-instance-arn', 'Values': [ri_arn]}]
-        )
-        ri_name = response['ReplicationInstances'][0]['ReplicationInstanceIdentifier']
-
-        task_metadata = {
-            "TaskID": task_id, "TaskName": task_name, "TaskStatus": task_status, "ReplicationInstName": ri_name
-        }
-
-        return (task_metadata)
+        return (cache_task_metadata(dms_client, response['ReplicationTasks'][0]))
 
     except ClientError as e:
         if e.response['Error']['Code'] in ['ResourceNotFoundFault', 'InvalidParameterValueException']:
+            invalidate_metadata_cache(task_arn)
             exit_program("The Task ARN [{}] not found".format(task_arn))
         else:
             raise (e)
 
 # -----------------------------------------------------------------------------------------------------------
 
-def get_table_validation_status(task_list):
+class TableStatAggregator:
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Single-pass aggregation of describe_table_statistics pages. Only a counter
+    # per TableState / ValidationState / validation record group is kept, plus
+    # at most `sample_size` table names per group for troubleshooting, so memory
+    # stays constant no matter how many tables a task replicates.
+
+    RECORD_GROUPS = ('ValidationPendingRecords', 'ValidationFailedRecords', 'ValidationSuspendedRecords')
+
+    def __init__(self, sample_size=0):
+        self.sample_size = sample_size
+        self.tables = 0
+        self.counts = {group: 0 for group in self.RECORD_GROUPS}
+        self.samples = {}
+
+    def _add(self, group, table_name):
+        self.counts[group] = self.counts.get(group, 0) + 1
+        if self.sample_size > 0:
+            sample = self.samples.setdefault(group, [])
+            if len(sample) < self.sample_size:
+                sample.append(table_name)
+
+    def add_page(self, table_statistics):
+        for item in table_statistics:
+            self.tables += 1
+            table_name = item['TableName']
+            self._add(item['TableState'], table_name)
+            self._add(item['ValidationState'], table_name)
+            for group in self.RECORD_GROUPS:
+                if item.get(group, 0) > 0:
+                    self._add(group, table_name)
+
+# -----------------------------------------------------------------------------------------------------------
+
+def collect_table_statistics(dms_client, task_arn, task_timeout, sample_size=0):
+    # -----------------------------------------------------------------------------------------------------------
+
+    # Runs inside a worker thread. The deadline is checked between pages, and the
+    # client timeouts bound each page, so a slow task is abandoned instead of
+    # holding up the whole collection cycle.
+    start = time.monotonic()
+    deadline = start + task_timeout
+    aggregator = TableStatAggregator(sample_size)
+    pages = 0
+
+    dms_paginator = dms_client.get_paginator('describe_table_statistics')
+    PaginationConfig = {'PageSize': 500}
+    page_iterator = dms_paginator.paginate(ReplicationTaskArn=task_arn, PaginationConfig=PaginationConfig)
+
+    for page in page_iterator:
+        pages += 1
+        aggregator.add_page(page['TableStatistics'])
+        if time.monotonic() > deadline:
+            raise TimeoutError("Collecting Table Statistics for Task {} exceeded {}s after {} pages".format(
+                task_arn, task_timeout, pages))
+
+    latency = {'Pages': pages, 'Tables': aggregator.tables, 'Seconds': round(time.monotonic() - start, 3)}
+
+    return (aggregator, latency)
+
+# -----------------------------------------------------------------------------------------------------------
+
+def get_table_validation_status(task_list, max_workers=DEFAULT_MAX_WORKERS, task_timeout=DEFAULT_TASK_TIMEOUT, sample_size=0):
     # -----------------------------------------------------------------------------------------------------------
 
-    dms_client = boto3.client('dms')
+    # boto3 clients are thread safe, so all workers share one client. The
+    # connection pool is sized to the worker count to avoid pool starvation.
+    attempt_timeout = max(task_timeout / TABLE_STATISTICS_ATTEMPTS, 1)
+    dms_client = clients.get_client('dms', max_pool_connections=max(max_workers, 10),
+                                    connect_timeout=min(attempt_timeout, MAX_CONNECT_TIMEOUT),
+                                    read_timeout=attempt_timeout,
+                                    retries={'mode': 'standard', 'total_max_attempts': TABLE_STATISTICS_ATTEMPTS})
 
     task_table_stat_dict = {}
+    task_latency_dict = {}
+    cycle_start = time.monotonic()
 
-    for task_arn in task_list:
-        try:
-            table_stat_list = []
-            table_stat_dict = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(collect_table_statistics, dms_client, task_arn, task_timeout, sample_size): task_arn
+                   for task_arn in task_list}
 
-            dms_paginator = dms_client.get_paginator(
-                'describe_table_statistics')
-            PaginationConfig = {'MaxItems': 20000, 'PageSize': 500}
-            page_iterator    = dms_paginator.paginate(ReplicationTaskArn=task_arn, PaginationConfig= PaginationConfig)
+        for future in as_completed(futures):
+            task_arn = futures[future]
+            try:
+                aggregator, latency = future.result()
 
-            for page in page_iterator:
-                table_stat_list.extend(page['TableStatistics'])
+            except (TimeoutError, ConnectTimeoutError, ReadTimeoutError) as e:
+                logger.warning("Skipping Task {} : {}".format(task_arn, str(e)))
+                continue
 
-            logger.debug("Table Statistics for Task {} : {}".format(
-                task_arn, table_stat_list))
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ResourceNotFoundFault':
+                    exit_program("DMS Task not found : {}".format(task_arn))
+                if e.response['Error']['Code'] == 'InvalidResourceStateFault':
+                    exit_program(
+                        "DMS Task is in Invalid Resource State to fetch Table Statistics : {}".format(task_arn))
+                else:
+                    exit_program("Unkonwn Error: {}".format(str(e)))
 
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'ResourceNotFoundFault':
-                exit_program("DMS Task not found : ", task_arn)
-            if e.response['Error']['Code'] == 'InvalidResourceStateFault':
-                exit_program(
-                    "DMS Task is in Invalid Resource State to fetch Table Statistics : ", task_arn)
-            else:
-                exit_program("Unkonwn Error: {}".format(str(e)))
+            logger.debug("Table counts by Statistics group for Task {} : {}".format(
+                task_arn, aggregator.counts))
+            if sample_size > 0:
+                logger.debug("Sample Tables by Statistics group for Task {} : {}".format(
+                    task_arn, aggregator.samples))
 
-        for item in table_stat_list:
-            table_status = item['TableState']
-            if table_stat_dict.get(table_status) is None:
-                table_stat_dict[table_status] = [item['TableName']]
-            else:
-                table_stat_dict[table_status].append(item['TableName'])
+            task_latency_dict[task_arn] = latency
+            task_table_stat_dict[task_arn] = aggregator.counts
 
-        for item in table_stat_list:
-            validation_status = item['ValidationState']
-            if table_stat_dict.get(validation_status) is None:
-                table_stat_dict[validation_status] = [item['TableName']]
-            else:
-                table_stat_dict[validation_status].append(
-                    item['TableName'])
+    cycle_seconds = time.monotonic() - cycle_start
+    sequential_seconds = sum(x['Seconds'] for x in task_latency_dict.values())
 
-        table_stat_dict['ValidationPendingRecords'] = [x['TableName']
-                                                        for x in table_stat_list if x['ValidationPendingRecords'] > 0]
-        table_stat_dict['ValidationFailedRecords'] = [x['TableName']
-                                                        for x in table_stat_list if x['ValidationFailedRecords'] > 0]
-        table_stat_dict['ValidationSuspendedRecords'] = [x['TableName']
-                                                            for x in table_stat_list if x['ValidationSuspendedRecords'] > 0]
+    for task_arn, latency in task_latency_dict.items():
+        logger.info("Table Statistics latency for Task {} : {}".format(task_arn, latency))
 
-        logger.debug("Tables by Statistics group for Task {} : {}".format(
-            task_arn, table_stat_dict))
-        task_table_stat_dict[task_arn] = table_stat_dict
+    logger.info("Collected Table Statistics for {}/{} Tasks with {} workers in {:.3f}s (sum of per-task latency {:.3f}s, speedup x{:.1f})".format(
+        len(task_latency_dict), len(task_list), max_workers, cycle_seconds, sequential_seconds,
+        sequential_seconds / cycle_seconds if cycle_seconds > 0 else 1.0))
 
-    logger.debug("Table grouping for all DMS Tasks : {}".format(
+    logger.debug("Table counts for all DMS Tasks : {}".format(
         task_table_stat_dict))
     return (task_table_stat_dict)
 
 # ---------------------------------------------------------------------------
 
-def publish_custom_metrics(all_metrics, cw_namespace):
+def build_metric_data(all_metrics):
     # ---------------------------------------------------------------------------
 
-    cw_client = boto3.client('cloudwatch')
+    dms_client = clients.get_client('dms')
+    metric_data = []
+    timestamp = datetime.datetime.utcnow()
 
     for task_arn in all_metrics.keys():
 
-        task_metadata = get_task_metadata(task_arn)
+        task_metadata = get_task_metadata(task_arn, dms_client)
         task_id = task_metadata['TaskID']
         ri_name = task_metadata['ReplicationInstName']
 
         table_stat = all_metrics[task_arn]
-        metric_data = []
-
-        logger.debug(
-            "Initiating Cloudwatch Metric Publish for Task : {}".format(task_arn))
 
         for stat in table_stat.keys():
             metric_data.append({
                 'MetricName': stat, 'Dimensions': [
                     {'Name': 'ReplicationInstanceIdentifier', 'Value': ri_name}, {'Name': 'ReplicationTaskIdentifier',     'Value': task_id}
-                ], 'Timestamp': datetime.datetime.utcnow(), 'Value': len(table_stat[stat]), 'Unit': 'Count'
+                ], 'Timestamp': timestamp, 'Value': table_stat[stat], 'Unit': 'Count'
             })
 
-        logger.debug("Cloudwatch Metric Data : {}".format(metric_data))
-        max_metrics = 20
-        group = 0
+    logger.debug("Cloudwatch Metric Data : {}".format(metric_data))
+    return (metric_data)
 
-        for x in range(0, len(metric_data), max_metrics):
-            group += 1
+# ---------------------------------------------------------------------------
 
-            # slice the metrics into blocks of 20 or just the remaining metrics
-            cw_data = metric_data[x:(x + max_metrics)]
+def publish_custom_metrics(all_metrics, cw_namespace, max_workers=DEFAULT_MAX_WORKERS, output_mode=OUTPUT_MODE_API,
+                           state_store=None, heartbeat_seconds=metric_state.DEFAULT_HEARTBEAT_SECONDS):
+    # ---------------------------------------------------------------------------
 
-            try:
-                cw_client.put_metric_data(Namespace=cw_namespace, MetricData= cw_data)
-            except:
-                exit_program('Pushing metrics to CloudWatch failed: exception : {}'.format(
-                    sys.exc_info()[1]))
+    metric_data = build_metric_data(all_metrics)
+    state_entries = {}
+
+    if state_store is not None:
+        total = len(metric_data)
+        metric_data, state_entries = metric_state.filter_changed(metric_data, state_store, heartbeat_seconds)
+        logger.info("Publishing {} of {} metrics that changed or are due for a heartbeat".format(
+            len(metric_data), total))
 
-        logger.debug(
-            "Cloudwatch Metric Publish completed for Task : {}".format(task_arn))
+    if output_mode == OUTPUT_MODE_EMF:
+        report = emf.emit_emf(cw_namespace, metric_data)
+        logger.info("Cloudwatch Metric Publish as Embedded Metric Format : {}".format(report))
+        if state_entries:
+            state_store.save(state_entries)
+        return (report)
+
+    # Retries are handled by metric_publisher with jittered backoff, so botocore
+    # makes a single attempt per call
+    cw_client = clients.get_client('cloudwatch', retries={'total_max_attempts': 1})
+    report = metric_publisher.publish_metric_data(cw_client, cw_namespace, metric_data, max_workers)
+
+    for batch in report['Batches']:
+        if batch['Status'] != 'SUCCESS':
+            logger.error('Pushing metrics to CloudWatch failed for batch {} ({} datums): {}'.format(
+                batch['Batch'], batch['Datums'], batch.get('Error')))
+
+    # Only remember what was published when every batch made it, otherwise the
+    # next run republishes the changed values
+    if state_entries and report['FailedDatums'] == 0:
+        state_store.save(state_entries)
+
+    logger.debug("Cloudwatch Metric Publish report : {}".format(report))
+    return (report)
 
 # -----------------------------------------------------------------------------------------------------------
 
+@instrumentation.instrumented
 def lambda_handler(event, context):
     # -----------------------------------------------------------------------------------------------------------
     try:
@@ -240,6 +421,9 @@ def lambda_handler(event, context):
         logger = log_config(EXECUTION_LOG, 'console')
         logger.debug('Input Event  : {}'.format(event))
 
+        if event.get('refresh_metadata', False):
+            invalidate_metadata_cache()
+
         if event.get('task_arn_list') is not None:
             logger.info("Input Type : List of DMS Task ARNs")
             task_list = event['task_arn_list']
@@ -253,8 +437,26 @@ def lambda_handler(event, context):
         else:
             exit_program("Invalid Input")
 
-        all_metrics = get_table_validation_status(task_list)
-        publish_custom_metrics(all_metrics, 'CustomMetrics/DMS')
+        max_workers = max(1, int(event.get('max_workers', DEFAULT_MAX_WORKERS)))
+        task_timeout = int(event.get('task_timeout', DEFAULT_TASK_TIMEOUT))
+
+        sample_size = int(event.get('sample_size', 0))
+
+        output_mode = event.get('output_mode', OUTPUT_MODE_API)
+        if output_mode not in (OUTPUT_MODE_API, OUTPUT_MODE_EMF):
+            exit_program("Invalid output_mode : {}".format(output_mode))
+
+        state_store = None
+        if event.get('state_store') is not None:
+            try:
+                state_store = metric_state.get_state_store(event['state_store'], event.get('state_location'))
+            except ValueError as e:
+                exit_program("Invalid state_store : {}".format(e))
+        heartbeat_seconds = int(event.get('heartbeat_seconds', metric_state.DEFAULT_HEARTBEAT_SECONDS))
+
+        all_metrics = get_table_validation_status(task_list, max_workers, task_timeout, sample_size)
+        publish_custom_metrics(all_metrics, 'CustomMetrics/DMS', max_workers, output_mode,
+                               state_store, heartbeat_seconds)
 
     except ClientError as e:
         exit_program("[main] Unkonwn Error: {}".format(str(e)))
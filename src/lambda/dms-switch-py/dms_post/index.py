@@ -1,55 +1,45 @@
 import os
 import json
-import boto3
+import clients
+import instrumentation
 import utils
 
-dms = boto3.client('dms')
-cf = boto3.client('cloudformation')
+# statuses from which a stopped or never-run replication can be (re)started
+STARTABLE_STATUSES = ('stopped', 'ready', 'created')
 
 
+@instrumentation.instrumented
 def handler(event, context):
-    replication_task_arn = os.environ.get('DMS_TASK')
+    utils.begin_invocation()
+    # created on the first invocation and reused by the warm ones
+    dms = clients.get_client('dms')
+    cf = clients.get_client('cloudformation')
+    stack_name = os.environ.get('STACK_NAME')
     print(json.dumps({'RequestType': event['RequestType']}))
     try:
         if event['RequestType'] == 'Create':
-            start_cmd = {
-                'ReplicationTaskArn': replication_task_arn,
-                'StartReplicationTaskType': 'start-replication'
-            }
-            dms.start_replication_task(**start_cmd)
-            utils.wait_for_dms_status(replication_task_arn, 'running')
-            return {
-                'PhysicalResourceId': 'post-dms',
-                'Status': 'SUCCESS'
-            }
+            replication_task_arns = utils.get_dms_tasks(cf, stack_name) or [os.environ.get('DMS_TASK')]
+            statuses = utils.get_dms_replication_task_statuses(dms, replication_task_arns)
+            startable = {arn: status for arn, status in statuses.items() if status not in ('running', 'starting')}
         elif event['RequestType'] == 'Update':
-            should_unpause = False
-            dms_changes = utils.has_dms_changes(
-                event['ResourceProperties']['StackName'])
-            if dms_changes:
-                should_unpause = True
-            else:
-                status = utils.get_dms_replication_task_status(replication_task_arn)
-                print(f'DMS status: {status}')
-                if status in ('stopped', 'ready'):
-                    should_unpause = True
-            if should_unpause:
-                start_cmd = {
-                    'ReplicationTaskArn': replication_task_arn,
-                    'StartReplicationTaskType': 'resume-processing'
-                }
-                dms.start_replication_task(**start_cmd)
-                utils.wait_for_dms_status(replication_task_arn, 'running')
-            return {
-                'PhysicalResourceId': 'post-dms',
-                'Status': 'SUCCESS'
-            }
+            replication_task_arns = utils.get_changed_dms_resources(cf, stack_name, utils.TASK_RESOURCE_TYPE)
+            statuses = utils.get_dms_replication_task_statuses(dms, replication_task_arns)
+            startable = {arn: status for arn, status in statuses.items() if status in STARTABLE_STATUSES}
         else:
             print('No operation for', event['RequestType'])
             return {
                 'PhysicalResourceId': 'post-dms',
                 'Status': 'SUCCESS'
             }
+        if startable:
+            utils.start_replication_tasks(dms, startable)
+            if utils.async_mode():
+                return utils.pending_response('post-dms', 'task', startable.keys(), 'running')
+            utils.wait_for_dms_tasks_status(dms, list(startable), 'running', context)
+        return {
+            'PhysicalResourceId': 'post-dms',
+            'Status': 'SUCCESS'
+        }
     except Exception as e:
         print('Failed!', str(e))
         return {
@@ -57,3 +47,8 @@ def handler(event, context):
             'Reason': str(e),
             'Status': 'FAILED'
         }
+
+
+@instrumentation.instrumented
+def is_complete(event, context):
+    return utils.check_complete(clients.get_client('dms'), event)
@@ -1,24 +1,28 @@
 import os
-import boto3
+import clients
+import instrumentation
 import utils
 
 
-dms = boto3.client('dms')
-cf = boto3.client('cloudformation')
-
-
+@instrumentation.instrumented
 def handler(event, context):
+    utils.begin_invocation()
+    # created on the first invocation and reused by the warm ones
+    dms = clients.get_client('dms')
+    cf = clients.get_client('cloudformation')
     try:
         stack_name = os.environ.get('STACK_NAME')
-        replication_task_arn = utils.get_dms_task(cf, stack_name)
-        status = utils.get_dms_replication_task_status(replication_task_arn)
-        if status == 'running':
-            if event['RequestType'] == 'Delete' or utils.has_dms_changes(cf, stack_name):
-                stop_cmd = {
-                    'ReplicationTaskArn': replication_task_arn
-                }
-                dms.stop_replication_task(**stop_cmd)
-                utils.wait_for_dms_status(replication_task_arn, 'stopped')
+        if event['RequestType'] == 'Delete':
+            replication_task_arns = utils.get_dms_tasks(cf, stack_name)
+        else:
+            replication_task_arns = utils.get_changed_dms_resources(cf, stack_name, utils.TASK_RESOURCE_TYPE)
+        statuses = utils.get_dms_replication_task_statuses(dms, replication_task_arns)
+        running = [arn for arn, status in statuses.items() if status == 'running']
+        if running:
+            utils.stop_replication_tasks(dms, running)
+            if utils.async_mode():
+                return utils.pending_response('pre-dms', 'task', running, 'stopped')
+            utils.wait_for_dms_tasks_status(dms, running, 'stopped', context)
         return {
             'PhysicalResourceId': 'pre-dms',
             'Status': 'SUCCESS'
@@ -31,3 +35,7 @@ def handler(event, context):
             'Status': 'FAILED'
         }
 
+
+@instrumentation.instrumented
+def is_complete(event, context):
+    return utils.check_complete(clients.get_client('dms'), event)
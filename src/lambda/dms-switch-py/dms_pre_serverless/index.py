@@ -1,29 +1,28 @@
 import os
-import boto3
+import clients
+import instrumentation
 import utils
-# from utils import get_dms_config
-# from utils import get_dms_replication_status
-# from utils import has_dms_changes
-# from utils import wait_for_dms_status
-
-
-dms = boto3.client('dms')
-cf = boto3.client('cloudformation')
 
 
+@instrumentation.instrumented
 def handler(event, context):
+    utils.begin_invocation()
+    # created on the first invocation and reused by the warm ones
+    dms = clients.get_client('dms')
+    cf = clients.get_client('cloudformation')
     try:
         stack_name = os.environ.get('STACK_NAME')
-        replication_config_arn = get_dms_config(stack_name)
-        status = utils.get_dms_replication_status(replication_config_arn)
-
-        if status == 'running':
-            if event['RequestType'] == 'Delete' or utils.has_dms_changes(stack_name):
-                stop_cmd = {
-                    'ReplicationConfigArn': replication_config_arn
-                }
-                dms.stop_replication(**stop_cmd)
-                utils.wait_for_dms_status(replication_config_arn, 'stopped')
+        if event['RequestType'] == 'Delete':
+            replication_config_arns = utils.get_dms_configs(cf, stack_name)
+        else:
+            replication_config_arns = utils.get_changed_dms_resources(cf, stack_name, utils.CONFIG_RESOURCE_TYPE)
+        statuses = utils.get_dms_replication_statuses(dms, replication_config_arns)
+        running = [arn for arn, status in statuses.items() if status == 'running']
+        if running:
+            utils.stop_replications(dms, running)
+            if utils.async_mode():
+                return utils.pending_response('pre-dms', 'config', running, 'stopped')
+            utils.wait_for_dms_configs_status(dms, running, 'stopped', context)
         return {
             'PhysicalResourceId': 'pre-dms',
             'Status': 'SUCCESS'
@@ -35,3 +34,8 @@ def handler(event, context):
             'Reason': str(e),
             'Status': 'FAILED'
         }
+
+
+@instrumentation.instrumented
+def is_complete(event, context):
+    return utils.check_complete(clients.get_client('dms'), event)
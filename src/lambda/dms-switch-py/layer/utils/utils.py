@@ -1,25 +1,44 @@
 import json
-import time 
-
-def get_change_set(cf, stack_name, change_set_name, changes=None, next_token=None):
-    if changes is None:
-        changes = []
-    response = cf.describe_change_set(
-        StackName=stack_name,
-        ChangeSetName=change_set_name,
-        NextToken=next_token
-    )
-    change_set = response.get('Changes', [])
-    next_changes = changes + change_set
-    if 'NextToken' in response:
-        return get_change_set(cf, stack_name, change_set_name, next_changes, response['NextToken'])
-    else:
-        return next_changes
-    
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TERMINAL_FAILURE_STATES = ('failed', 'error')
+TASK_RESOURCE_TYPE = 'AWS::DMS::ReplicationTask'
+CONFIG_RESOURCE_TYPE = 'AWS::DMS::ReplicationConfig'
+MAX_CONCURRENT_OPERATIONS = 10
+STATUS_FILTER_CHUNK = 100
+
+# Stack resources and change sets listed during the current invocation.
+# Handlers call begin_invocation() first so warm containers never reuse a
+# previous deployment's listing.
+_invocation_cache = {}
+
+
+def begin_invocation():
+    _invocation_cache.clear()
+
+
+def iter_change_set(cf, stack_name, change_set_name):
+    kwargs = {'StackName': stack_name, 'ChangeSetName': change_set_name}
+    while True:
+        response = cf.describe_change_set(**kwargs)
+        yield from response.get('Changes', [])
+        if 'NextToken' not in response:
+            return
+        kwargs['NextToken'] = response['NextToken']
+
+
+def get_change_set(cf, stack_name, change_set_name):
+    key = ('change_set', stack_name, change_set_name)
+    if key not in _invocation_cache:
+        _invocation_cache[key] = list(iter_change_set(cf, stack_name, change_set_name))
+    return _invocation_cache[key]
+
+
 def get_dms_config(cf, stack_name):
-    resources = list_stack_resources(cf, stack_name, [])
-    dms_configs = [res['PhysicalResourceId']
-                   for res in resources if res['ResourceType'] == 'AWS::DMS::ReplicationConfig']
+    dms_configs = get_dms_configs(cf, stack_name)
     if dms_configs:
         dms_config = dms_configs[0]
         print(dms_config)
@@ -28,49 +47,59 @@ def get_dms_config(cf, stack_name):
         return None
 
 
-def list_stack_resources(cf, stack_name, resources=None, next_token=None):
-    if resources is None:
-        resources = []
-    response = cf.list_stack_resources(
-        StackName=stack_name, NextToken=next_token)
-    resource_summaries = response.get('StackResourceSummaries', [])
-    resources += resource_summaries
-    if 'NextToken' in response:
-        return list_stack_resources(cf, stack_name, resources, response['NextToken'])
-    else:
-        return resources
+def get_dms_configs(cf, stack_name):
+    return get_dms_resources(cf, stack_name, CONFIG_RESOURCE_TYPE)
+
+
+def get_dms_resources(cf, stack_name, resource_type):
+    resources = list_stack_resources(cf, stack_name)
+    return [res['PhysicalResourceId']
+            for res in resources if res['ResourceType'] == resource_type and res.get('PhysicalResourceId')]
+
+
+def iter_stack_resources(cf, stack_name):
+    paginator = cf.get_paginator('list_stack_resources')
+    for page in paginator.paginate(StackName=stack_name):
+        yield from page.get('StackResourceSummaries', [])
+
+
+def list_stack_resources(cf, stack_name):
+    key = ('stack_resources', stack_name)
+    if key not in _invocation_cache:
+        _invocation_cache[key] = list(iter_stack_resources(cf, stack_name))
+    return _invocation_cache[key]
+
 
 def get_dms_replication_status(dms, replication_config_arn):
-    filters = [
-        {
-            'Name': 'replication-config-arn',
-            'Values': [replication_config_arn]
-        }
-    ]
-    response = dms.describe_replications(Filters=filters)
-    status = response['Replications'][0]['Status'] if response.get(
-        'Replications') else None
-    return status
+    return get_dms_replication_statuses(dms, [replication_config_arn])[replication_config_arn]
 
 
 def get_dms_replication_task_status(dms, replication_task_arn):
-    filters = [
-        {
-            'Name': 'replication-task-arn',
-            'Values': [replication_task_arn]
-        }
-    ]
-    response = dms.describe_replication_tasks(
-        Filters=filters, WithoutSettings=True)
-    status = response['ReplicationTasks'][0]['Status'] if response.get(
-        'ReplicationTasks') else None
-    return status
+    return get_dms_replication_task_statuses(dms, [replication_task_arn])[replication_task_arn]
+
+
+def get_statuses(dms, operation, filter_name, arn_key, items_key, arns, **kwargs):
+    # One paginated describe call per chunk of ARNs (multi-value filter)
+    # instead of one call per ARN. ARNs DMS does not return map to None.
+    arns = list(dict.fromkeys(arns))
+    statuses = {arn: None for arn in arns}
+    paginator = dms.get_paginator(operation)
+    for x in range(0, len(arns), STATUS_FILTER_CHUNK):
+        filters = [
+            {
+                'Name': filter_name,
+                'Values': arns[x:(x + STATUS_FILTER_CHUNK)]
+            }
+        ]
+        for page in paginator.paginate(Filters=filters, **kwargs):
+            for item in page.get(items_key, []):
+                if item.get(arn_key) in statuses:
+                    statuses[item[arn_key]] = item['Status']
+    return statuses
 
 
 def get_dms_task(cf, stack_name):
-    resources = list_stack_resources(cf, stack_name, [])
-    dms_tasks = [res['PhysicalResourceId']
-                 for res in resources if res['ResourceType'] == 'AWS::DMS::ReplicationTask']
+    dms_tasks = get_dms_tasks(cf, stack_name)
     if dms_tasks:
         dms_task = dms_tasks[0]
         return dms_task
@@ -78,34 +107,179 @@ def get_dms_task(cf, stack_name):
         return None
 
 
-def has_dms_changes(cf, stack_name):
+def get_dms_tasks(cf, stack_name):
+    return get_dms_resources(cf, stack_name, TASK_RESOURCE_TYPE)
+
+
+def get_dms_changes(cf, stack_name):
     stacks = cf.describe_stacks(StackName=stack_name)
     print(json.dumps({'stacks': stacks}, default=str))
     change_set_name = stacks['Stacks'][0]['ChangeSetId'] if stacks.get(
         'Stacks') else ''
-    changes = get_change_set(cf, stack_name, change_set_name, [])
-    dms_changes = any(change.get('ResourceChange', {}).get(
-        'ResourceType', '').startswith('AWS::DMS') for change in changes)
-    return dms_changes
-
-def wait_for_dms_config_status(dms, replication_config_arn, target_status):
-    status = ''
-    for _ in range(24):
-        status = get_dms_replication_status(dms, replication_config_arn)
-        print(f'DMS status: {status}')
-        if status == target_status:
-            return status
-        time.sleep(10)
-    raise Exception(f'DMS not {target_status}: {status}')
-
-
-def wait_for_dms_status(dms, replication_task_arn, target_status):
-    status = ''
-    for _ in range(24):
-        status = get_dms_replication_status(dms, replication_task_arn)
-        print(f'DMS status: {status}')
-        if status == target_status:
-            return status
-        time.sleep(10)
-    raise Exception(f'DMS not {target_status}: {status}')
+    changes = get_change_set(cf, stack_name, change_set_name)
+    return [change['ResourceChange'] for change in changes
+            if change.get('ResourceChange', {}).get('ResourceType', '').startswith('AWS::DMS')]
+
+
+def get_changed_dms_resources(cf, stack_name, resource_type):
+    # Physical IDs of the tasks (or configs) a deployment touches. A change to
+    # the task/config itself only touches that one; a change to any shared DMS
+    # resource (endpoint, instance, subnet group, ...) touches all of them.
+    changes = get_dms_changes(cf, stack_name)
+    resources = [res for res in list_stack_resources(cf, stack_name) if res['ResourceType'] == resource_type]
+    shared_changed = any(change['ResourceType'] not in (TASK_RESOURCE_TYPE, CONFIG_RESOURCE_TYPE) for change in changes)
+    changed_ids = set()
+    for change in changes:
+        if change['ResourceType'] == resource_type:
+            changed_ids.add(change.get('LogicalResourceId'))
+            changed_ids.add(change.get('PhysicalResourceId'))
+    return set(res['PhysicalResourceId'] for res in resources
+               if res.get('PhysicalResourceId') and (shared_changed or res['LogicalResourceId'] in changed_ids
+                                                     or res['PhysicalResourceId'] in changed_ids))
+
+
+def get_dms_replication_statuses(dms, replication_config_arns):
+    return get_statuses(dms, 'describe_replications', 'replication-config-arn', 'ReplicationConfigArn',
+                        'Replications', replication_config_arns)
+
+
+def get_dms_replication_task_statuses(dms, replication_task_arns):
+    return get_statuses(dms, 'describe_replication_tasks', 'replication-task-arn', 'ReplicationTaskArn',
+                        'ReplicationTasks', replication_task_arns, WithoutSettings=True)
+
+
+def run_concurrently(operation, items):
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_OPERATIONS, len(items))) as executor:
+        return list(executor.map(operation, items))
 
+
+def stop_replication_tasks(dms, replication_task_arns):
+    return run_concurrently(lambda arn: dms.stop_replication_task(ReplicationTaskArn=arn), replication_task_arns)
+
+
+def stop_replications(dms, replication_config_arns):
+    return run_concurrently(lambda arn: dms.stop_replication(ReplicationConfigArn=arn), replication_config_arns)
+
+
+def start_type_for(status):
+    # never-run tasks/configs must be started, stopped ones are resumed
+    return 'resume-processing' if status == 'stopped' else 'start-replication'
+
+
+def start_replication_tasks(dms, statuses):
+    return run_concurrently(lambda item: dms.start_replication_task(
+        ReplicationTaskArn=item[0], StartReplicationTaskType=start_type_for(item[1])), statuses.items())
+
+
+def start_replications(dms, statuses):
+    return run_concurrently(lambda item: dms.start_replication(
+        ReplicationConfigArn=item[0], StartReplicationType=start_type_for(item[1])), statuses.items())
+
+
+def wait_for_all_status(get_statuses, target_status, context=None, timeout=240, initial_delay=5, max_delay=60,
+                        safety_margin_ms=15000, failure_states=TERMINAL_FAILURE_STATES,
+                        clock=time.monotonic, sleep=time.sleep, rng=random.random):
+    # Polls get_statuses() (a {arn: status} map) with exponential backoff and
+    # jitter until every entry reaches target_status. Gives up early on a
+    # terminal failure state. The wait ends at a deadline: the Lambda time left
+    # minus safety_margin_ms when a context is given, else `timeout` seconds.
+    # A delay that would cross the deadline is shortened to end on it, so the
+    # last poll happens right before the deadline.
+    if context is not None:
+        budget = (context.get_remaining_time_in_millis() - safety_margin_ms) / 1000
+    else:
+        budget = timeout
+    deadline = clock() + budget
+    attempt = 0
+    while True:
+        statuses = get_statuses()
+        print(f'DMS status: {json.dumps(statuses)}')
+        pending = {arn: status for arn, status in statuses.items() if status != target_status}
+        if not pending:
+            return statuses
+        failed = {arn: status for arn, status in pending.items() if status in failure_states}
+        if failed:
+            raise Exception(f'DMS {failed} while waiting for {target_status}')
+
+        left = deadline - clock()
+        if left <= 0:
+            raise Exception(f'DMS not {target_status} after {max(0, round(budget))} s: {pending}')
+
+        delay = min(max_delay, initial_delay * (2 ** attempt))
+        delay = delay / 2 + rng() * delay / 2
+        attempt += 1
+        sleep(min(delay, left))
+
+
+def wait_for_status(get_status, target_status, context=None, **kwargs):
+    return wait_for_all_status(lambda: {'status': get_status()}, target_status, context, **kwargs)['status']
+
+
+def wait_for_dms_config_status(dms, replication_config_arn, target_status, context=None, **kwargs):
+    return wait_for_status(lambda: get_dms_replication_status(dms, replication_config_arn),
+                           target_status, context, **kwargs)
+
+
+def wait_for_dms_status(dms, replication_task_arn, target_status, context=None, **kwargs):
+    return wait_for_status(lambda: get_dms_replication_task_status(dms, replication_task_arn),
+                           target_status, context, **kwargs)
+
+
+def wait_for_dms_configs_status(dms, replication_config_arns, target_status, context=None, **kwargs):
+    return wait_for_all_status(lambda: get_dms_replication_statuses(dms, replication_config_arns),
+                               target_status, context, **kwargs)
+
+
+def wait_for_dms_tasks_status(dms, replication_task_arns, target_status, context=None, **kwargs):
+    return wait_for_all_status(lambda: get_dms_replication_task_statuses(dms, replication_task_arns),
+                               target_status, context, **kwargs)
+
+
+def async_mode():
+    # WAIT_MODE=async splits each handler into onEvent (start the stop/start
+    # and return) plus an isComplete entry point polled by the provider.
+    return os.environ.get('WAIT_MODE') == 'async'
+
+
+def pending_response(physical_resource_id, arn_type, arns, target_status):
+    # Custom resource responses are capped at 4 KB, so the ARNs (which share
+    # the same arn:aws:dms:<region>:<account>:<type> prefix) are sent as IDs.
+    arns = sorted(arns)
+    return {
+        'PhysicalResourceId': physical_resource_id,
+        'Status': 'SUCCESS',
+        'Data': {
+            'ArnType': arn_type,
+            'ArnPrefix': arns[0].rpartition(':')[0],
+            'ReplicationIds': ','.join(arn.rpartition(':')[2] for arn in arns),
+            'TargetStatus': target_status
+        }
+    }
+
+
+def check_complete(dms, event):
+    # The provider framework passes the onEvent response fields to isComplete,
+    # so 'Data' carries what onEvent asked to wait for.
+    data = event.get('Data') or {}
+    arns = [data['ArnPrefix'] + ':' + replication_id
+            for replication_id in data.get('ReplicationIds', '').split(',') if replication_id]
+    if not arns:
+        return {'IsComplete': True}
+    if data.get('ArnType') == 'config':
+        statuses = get_dms_replication_statuses(dms, arns)
+    else:
+        statuses = get_dms_replication_task_statuses(dms, arns)
+    print(f'DMS status: {json.dumps(statuses)}')
+    # an ARN DMS no longer returns never reaches the target status: on Delete the
+    # task or config is gone, otherwise waiting for it would only end at the
+    # provider's total timeout
+    missing = sorted(arn for arn, status in statuses.items() if status is None)
+    if missing and event.get('RequestType') != 'Delete':
+        raise Exception(f'DMS no longer returns {missing} while waiting for {data.get("TargetStatus")}')
+    failed = {arn: status for arn, status in statuses.items() if status in TERMINAL_FAILURE_STATES}
+    if failed:
+        raise Exception(f'DMS {failed} while waiting for {data.get("TargetStatus")}')
+    return {'IsComplete': all(status == data.get('TargetStatus') for status in statuses.values() if status is not None)}
@@ -0,0 +1,132 @@
+import hashlib
+import json
+
+# CloudWatch dashboards are laid out on a 24 column grid. PutDashboard rejects
+# bodies larger than 1 MB and dashboards with more than 500 widgets.
+GRID_WIDTH = 24
+MAX_DASHBOARD_BODY_BYTES = 1024 * 1024
+MAX_DASHBOARD_WIDGETS = 500
+
+
+class DashboardLimitError(ValueError):
+    pass
+
+
+def body_hash(body):
+    # hash of the canonical JSON, so bodies that only differ in formatting or key
+    # order (GetDashboard does not return the body byte for byte) compare equal
+    canonical = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def dashboard_url(name, region):
+    return 'https://{0}.console.aws.amazon.com/cloudwatch/home?region={0}#dashboards:name={1}'.format(region, name)
+
+
+class Widget:
+    def __init__(self, widget_type, width, height, properties):
+        if not 0 < width <= GRID_WIDTH:
+            raise ValueError('widget width must be between 1 and {}, got {}'.format(GRID_WIDTH, width))
+        self.type = widget_type
+        self.width = width
+        self.height = height
+        self.properties = properties
+        self.x = None
+        self.y = None
+
+    def to_dict(self):
+        return {'type': self.type, 'x': self.x, 'y': self.y, 'width': self.width,
+                'height': self.height, 'properties': self.properties}
+
+
+class TextWidget(Widget):
+    def __init__(self, markdown, width=GRID_WIDTH, height=1):
+        super().__init__('text', width, height, {'markdown': markdown})
+
+
+class MetricWidget(Widget):
+    # metrics are given in full, e.g. ["AWS/DMS", "CPUUtilization", "ReplicationInstanceIdentifier", ri_id],
+    # optionally followed by a rendering options dict, and compacted on output
+    def __init__(self, title, metrics, region, width=6, height=6, view='timeSeries', **properties):
+        properties.update({'title': title, 'region': region, 'view': view, 'metrics': compact_metrics(metrics)})
+        if view == 'timeSeries':
+            properties.setdefault('stacked', False)
+        super().__init__('metric', width, height, properties)
+
+
+class LogWidget(Widget):
+    def __init__(self, title, query, region, width=GRID_WIDTH, height=6, view='table', **properties):
+        properties.update({'title': title, 'region': region, 'view': view, 'query': query})
+        properties.setdefault('stacked', False)
+        super().__init__('log', width, height, properties)
+
+
+def compact_metrics(metrics):
+    # Use the dashboard shorthand for repeated values: "." repeats the value at the
+    # same position of the previous metric and ["...", last] repeats every value
+    # but the last one. Keeps bodies small when many tasks share a graph.
+    compacted = []
+    previous = None
+    for metric in metrics:
+        values = [v for v in metric if not isinstance(v, dict)]
+        options = [v for v in metric if isinstance(v, dict)]
+        if previous is None or 'expression' in (options[0] if options else {}):
+            compacted.append(list(metric))
+        elif not options and len(values) == len(previous) and values[:-1] == previous[:-1]:
+            compacted.append(['...', values[-1]])
+        else:
+            row = [v if i >= len(previous) or v != previous[i] else '.' for i, v in enumerate(values)]
+            compacted.append(row + options)
+        if values:
+            previous = values
+    return compacted
+
+
+class Dashboard:
+    # Flow layout: widgets are placed left to right and wrap to a new row when the
+    # grid width is exceeded. A row is as tall as its tallest widget.
+    def __init__(self):
+        self.widgets = []
+        self.x = 0
+        self.y = 0
+        self.row_height = 0
+
+    def new_row(self):
+        self.y += self.row_height
+        self.x = 0
+        self.row_height = 0
+
+    def add(self, widget):
+        if self.x + widget.width > GRID_WIDTH:
+            self.new_row()
+        widget.x = self.x
+        widget.y = self.y
+        self.x += widget.width
+        self.row_height = max(self.row_height, widget.height)
+        self.widgets.append(widget)
+        return widget
+
+    def add_row(self, *widgets):
+        # starts a new row, so a section never shares a row with the previous one
+        self.new_row()
+        for widget in widgets:
+            self.add(widget)
+        self.new_row()
+
+    @property
+    def height(self):
+        return self.y + self.row_height
+
+    def to_dict(self):
+        return {'widgets': [widget.to_dict() for widget in self.widgets]}
+
+    def to_json(self, max_bytes=MAX_DASHBOARD_BODY_BYTES, max_widgets=MAX_DASHBOARD_WIDGETS):
+        # serialised once; limits are checked here so an oversized dashboard fails
+        # before PutDashboard is called
+        if len(self.widgets) > max_widgets:
+            raise DashboardLimitError('dashboard has {} widgets, the limit is {}'.format(len(self.widgets), max_widgets))
+        body = json.dumps(self.to_dict(), separators=(',', ':'))
+        size = len(body.encode('utf-8'))
+        if size > max_bytes:
+            raise DashboardLimitError('dashboard body is {} bytes, the limit is {}'.format(size, max_bytes))
+        return body
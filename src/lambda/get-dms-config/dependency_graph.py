@@ -0,0 +1,57 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class CyclicDependencyError(ValueError):
+    pass
+
+
+def run_graph(stages, max_workers=8, clock=time.perf_counter):
+    # stages: {name: (function, [names of the stages it depends on])}. Each function is
+    # called with a dict of its dependencies' results as soon as they are all available,
+    # so independent stages run concurrently. Returns (results, timings) where timings
+    # holds the start offset and duration of every stage in milliseconds. The first
+    # failing stage cancels whatever has not started yet and its exception is raised.
+    for name, (_, dependencies) in stages.items():
+        unknown = [d for d in dependencies if d not in stages]
+        if unknown:
+            raise ValueError('stage {} depends on unknown stages {}'.format(name, unknown))
+
+    results = {}
+    timings = {}
+    started = clock()
+
+    def run(name):
+        function, dependencies = stages[name]
+        stage_start = clock()
+        try:
+            return function({d: results[d] for d in dependencies})
+        finally:
+            timings[name] = {'StartMs': round((stage_start - started) * 1000, 1),
+                             'DurationMs': round((clock() - stage_start) * 1000, 1)}
+
+    pending = dict(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in [n for n, (_, deps) in pending.items() if all(d in results for d in deps)]:
+                running[executor.submit(run, name)] = name
+                del pending[name]
+            if not running:
+                raise CyclicDependencyError('stages {} can never run'.format(sorted(pending)))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                logger.info('stage {} finished in {} ms'.format(name, timings[name]['DurationMs']))
+
+    timings['Total'] = {'StartMs': 0.0, 'DurationMs': round((clock() - started) * 1000, 1)}
+    return results, timings
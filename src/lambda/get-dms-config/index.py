@@ -1,173 +1,213 @@
+import hashlib
 import json
 import cfnresponse
+import clients
 import logging
 import traceback
-import boto3
-import botocore
+from botocore.exceptions import ClientError
+import instrumentation
 import os
 import re
+from dependency_graph import run_graph
+from dashboard import Dashboard, DashboardLimitError, LogWidget, MetricWidget, TextWidget, body_hash, dashboard_url
 from datetime import datetime
 
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-DASHBOARD_H1 = 0
-current_y = DASHBOARD_H1
 riArn = os.environ['RI_ARN']
 numTasks = os.environ['NUM_TASKS']
 stackName = os.environ['STACK_NAME']
 region = os.environ['REGION']
-
-def generate_ri_metrics(y, ri_id):
-    d_ri = '{"widgets": [{"height": 3,"width": 24,"y": '+str(y)+',"x": 0,"type": "text","properties": {"markdown": "# DMS Dashboard for Replication Instance '+ri_id+' \n## Replication Instance Metrics \n- Instance Class Scaling Up (Out): high CPU, low freeable memory and high swap usage (swap usage > 0) \n- Storage Scaling Up (Out): low free storage and high disk queue depth, especially when migrating or replication more data (more network receive or transit throughput)."}},{"height": 6,"width": 6,"y": '+str(y+3)+',"x": 0,"type": "metric","properties": {"view": "timeSeries","stacked": false,"metrics": [[ "AWS/DMS", "CPUUtilization", "ReplicationInstanceIdentifier", "'+ri_id+'" ]],"region": "' + region + '","title": "RI CPU Utilization"}},{"height": 6,"width": 6,"y": '+str(y+3)+',"x": 6,"type": "metric","properties": {"metrics": [[ "AWS/DMS", "FreeableMemory", "ReplicationInstanceIdentifier", "'+ri_id+'" ],[ ".", "SwapUsage", ".", ".", { "yAxis": "right" } ]],"view": "timeSeries","stacked": false,"region": "' + region + '","stat": "Average","period": 300,"title": "RI Memory Utilization"}},{"height": 6,"width": 6,"y": '+str(y+3)+',"x": 18,"type": "metric","properties": {"metrics": [[ "AWS/DMS", "NetworkTransmitThroughput", "ReplicationInstanceIdentifier", "'+ri_id+'" ],[ ".", "NetworkReceiveThroughput", ".", "." ],[ ".", "DiskQueueDepth", ".", ".", { "yAxis": "right" } ]],"view": "timeSeries","stacked": false,"region": "' + region + '","stat": "Average","period": 60,"title": "Migration Workloads"}},{"height": 6,"width": 6,"y": '+str(y+3)+',"x": 12,"type": "metric","properties": {"view": "timeSeries","stacked": false,"region": "' + region + '","stat": "Average","period": 60,"title": "RI Free Storage","metrics": [[ "AWS/DMS", "FreeStorageSpace", "ReplicationInstanceIdentifier", "'+ri_id+'" ]]}},'
-
-    global current_y 
-    current_y = y+3+6
-
-    return d_ri
-
-def generate_validation_metrics(y, ri_id): ##\''''+ri_id+'''\'
-    q = ['''SELECT SUM(\\"Table completed\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''','''SELECT SUM(\\"Validated\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifi''','''SELECT SUM(\\"Table error\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''', '''SELECT SUM(\\"Pending records\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''','''SELECT SUM(\\"No primary Key\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''','''SELECT SUM(\\"Not enabled\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''','''SELECT SUM(\\"ValidationSuspendedRecords\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''','''SELECT SUM(\\"ValidationFailedRecords\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''', '''SELECT SUM(\\"ValidationPendingRecords\\")\n  FROM SCHEMA(\\"CustomMetrics/DMS\\", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = '%s'\n GROUP BY ReplicationInstanceIdentifier''']
-
-    d_val_1 = '''{"type": "text","x": 0,"y": '''+str(y)+''',"width": 15,"height": 2,"properties": {"markdown": "## Table Counts per Validation State\nNumber of tables in varied validation state in the most recent three hours ([CloudWatch Metrics Insights currently allow only 3 hours](https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/cloudwatch-metrics-insights-limits.html))."}},{"type": "text","x": 15,"y": '''+str(y)+''',"width": 9,"height": 2,"properties": {"markdown": "## Record Counts per Validation State\nTotal number of records for all tables in varied validation state in the most recent three hours ([CloudWatch Metrics Insights currently allow only 3 hours](https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/cloudwatch-metrics-insights-limits.html))."}},'''
-
-    w = [2,2,2,3,3,3,3,3,3]
-    x = 0
-    titles = ['Tables Completed','Validated','Table error','Pending Records','Validation Missing PK','Validation Not Enabled','ValidationSuspendedRecords','ValidationFailedRecords','ValidationPendingRecords']
-    d_val = ''
-    for i in range(9):
-        d_val = d_val + '''{"height": 3,"width": '''+str(w[i])+''',"y": '''+str(y+3)+''',"x":'''+str(x)+''',"type": "metric","properties": {"metrics": [[ { "expression": "'''+q[i].replace('%s',ri_id,1)+'''", "label": "", "id": "q1", "region": "''' + region + '''" } ]],"view": "singleValue","region": "''' + region + '''","title": "'''+titles[i]+'''","yAxis": {"left": {"label": "Count","showUnits": false}},"stat": "Average","period": 300}},'''
-        x = w[i]+x
-
-    d_val = d_val_1+d_val
-
-    global current_y 
-    current_y = y+3+3
-
-    return d_val
-
-def generate_task_metrics(y, ri_id, task_external_ids):
-    ## ${AWS::Region}, y = 14
+## tasks beyond this (or beyond what fits the PutDashboard limits) are split over linked dashboards
+MAX_TASKS_PER_DASHBOARD = int(os.environ.get('TASKS_PER_DASHBOARD', 20))
+## explicit: one metric line per task; search: SEARCH() expressions that pick up every task of the
+## replication instance, so the dashboard size does not grow with the number of tasks
+TASK_METRICS_EXPLICIT = 'explicit'
+TASK_METRICS_SEARCH = 'search'
+TASK_METRICS_MODE = os.environ.get('TASK_METRICS_MODE', TASK_METRICS_EXPLICIT)
+DASHBOARD_NAME = 'CFN-' + stackName + '-DMS-Dashboard'
+DISCOVERY_WORKERS = 4
+RDS_FILTER_CHUNK = 100
+
+RI_DESCRIPTION = ' \n## Replication Instance Metrics \n- Instance Class Scaling Up (Out): high CPU, low freeable memory and high swap usage (swap usage > 0) \n- Storage Scaling Up (Out): low free storage and high disk queue depth, especially when migrating or replication more data (more network receive or transit throughput).'
+TABLE_VALIDATION_DESCRIPTION = '## Table Counts per Validation State\nNumber of tables in varied validation state in the most recent three hours ([CloudWatch Metrics Insights currently allow only 3 hours](https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/cloudwatch-metrics-insights-limits.html)).'
+RECORD_VALIDATION_DESCRIPTION = '## Record Counts per Validation State\nTotal number of records for all tables in varied validation state in the most recent three hours ([CloudWatch Metrics Insights currently allow only 3 hours](https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/cloudwatch-metrics-insights-limits.html)).'
+TASK_METRICS_DESCRIPTION = '## Task Metrics \n**CDC Latency Definition**\n- CDC Source Latency: Latency between source and replication instance.\n- CDC Target Latency: Latency between source and target. Thus, CDC Target Latency >= CDC Source Latency\n\n**Identify CDC Latency**\n- CDC Source Latency >> 0 and CDC Source Latency = CDC Target Latency : focus on **source** latency\nCDC Source Latency \n  - [Mitigate CDC Source Latency](https://aws.amazon.com/premiumsupport/knowledge-center/dms-high-source-latency/)\n- CDC Source Latency = 0 and CDC Target Latency >> 0: focus on **target** latency\nCDC Source Latency \n  - Incoming changes spikes together with CDC Target Latency\n  - CDCChangesTargetDisk spikes as CDC changes queued up and are saved to disk\n  - [Mitigate CDC target latency](https://aws.amazon.com/premiumsupport/knowledge-center/dms-high-target-latency/)\n\n**Task Recovery**\n\nTask repeatedly recovers indicates that some issue is not able to self healed and need manual intervention. Situations like source or target database downtime, connectivity issue, etc.'
+TASK_ERRORS_DESCRIPTION = '## Task Errors \n\n**Logging Level**\n- T: Trace messages are written to the log.\n- D: Debug messages are written to the log.\n- I: Informational messages are written to the log.\n- W: Warnings are written to the log.\n- E: Error messages are written to the log.\n\n**Logging Components**\n- **FILE_FACTORY** – The file factory manages files used for batch apply and batch load, and manages Amazon S3 endpoints.\n- **METADATA_MANAGER** – The metadata manager manages source and target metadata, partitioning, and table state during replication.\n- **SORTER** – The SORTER receives incoming events from the SOURCE_CAPTURE process. The events are batched in transactions, and passed to the TARGET_APPLY service component. If the SOURCE_CAPTURE process produces events faster than the TARGET_APPLY component can consume them, the SORTER component caches the backlogged events to disk or to a swap file. Cached events are a common cause for running out of storage in replication instances. The SORTER service component manages cached events, gathers CDC statistics, and reports task latency.\n- **SOURCE_CAPTURE** – Ongoing replication (CDC) data is captured from the source database or service, and passed to the SORTER service component.\n- **SOURCE_UNLOAD** – Data is unloaded from the source database or service during Full Load.\n- **TABLES_MANAGER** — The table manager tracks captured tables, manages the order of table migration, and collects table statistics.\n- **TARGET_APPLY** – Data and data definition language (DDL) statements are applied to the target database.\n- **TARGET_LOAD** – Data is loaded into the target database.\n- **TASK_MANAGER** – The task manager manages running tasks, and breaks tasks down into sub-tasks for parallel data processing.\n- **TRANSFORMATION** – Table-mapping transformation events. For more information, see Using table mapping to specify task settings.\n- **VALIDATOR/ VALIDATOR_EXT** – The VALIDATOR service component verifies that data was migrated accurately from the source to the target. For more information, see Data validation. \n\n[More details](https://docs.aws.amazon.com/dms/latest/userguide/CHAP_Tasks.CustomizingTasks.TaskSettings.Logging.html)'
+
+## (title, custom metric summed by the Metrics Insights query, widget width)
+VALIDATION_WIDGETS = [
+    ('Tables Completed', 'Table completed', 2),
+    ('Validated', 'Validated', 2),
+    ('Table error', 'Table error', 2),
+    ('Pending Records', 'Pending records', 3),
+    ('Validation Missing PK', 'No primary Key', 3),
+    ('Validation Not Enabled', 'Not enabled', 3),
+    ('ValidationSuspendedRecords', 'ValidationSuspendedRecords', 3),
+    ('ValidationFailedRecords', 'ValidationFailedRecords', 3),
+    ('ValidationPendingRecords', 'ValidationPendingRecords', 3)
+]
+VALIDATION_QUERY = 'SELECT SUM("%s")\n  FROM SCHEMA("CustomMetrics/DMS", ReplicationInstanceIdentifier, ReplicationTaskIdentifier)\n WHERE ReplicationInstanceIdentifier = \'%s\'\n GROUP BY ReplicationInstanceIdentifier'
+
+def dms_metric(metric_name, ri_id, task_id=None, options=None):
+    metric = ["AWS/DMS", metric_name, "ReplicationInstanceIdentifier", ri_id]
+    if task_id is not None:
+        metric += ["ReplicationTaskIdentifier", task_id]
+    if options:
+        metric.append(options)
+    return metric
+
+def dms_search(metric_name, ri_id, expression_id, stat='Average', period=60, options=None):
+    ## every task metric of the replication instance, labelled by task
+    expression = "SEARCH('{AWS/DMS,ReplicationInstanceIdentifier,ReplicationTaskIdentifier} MetricName=\"%s\" ReplicationInstanceIdentifier=\"%s\"', '%s', %d)" % (metric_name, ri_id, stat, period)
+    return dms_expression(expression, expression_id, "${PROP('Dim.ReplicationTaskIdentifier')} " + metric_name, options)
+
+def dms_expression(expression, expression_id, label, options=None):
+    metric = {"expression": expression, "id": expression_id, "label": label, "region": region}
+    metric.update(options or {})
+    return [metric]
+
+def generate_ri_metrics(dashboard, ri_id):
+    dashboard.add_row(TextWidget('# DMS Dashboard for Replication Instance '+ri_id+RI_DESCRIPTION, height=3))
+    dashboard.add_row(
+        MetricWidget('RI CPU Utilization', [dms_metric('CPUUtilization', ri_id)], region),
+        MetricWidget('RI Memory Utilization', [
+            dms_metric('FreeableMemory', ri_id),
+            dms_metric('SwapUsage', ri_id, options={"yAxis": "right"})], region, stat='Average', period=300),
+        MetricWidget('RI Free Storage', [dms_metric('FreeStorageSpace', ri_id)], region, stat='Average', period=60),
+        MetricWidget('Migration Workloads', [
+            dms_metric('NetworkTransmitThroughput', ri_id),
+            dms_metric('NetworkReceiveThroughput', ri_id),
+            dms_metric('DiskQueueDepth', ri_id, options={"yAxis": "right"})], region, stat='Average', period=60))
+
+def generate_validation_metrics(dashboard, ri_id):
+    ## single values from CloudWatch Metrics Insights over the custom metrics published by dms-monitoring
+    dashboard.add_row(
+        TextWidget(TABLE_VALIDATION_DESCRIPTION, width=15, height=2),
+        TextWidget(RECORD_VALIDATION_DESCRIPTION, width=9, height=2))
+    widgets = []
+    for title, metric_name, width in VALIDATION_WIDGETS:
+        expression = {"expression": VALIDATION_QUERY % (metric_name, ri_id), "label": "", "id": "q1", "region": region}
+        widgets.append(MetricWidget(title, [[expression]], region, width=width, height=3, view='singleValue',
+                                    yAxis={"left": {"label": "Count", "showUnits": False}}, stat='Average', period=300))
+    dashboard.add_row(*widgets)
+
+def generate_task_metrics(dashboard, ri_id, task_external_ids):
     ## Task metric description
-    d_desc = '{"height": 8,"width": 24,"y": '+str(y)+',"x": 0,"type": "text","properties": {"markdown": "## Task Metrics \n**CDC Latency Definition**\n- CDC Source Latency: Latency between source and replication instance.\n- CDC Target Latency: Latency between source and target. Thus, CDC Target Latency >= CDC Source Latency\n\n**Identify CDC Latency**\n- CDC Source Latency >> 0 and CDC Source Latency = CDC Target Latency : focus on **source** latency\nCDC Source Latency \n  - [Mitigate CDC Source Latency](https://aws.amazon.com/premiumsupport/knowledge-center/dms-high-source-latency/)\n- CDC Source Latency = 0 and CDC Target Latency >> 0: focus on **target** latency\nCDC Source Latency \n  - Incoming changes spikes together with CDC Target Latency\n  - CDCChangesTargetDisk spikes as CDC changes queued up and are saved to disk\n  - [Mitigate CDC target latency](https://aws.amazon.com/premiumsupport/knowledge-center/dms-high-target-latency/)\n\n**Task Recovery**\n\nTask repeatedly recovers indicates that some issue is not able to self healed and need manual intervention. Situations like source or target database downtime, connectivity issue, etc."}},'
-    ## CPU metrics per task 
-    d_cpu_1 = '{"height": 6,"width": 6,"y": '+str(y+8)+',"x": 0,"type": "metric","properties": {"metrics": ['
-    ## Memory metrics per task
-    d_mem_1 = '{"height": 6,"width": 6,"y": '+str(y+8)+',"x": 6,"type": "metric","properties": {"metrics": ['
-    ## RecoveryCount metrics per task
-    d_rec_1 = '{"height": 6,"width": 6,"y": '+str(y+8)+',"x": 12,"type": "metric","properties": {"metrics": ['
-    ## Validation Issue
-    d_val_1 = '{"height": 6,"width": 6,"y": '+str(y+8)+',"x": 18,"type": "metric","properties": {"metrics": ['
+    dashboard.add_row(TextWidget(TASK_METRICS_DESCRIPTION, height=8))
+    ## CPU, memory, RecoveryCount and validation issues, one line per task
+    cpu, mem, rec, val, lag = [], [], [], [], []
+    for task_id in task_external_ids:
+        cpu.append(dms_metric('CPUUtilization', ri_id, task_id))
+        mem.append(dms_metric('MemoryUsageBytes', ri_id, task_id))
+        rec.append(dms_metric('RecoveryCount', ri_id, task_id))
+        val.append(dms_metric('ValidationFailedOverallCount', ri_id, task_id))
+        val.append(dms_metric('ValidationPendingOverallCount', ri_id, task_id))
+        lag.append(dms_metric('CDCLatencySource', ri_id, task_id))
+        lag.append(dms_metric('CDCLatencyTarget', ri_id, task_id))
+    dashboard.add_row(
+        MetricWidget('CPU Utilization by Tasks', cpu, region, stat='Average', period=60),
+        MetricWidget('Memory Usage by Tasks', mem, region, stat='Average', period=60),
+        MetricWidget('Task RecoveryCount', rec, region, stat='Average', period=60),
+        MetricWidget('Validation Issue', val, region, stat='Average', period=60))
     ## CDC latency per tasks
-    d_lag_1 = '{"height": 6,"width": 24,"y": '+str(y+8+6)+',"x": 0,"type": "metric","properties": {"metrics": ['
-    ## CDC latency details for each task
-    d_lag_tasks = ''
-    d_common_1 = ''
-    d_cpu_2 = ''
-    d_mem_2 = ''
-    d_rec_2 = ''
-    d_val_2 = ''
-    d_lag_2 = ''
-    d_common_3 = '[ ".", "ValidationPendingOverallCount", ".", ".", ".", "." ]'
-    d_common_4 = ''
-    d_common_5 = '[ ".", "CDCLatencyTarget", ".", ".", ".", "." ]'
-    d_common_6 = ''
-    d_common_7 = '[ ".", "CDCLatencyTarget", ".", ".", ".", "." ],[ ".", "CDCIncomingChanges", ".", ".", ".", ".", { "yAxis": "right" } ],[ ".", "CDCChangesDiskTarget", ".", ".", ".", ".", { "yAxis": "right" } ],[ ".", "CDCChangesDiskSource", ".", ".", ".", ".", { "yAxis": "right" } ]],"view": "timeSeries","stacked": false,"region": "' + region + '","stat": "Average","period": 60,"title": "CDC Latency '
-    for i in range(0,len(task_external_ids)):
-        d_lag_tasks = d_lag_tasks + '{"height": 6,"width": 6,"y": '+str(y+8+6+6+int(i/4)*6)+',"x":'+str(i%4*6)+',"type": "metric","properties": {"metrics": ['
-        d_lag_tasks = d_lag_tasks + '[ "AWS/DMS", "CDCLatencySource", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],' + d_common_7 + task_external_ids[i]+'"}},'
-        if i == 0:
-            d_cpu_2 = d_cpu_2 + '[ "AWS/DMS", "CPUUtilization", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],'
-            d_mem_2 = d_mem_2 + '[ "AWS/DMS", "MemoryUsageBytes", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],'
-            d_rec_2 = d_rec_2 + '[ "AWS/DMS", "RecoveryCount", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],'
-            d_val_2 = d_val_2 + '[ "AWS/DMS", "ValidationFailedOverallCount", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],' + d_common_3 + ','
-            d_lag_2 = d_lag_2 + '[ "AWS/DMS", "CDCLatencySource", "ReplicationInstanceIdentifier", "'+ri_id+'","ReplicationTaskIdentifier", "'+task_external_ids[i]+'"],' + d_common_5 + ','
-        elif i > 0 and i < len(task_external_ids) - 1:
-            d_common_1 = d_common_1 + '[ "...", "'+task_external_ids[i]+'" ],'
-            d_common_4 = d_common_4 + '[ ".", "ValidationFailedOverallCount", ".", ".", ".", "'+task_external_ids[i]+'" ],'+d_common_3+','
-            d_common_6 = d_common_6 + '[ ".", "CDCLatencySource", ".", ".", ".", "'+task_external_ids[i]+'" ],'+d_common_5+','
-        else:
-            d_common_1 = d_common_1 + '[ "...", "'+task_external_ids[i]+'" ]'
-            d_common_4 = d_common_4 + '[ ".", "ValidationFailedOverallCount", ".", ".", ".", "'+task_external_ids[i]+'" ],' + d_common_3
-            d_common_6 = d_common_6 + '[ ".", "CDCLatencySource", ".", ".", ".", "'+task_external_ids[i]+'" ],' + d_common_5
-
-    d_common_2 = '],"view": "timeSeries","stacked": false,"region": "' + region + '","stat": "Average","period": 60,"title": "'
-
-    d_cpu_3 = 'CPU Utilization by Tasks"}}'
-    d_mem_3 = 'Memory Usage by Tasks"}}'
-    d_rec_3 = 'Task RecoveryCount"}}'
-    d_val_3 = 'Validation Issue"}}'
-    d_lag_3 = 'CDC Latency"}}'
-
-    d_cpu = d_cpu_1 + d_cpu_2 + d_common_1 + d_common_2 + d_cpu_3
-    d_mem = d_mem_1 + d_mem_2 + d_common_1 + d_common_2 + d_mem_3
-    d_rec = d_rec_1 + d_rec_2 + d_common_1 + d_common_2 + d_rec_3
-    d_val = d_val_1 + d_val_2 + d_common_4 + d_common_2 + d_val_3
-    d_lag = d_lag_1 + d_lag_2 + d_common_6 + d_common_2 + d_lag_3
-
-    ## input: task list; output dashboard json, current y
-    task_metrics_json = d_desc + d_cpu +','+ d_mem +','+ d_rec +','+ d_val + ','+ d_lag + ',' + d_lag_tasks
-
-    global current_y 
-    current_y = y+8+6+6+int(i/4)*6+6 ## current y = previous y + CPU & memory & recovery & validation + cdc latency + cdc latency for each task, each row = 6 in height
-
-    return task_metrics_json
-
-def generate_task_logs(y, ri_id):
-    ## input: task list; output dashboard json, current y
-    ## y = 40
+    dashboard.add_row(MetricWidget('CDC Latency', lag, region, width=24, stat='Average', period=60))
+    ## CDC latency details for each task, four per row
+    widgets = []
+    for task_id in task_external_ids:
+        widgets.append(MetricWidget('CDC Latency '+task_id, [
+            dms_metric('CDCLatencySource', ri_id, task_id),
+            dms_metric('CDCLatencyTarget', ri_id, task_id),
+            dms_metric('CDCIncomingChanges', ri_id, task_id, {"yAxis": "right"}),
+            dms_metric('CDCChangesDiskTarget', ri_id, task_id, {"yAxis": "right"}),
+            dms_metric('CDCChangesDiskSource', ri_id, task_id, {"yAxis": "right"})], region, stat='Average', period=60))
+    dashboard.add_row(*widgets)
+
+def generate_task_search_metrics(dashboard, ri_id):
+    ## same sections as generate_task_metrics built from SEARCH() and metric math, so new tasks
+    ## show up without regenerating the dashboard
+    dashboard.add_row(TextWidget(TASK_METRICS_DESCRIPTION, height=8))
+    dashboard.add_row(
+        MetricWidget('CPU Utilization by Tasks', [dms_search('CPUUtilization', ri_id, 'e1')], region, stat='Average', period=60),
+        MetricWidget('Memory Usage by Tasks', [dms_search('MemoryUsageBytes', ri_id, 'e1')], region, stat='Average', period=60),
+        MetricWidget('Task RecoveryCount', [dms_search('RecoveryCount', ri_id, 'e1')], region, stat='Average', period=60),
+        MetricWidget('Validation Issue', [
+            dms_search('ValidationFailedOverallCount', ri_id, 'e1'),
+            dms_search('ValidationPendingOverallCount', ri_id, 'e2')], region, stat='Average', period=60))
+    dashboard.add_row(MetricWidget('CDC Latency', [
+        dms_search('CDCLatencySource', ri_id, 'e1'),
+        dms_search('CDCLatencyTarget', ri_id, 'e2')], region, width=24, stat='Average', period=60))
+    ## replaces the per task latency widgets: the tasks furthest behind and the CDC backlog of all tasks
+    top_latency = dms_search('CDCLatencyTarget', ri_id, 'e1', options={"visible": False})
+    dashboard.add_row(
+        MetricWidget('Top 10 Tasks by CDC Target Latency', [
+            top_latency,
+            dms_expression('SORT(e1, MAX, DESC, 10)', 'e2', '${LABEL}')], region, width=12, stat='Average', period=60),
+        MetricWidget('CDC Incoming Changes', [dms_search('CDCIncomingChanges', ri_id, 'e1')], region, stat='Average', period=60),
+        MetricWidget('CDC Changes on Disk', [
+            dms_search('CDCChangesDiskSource', ri_id, 'e1'),
+            dms_search('CDCChangesDiskTarget', ri_id, 'e2')], region, stat='Average', period=60))
+
+def generate_task_logs(dashboard, ri_id):
     ## A table of DMS warnings and errors per log component
-    d_desc = '{"height": 12,"width": 24,"y": '+str(y)+',"x": 0,"type": "text","properties": {"markdown": "## Task Errors \n\n**Logging Level**\n- T: Trace messages are written to the log.\n- D: Debug messages are written to the log.\n- I: Informational messages are written to the log.\n- W: Warnings are written to the log.\n- E: Error messages are written to the log.\n\n**Logging Components**\n- **FILE_FACTORY** – The file factory manages files used for batch apply and batch load, and manages Amazon S3 endpoints.\n- **METADATA_MANAGER** – The metadata manager manages source and target metadata, partitioning, and table state during replication.\n- **SORTER** – The SORTER receives incoming events from the SOURCE_CAPTURE process. The events are batched in transactions, and passed to the TARGET_APPLY service component. If the SOURCE_CAPTURE process produces events faster than the TARGET_APPLY component can consume them, the SORTER component caches the backlogged events to disk or to a swap file. Cached events are a common cause for running out of storage in replication instances. The SORTER service component manages cached events, gathers CDC statistics, and reports task latency.\n- **SOURCE_CAPTURE** – Ongoing replication (CDC) data is captured from the source database or service, and passed to the SORTER service component.\n- **SOURCE_UNLOAD** – Data is unloaded from the source database or service during Full Load.\n- **TABLES_MANAGER** — The table manager tracks captured tables, manages the order of table migration, and collects table statistics.\n- **TARGET_APPLY** – Data and data definition language (DDL) statements are applied to the target database.\n- **TARGET_LOAD** – Data is loaded into the target database.\n- **TASK_MANAGER** – The task manager manages running tasks, and breaks tasks down into sub-tasks for parallel data processing.\n- **TRANSFORMATION** – Table-mapping transformation events. For more information, see Using table mapping to specify task settings.\n- **VALIDATOR/ VALIDATOR_EXT** – The VALIDATOR service component verifies that data was migrated accurately from the source to the target. For more information, see Data validation. \n\n[More details](https://docs.aws.amazon.com/dms/latest/userguide/CHAP_Tasks.CustomizingTasks.TaskSettings.Logging.html)"}},'
-    d_log = '''{"height": 6, "width": 24,"y": '''+str(y+12)+''',"x": 0,"type": "log","properties": { "query": "SOURCE 'dms-tasks-'''+ri_id+'''' | fields @logStream, @message\n| filter @message like /]E:/\n| filter @message not like /DATA_STRUCTURE/\n| parse @message \\"* [* ]*\\" as timestamp, logComponent, error\n| stats count(*) as countLogComponent by @logStream,logComponent\n| sort @logStream\n","region": "''' + region + '''","stacked": false,"title": "Error by log component: dms-tasks-'''+ri_id+'''","view": "table"}},'''
-    task_log_json = d_desc+d_log
+    dashboard.add_row(TextWidget(TASK_ERRORS_DESCRIPTION, height=12))
+    query = "SOURCE 'dms-tasks-"+ri_id+"' | fields @logStream, @message\n| filter @message like /]E:/\n| filter @message not like /DATA_STRUCTURE/\n| parse @message \"* [* ]*\" as timestamp, logComponent, error\n| stats count(*) as countLogComponent by @logStream,logComponent\n| sort @logStream\n"
+    dashboard.add_row(LogWidget('Error by log component: dms-tasks-'+ri_id, query, region))
 
-    global current_y 
-    current_y = y+12+6 ## y=58
 
-    return task_log_json
-
-
-def logs_by_tasks(y, ri_id, tasks_endponts, target_cluster_ids, ri_ips):
+def logs_by_tasks(dashboard, ri_id, tasks_endponts, target_cluster_ids, ri_ips):
     ## if target is mysql / postgresql, put DMS logs and DB logs together per task
     ## tasks_endponts: {"task_external_id":["endpoint_arn","endpoint_type","server_name","user_name","instance_id_extracted"]}
     ## target_cluster_ids: {"instance_id_extracted":"aurora_cluster_id"}, can be null
-    ## endpoint type supported: "mysql", "postgres", "mariadb", "aurora", "aurora-postgresql"
-    d_logs = ''
-    endpoint_types = ("mysql", "postgres", "mariadb", "aurora", "aurora-postgresql", "kinesis")
     logger.info("tasks_endponts")
     logger.info(tasks_endponts)
     for task in tasks_endponts:
-        d_desc = '{"height": 1,"width": 24,"y": '+str(y)+',"x": 0,"type": "text","properties": {"markdown": "## Task '+task+'\n"}},'
-        d_task_log = '''{"height": 9,"width": 24,"y": '''+str(y+1)+''',"x": 0,"type": "log","properties": {"query": "SOURCE 'dms-tasks-'''+ri_id+'''' | fields @message\n| filter @logStream like /'''+task+'''/\n| filter @message like /]E:/ or @message like /]W:/\n| filter @message not like /DATA_STRUCTURE/","region": "''' + region + '''","stacked": false,"title": "Error history: '''+task+'''","view": "table"}},'''
-        d_db_log = ''
-        if tasks_endponts[task][1] in endpoint_types:
-            logger.info("task")
-            logger.info(task)
-            cluster_id = -1
-            if tasks_endponts[task][4] != -1 and len(target_cluster_ids) != 0: ## Must be Aurora and found the resource from RDS
-                if tasks_endponts[task][4] in target_cluster_ids:
-                    cluster_id = target_cluster_ids[tasks_endponts[task][4]] ## Aurora instance endpoint provided to DMS endpoint
-                else: cluster_id = tasks_endponts[task][4] ## Aurora cluster endpoint provided to DMS endpoint
-            d_db_log = generate_db_logs(y+1+9,tasks_endponts[task][1],tasks_endponts[task][2],tasks_endponts[task][3],tasks_endponts[task][4],cluster_id,ri_ips) ## "server_name","user_name","instance_id_extracted","cluster_id" may be -1
-        d_logs = d_logs + d_desc + d_task_log + d_db_log
-        y = y+1+9+6
-
-    ## Remove the last , in the JSON
-    d_logs = d_logs[:-1]
-
-    global current_y 
-    current_y = y
-
-    return d_logs
-
-def generate_db_logs(y,endpoint_type,server_name,user_name,instance_id,cluster_id,ri_ips):
+        dashboard.add_row(TextWidget('## Task '+task+'\n'))
+        query = "SOURCE 'dms-tasks-"+ri_id+"' | fields @message\n| filter @logStream like /"+task+"/\n| filter @message like /]E:/ or @message like /]W:/\n| filter @message not like /DATA_STRUCTURE/"
+        dashboard.add_row(LogWidget('Error history: '+task, query, region, height=9))
+        db_log = db_log_for_task(task, tasks_endponts[task], target_cluster_ids, ri_ips)
+        if db_log is not None:
+            dashboard.add_row(db_log)
+
+def logs_for_all_tasks(dashboard, ri_id, tasks_endponts, target_cluster_ids, ri_ips, error_history=True):
+    ## search mode: one error history for every task and one log widget per distinct target database
+    if error_history:
+        dashboard.add_row(TextWidget('## Task Error History\n'))
+        query = "SOURCE 'dms-tasks-"+ri_id+"' | fields @logStream, @message\n| filter @message like /]E:/ or @message like /]W:/\n| filter @message not like /DATA_STRUCTURE/\n| sort @timestamp desc"
+        dashboard.add_row(LogWidget('Error history: dms-tasks-'+ri_id, query, region, height=9))
+    db_logs = {}
+    for task in tasks_endponts:
+        db_log = db_log_for_task(task, tasks_endponts[task], target_cluster_ids, ri_ips)
+        if db_log is not None:
+            db_logs.setdefault(db_log.properties['query'], db_log)
+    for db_log in db_logs.values():
+        dashboard.add_row(db_log)
+
+def db_log_for_task(task, task_endpoint, target_cluster_ids, ri_ips):
+    ## endpoint type supported: "mysql", "postgres", "mariadb", "aurora", "aurora-postgresql"
+    endpoint_types = ("mysql", "postgres", "mariadb", "aurora", "aurora-postgresql", "kinesis")
+    if task_endpoint[1] not in endpoint_types or task_endpoint[2] == -1:
+        return None
+    logger.info("task")
+    logger.info(task)
+    cluster_id = -1
+    if task_endpoint[4] != -1 and len(target_cluster_ids) != 0: ## Must be Aurora and found the resource from RDS
+        if task_endpoint[4] in target_cluster_ids:
+            cluster_id = target_cluster_ids[task_endpoint[4]] ## Aurora instance endpoint provided to DMS endpoint
+        else: cluster_id = task_endpoint[4] ## Aurora cluster endpoint provided to DMS endpoint
+    return generate_db_logs(task_endpoint[1],task_endpoint[2],task_endpoint[3],task_endpoint[4],cluster_id,ri_ips) ## "server_name","user_name","instance_id_extracted","cluster_id" may be -1
+
+def generate_db_logs(endpoint_type,server_name,user_name,instance_id,cluster_id,ri_ips):
     ## output: dms log per task, if target is rds/aurora mysql/postgresql, output db error log
     ## if connection string in scretes manager, then don't display
     ## check server name by RDS instance endpoint pattern
     p_rds = '([0-9a-zA-Z-]{1,63})(\\.[a-zA-Z0-9]+\\.)([a-z]{2}-(?:north|south|central|east|west)(?:east|west)?-[1-9])(\\.rds\\.amazonaws\\.com)'
     ## check server name by aurora cluster endpoint pattern
     p_aurora = '([0-9a-zA-Z-]{1,63})(\\.cluster\\-[a-zA-Z0-9]+\\.)([a-z]{2}-(?:north|south|central|east|west)(?:east|west)?-[1-9])(\\.rds\\.amazonaws\\.com)'
-    db_log = ''
+    db_log = None
+    ## filters postgres logs to the DMS user connecting from the replication instance
+    pg_filter = "| parse @message \"* UTC:*(*):*@*:[*]:*: *\" as @timestamp_utc, @ip, @port, @db_user, @db, @pid, @severity, @info\n| filter @severity in [\"ERROR\",\"WARNING\",\"FATAL\",\"PANIC\"]\n| filter @db_user=\""+str(user_name)+"\"\n| filter @ip in [\""+"\",\"".join(ri_ips)+"\"]\n| sort @timestamp desc\n| display @message\n| limit 20"
     ## TO DO: RDS/Aurora may not have error log published to CW. EnabledCloudwatchLogsExports:[Error]
     logger.info("cluster_id: ")
     logger.info(cluster_id)
@@ -181,24 +221,277 @@ def generate_db_logs(y,endpoint_type,server_name,user_name,instance_id,cluster_i
         if bool(re.match(p_rds,server_name)):
             logger.info('Not Aurora cluster specified for the DMS target endpoint, or it uses a customer DNS')
             if endpoint_type == 'mysql' or endpoint_type == 'mariadb':
-                db_log = '''{"height": 6,"width": 24,"y": '''+str(y)+''',"x": 0,"type": "log","properties": {"query": "SOURCE '/aws/rds/instance/'''+instance_id+'''/error' | fields @message\n| filter @logStream like \\"'''+instance_id+'''\\"\n| filter @message like \\"[Error]\\" or @message like \\"[Warning]\\"\n| sort @timestamp desc\n| limit 20","region": "''' + region + '''","stacked": false,"title": "Target Database Error Log","view": "table"}},'''
+                query = "SOURCE '/aws/rds/instance/"+instance_id+"/error' | fields @message\n| filter @logStream like \""+instance_id+"\"\n| filter @message like \"[Error]\" or @message like \"[Warning]\"\n| sort @timestamp desc\n| limit 20"
+                db_log = LogWidget('Target Database Error Log', query, region)
             elif endpoint_type == 'postgres':
-                db_log = '''{"height": 6,"width": 24,"y": '''+str(y)+''',"x": 0,"type": "log","properties": {"query": "SOURCE '/aws/rds/instance/'''+instance_id+'''/postgresql' | fields @message\n| filter @logStream like \\"'''+instance_id+'''\\"\n| parse @message \\"* UTC:*(*):*@*:[*]:*: *\\" as @timestamp_utc, @ip, @port, @db_user, @db, @pid, @severity, @info\n| filter @severity in [\\"ERROR\\",\\"WARNING\\",\\"FATAL\\",\\"PANIC\\"]\n| filter @db_user=\\"'''+user_name+'''\\"\n| filter @ip in [\\"'''+'''\\",\\"'''.join(ri_ips)+'''\\"]\n| sort @timestamp desc\n| display @message\n| limit 20","region": "''' + region + '''","title": "Target Database Error Log","view": "table"}},'''
+                query = "SOURCE '/aws/rds/instance/"+instance_id+"/postgresql' | fields @message\n| filter @logStream like \""+instance_id+"\"\n"+pg_filter
+                db_log = LogWidget('Target Database Error Log', query, region)
         else:
             logger.info('The "'+server_name+'" provided to the DMS target endpoint with endpoint type '+endpoint_type+' may be a custom DNS or not an actual Aurora nor RDS database. Cannot access to the error log.')
     else: ## Must be an Aurora cluster. If cluster_id != instance_id, it is aurora's instance ID provided to DMS endpoint
         if endpoint_type == 'aurora':
             ## if it is aurora cluster endpoint specified
             if cluster_id != -1:
-                db_log = '''{"height": 6,"width": 24,"y": '''+str(y)+''',"x": 0,"type": "log","properties": {"query": "SOURCE '/aws/rds/cluster/'''+cluster_id+'''/error' | fields @message\n| filter @message like \\"[Error]\\" or @message like \\"[Warning]\\"\n| sort @timestamp desc\n| limit 20","region": "''' + region + '''","stacked": false,"title": "Target Database Error Log","view": "table"}},'''
+                query = "SOURCE '/aws/rds/cluster/"+cluster_id+"/error' | fields @message\n| filter @message like \"[Error]\" or @message like \"[Warning]\"\n| sort @timestamp desc\n| limit 20"
+                db_log = LogWidget('Target Database Error Log', query, region)
         elif endpoint_type == 'aurora-postgresql':
-            db_log = '''{"height": 6,"width": 24,"y": '''+str(y)+''',"x": 0,"type": "log","properties": {"query": "SOURCE '/aws/rds/cluster/'''+cluster_id+'''/postgresql' | fields @message\n| parse @message \\"* UTC:*(*):*@*:[*]:*: *\\" as @timestamp_utc, @ip, @port, @db_user, @db, @pid, @severity, @info\n| filter @severity in [\\"ERROR\\",\\"WARNING\\",\\"FATAL\\",\\"PANIC\\"]\n| filter @db_user=\\"'''+user_name+'''\\"\n| filter @ip in [\\"'''+'''\\",\\"'''.join(ri_ips)+'''\\"]\n| sort @timestamp desc\n| display @message\n| limit 20","region": "''' + region + '''","title": "Target Database Error Log","view": "table"}},'''
+            query = "SOURCE '/aws/rds/cluster/"+cluster_id+"/postgresql' | fields @message\n"+pg_filter
+            db_log = LogWidget('Target Database Error Log', query, region)
         else:
             logger.info('Currently, only support displaying error logs for "mysql", "postgres", "mariadb", "aurora", "aurora-postgresql"')
 
     return db_log
 
+def dashboard_name(shard):
+    ## the first dashboard keeps the original name, the others get a numeric suffix
+    return DASHBOARD_NAME if shard == 0 else DASHBOARD_NAME + '-' + str(shard + 1)
+
+def generate_index(dashboard, ri_id, chunks, shard):
+    ## links between the dashboards of a replication instance split by task
+    lines = ['## Dashboards for Replication Instance ' + ri_id]
+    for n, chunk in enumerate(chunks):
+        label = 'Tasks {} - {}'.format(chunk[0], chunk[-1]) if len(chunk) > 1 else 'Task {}'.format(chunk[0])
+        if n == 0:
+            label = label + ' and replication instance metrics'
+        if n == shard:
+            lines.append('- **{}** (this dashboard)'.format(label))
+        else:
+            lines.append('- [{}]({})'.format(label, dashboard_url(dashboard_name(n), region)))
+    dashboard.add_row(TextWidget('\n'.join(lines), height=len(chunks) + 1))
+
+def generate_dashboard(ri_id, task_external_ids, tasks_endponts, target_cluster_ids, ri_ips, chunks=None, shard=0):
+    dashboard = Dashboard()
+    if chunks and len(chunks) > 1:
+        generate_index(dashboard, ri_id, chunks, shard)
+    if shard == 0:
+        # Generate RI metrics
+        generate_ri_metrics(dashboard, ri_id)
+        # Generate validation metrics
+        generate_validation_metrics(dashboard, ri_id)
+    # Generate task metrics for CloudWatch Dashboard JSON
+    if TASK_METRICS_MODE == TASK_METRICS_SEARCH:
+        if shard == 0:
+            generate_task_search_metrics(dashboard, ri_id)
+    else:
+        generate_task_metrics(dashboard, ri_id, task_external_ids)
+    if shard == 0:
+        # Generate a table of DMS warnings and errors per log component
+        generate_task_logs(dashboard, ri_id)
+    # Generate widgets for displaying DMS warnings and errors, and error logs from target database
+    chunk_endpoints = {task: tasks_endponts[task] for task in task_external_ids}
+    if TASK_METRICS_MODE == TASK_METRICS_SEARCH:
+        logs_for_all_tasks(dashboard, ri_id, chunk_endpoints, target_cluster_ids, ri_ips, shard == 0)
+    else:
+        logs_by_tasks(dashboard, ri_id, chunk_endpoints, target_cluster_ids, ri_ips)
+    return dashboard
+
+def generate_dashboards(ri_id, task_external_ids, tasks_endponts, target_cluster_ids, ri_ips):
+    ## returns [(dashboard_name, dashboard, dashboard_json)]. All tasks go on one dashboard when
+    ## they fit, otherwise the number of tasks per dashboard is halved until every shard fits
+    per_dashboard = max(1, min(len(task_external_ids), MAX_TASKS_PER_DASHBOARD))
+    if TASK_METRICS_MODE == TASK_METRICS_SEARCH:
+        ## the widgets no longer depend on the tasks, shard only when the limits require it
+        per_dashboard = max(1, len(task_external_ids))
+    while True:
+        chunks = [task_external_ids[i:i + per_dashboard] for i in range(0, len(task_external_ids), per_dashboard)]
+        try:
+            dashboards = []
+            for shard, chunk in enumerate(chunks):
+                dashboard = generate_dashboard(ri_id, chunk, tasks_endponts, target_cluster_ids, ri_ips, chunks, shard)
+                dashboards.append((dashboard_name(shard), dashboard, dashboard.to_json()))
+            return dashboards
+        except DashboardLimitError as e:
+            if per_dashboard == 1:
+                raise
+            logger.info('{} with {} tasks per dashboard, splitting further'.format(e, per_dashboard))
+            per_dashboard = (per_dashboard + 1) // 2
+
+def put_dashboard_if_changed(cw_client, name, dashboard_json):
+    ## returns (decision, validation messages); the put is skipped when the existing dashboard
+    ## has the same content, which keeps no-op stack updates fast and clear of PutDashboard throttling
+    new_hash = body_hash(dashboard_json)
+    try:
+        current = cw_client.get_dashboard(DashboardName=name)
+        decision = 'unchanged' if body_hash(current['DashboardBody']) == new_hash else 'updated'
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceNotFound':
+            raise
+        decision = 'created'
+    logger.info('Dashboard {} {} (sha256 {})'.format(name, decision, new_hash))
+    if decision == 'unchanged':
+        return decision, []
+    cw_response = cw_client.put_dashboard(
+        DashboardName=name,
+        DashboardBody=dashboard_json
+    )
+    logger.info(cw_response)
+    return decision, cw_response['DashboardValidationMessages']
+
+def delete_stale_dashboards(cw_client, dashboard_names):
+    ## removes shards left over from a previous deployment that needed more dashboards
+    stale = []
+    for page in cw_client.get_paginator('list_dashboards').paginate(DashboardNamePrefix=DASHBOARD_NAME + '-'):
+        for entry in page['DashboardEntries']:
+            suffix = entry['DashboardName'][len(DASHBOARD_NAME) + 1:]
+            if suffix.isdigit() and entry['DashboardName'] not in dashboard_names:
+                stale.append(entry['DashboardName'])
+    if stale:
+        logger.info('Deleting stale dashboards: {}'.format(stale))
+        cw_client.delete_dashboards(DashboardNames=stale)
+    return stale
+
+def describe_replication_instance(dms_client):
+    # Get RI information
+    ri_id = ''
+    ri_ips = []
+    ri_response = dms_client.describe_replication_instances(
+        Filters=[
+            {
+                'Name': 'replication-instance-arn',
+                'Values': [
+                    riArn
+                ]
+            }
+        ]
+    )
+    if len(ri_response['ReplicationInstances']) > 0:
+        logger.info('Replication instance found')
+        ri_id = ri_response['ReplicationInstances'][0]['ReplicationInstanceIdentifier']
+        ri_ips = ri_response['ReplicationInstances'][0]['ReplicationInstancePublicIpAddresses'] + \
+            ri_response['ReplicationInstances'][0]['ReplicationInstancePrivateIpAddresses']
+        ri_ips = [ip for ip in ri_ips if ip is not None]
+    return ri_id, ri_ips
+
+def describe_monitored_tasks(dms_client):
+    ## returns the task ids to monitor, newest first, and {"task_external_id":"target_endpoint_arn"}
+    replication_tasks = []
+    for page in dms_client.get_paginator('describe_replication_tasks').paginate(
+        Filters=[
+            {
+                'Name': 'replication-instance-arn',
+                'Values': [
+                    riArn
+                ]
+            }
+        ],
+        WithoutSettings=True
+    ):
+        replication_tasks.extend(page['ReplicationTasks'])
+
+    task_external_ids = []  # sorted by date
+    task_targets = {}
+    if len(replication_tasks) > 0:
+        logger.info('Replication tasks found')
+        tz = None
+        for task in replication_tasks:
+            if 'ReplicationTaskCreationDate' in task:
+                tz = task['ReplicationTaskCreationDate'].tzinfo
+                break
+        # use ReplicationTaskCreationDate to determine the latest task to monitor
+        tasks = sorted(replication_tasks, key=lambda x: x.get(
+            'ReplicationTaskCreationDate', datetime.now(tz)), reverse=True)
+        if int(numTasks) != 0:
+            tasks = tasks[:int(numTasks)]
+        for task in tasks:
+            task_id = task['ReplicationTaskArn'].split(':')[-1]
+            task_external_ids.append(task_id)
+            task_targets[task_id] = task['TargetEndpointArn']
+    return task_external_ids, task_targets
+
+def describe_target_endpoints(dms_client, target_endpoints):
+    ## {"endpoint_arn":["endpoint_type","server_name","user_name","instance_id_extracted"]} for the
+    ## distinct target endpoints, and the distinct instance ids to look up in RDS
+    endpoints = {}
+    target_endpoint_ids = []  # distinct target endpoint ids, can be null
+    target_supported = set(
+        ["mysql", "postgres", "mariadb", "aurora", "aurora-postgresql", "kinesis"])
+    if len(target_endpoints) == 0:
+        return endpoints, target_endpoint_ids
+    for page in dms_client.get_paginator('describe_endpoints').paginate(
+        Filters=[
+            {
+                'Name': 'endpoint-arn',
+                'Values': sorted(target_endpoints)
+            }
+        ]
+    ):
+        for endpoint in page['Endpoints']:
+            endpoints[endpoint['EndpointArn']] = [
+                endpoint['EngineName']]
+            if 'ServerName' in endpoint:
+                instance_id_extracted = endpoint['ServerName'].split('.')[
+                    0]
+                endpoints[endpoint['EndpointArn']].extend(
+                    [endpoint['ServerName'], endpoint['Username'], instance_id_extracted])
+                if endpoint['EngineName'] in target_supported and instance_id_extracted not in target_endpoint_ids:
+                    target_endpoint_ids.append(
+                        instance_id_extracted)
+            else:
+                logger.info(
+                    'Endpoint' + str(endpoint['EndpointArn']) + ' uses AWS Secrete Manager or IAM role for connection. Skip from printing DB logs.')
+                endpoints[endpoint['EndpointArn']].extend(
+                    [-1, -1, -1])
+    if len(endpoints) > 0:
+        logger.info('DMS endpoints found')
+    return endpoints, target_endpoint_ids
+
+def describe_target_clusters(rds_client, filter_name, target_endpoint_ids):
+    ## {"instance_id_extracted":"aurora_cluster_id"} for the RDS instances matching the ids
+    ## by instance identifier (filter_name db-instance-id) or cluster identifier (db-cluster-id)
+    target_cluster_ids = {}
+    for i in range(0, len(target_endpoint_ids), RDS_FILTER_CHUNK):
+        for page in rds_client.get_paginator('describe_db_instances').paginate(
+            Filters=[
+                {
+                    'Name': filter_name,
+                    'Values': target_endpoint_ids[i:i + RDS_FILTER_CHUNK]
+                }
+            ]
+        ):
+            for rds in page['DBInstances']:
+                if 'DBClusterIdentifier' in rds:
+                    target_cluster_ids[rds['DBInstanceIdentifier']
+                                       ] = rds['DBClusterIdentifier']
+    if len(target_cluster_ids) > 0:
+        logger.info('RDS instances found via ' + filter_name)
+    else:
+        logger.info('RDS instances not found via ' + filter_name + ' for the server names specified for the DMS endpoints')
+    return target_cluster_ids
+
+def join_targets(monitored_tasks, target_endpoints):
+    ## {"task_external_id":["endpoint_arn","endpoint_type","server_name","user_name","instance_id_extracted"]}
+    task_external_ids, task_targets = monitored_tasks
+    endpoints, _ = target_endpoints
+    tasks_endponts = {}
+    for task_id in task_external_ids:
+        endpoint_arn = task_targets[task_id]
+        tasks_endponts[task_id] = [endpoint_arn] + endpoints.get(endpoint_arn, [-1, -1, -1, -1])
+    return task_external_ids, tasks_endponts
+
+def discover_dms_config(dms_client, rds_client):
+    ## The RI and its tasks are described concurrently, endpoints once the tasks are known and
+    ## the two RDS lookups concurrently once the endpoints are known. Customer can select a mysql
+    ## or postgresql for aurora endpoints, and specify instance or cluster endpoints for aurora
+    ## target endpoints, hence the lookup by both identifiers.
+    stages = {
+        'replication_instance': (lambda r: describe_replication_instance(dms_client), []),
+        'tasks': (lambda r: describe_monitored_tasks(dms_client), []),
+        'endpoints': (lambda r: describe_target_endpoints(
+            dms_client, set(r['tasks'][1].values())), ['tasks']),
+        'rds_by_instance': (lambda r: describe_target_clusters(
+            rds_client, 'db-instance-id', r['endpoints'][1]), ['endpoints']),
+        'rds_by_cluster': (lambda r: describe_target_clusters(
+            rds_client, 'db-cluster-id', r['endpoints'][1]), ['endpoints']),
+        'targets': (lambda r: join_targets(r['tasks'], r['endpoints']), ['tasks', 'endpoints']),
+        'target_clusters': (lambda r: dict(r['rds_by_instance'], **r['rds_by_cluster']), ['rds_by_instance', 'rds_by_cluster']),
+    }
+    return run_graph(stages, max_workers=DISCOVERY_WORKERS)
+
+@instrumentation.instrumented
 def lambda_handler(event, context):
+    # boto3 is imported here rather than at init, the clients module needs it from now on anyway
+    import boto3
+    import botocore
     # boto3.session.Session().get_available_services()
     logger.info(boto3.__version__)
     logger.info(botocore.__version__)
@@ -217,188 +510,50 @@ def lambda_handler(event, context):
             responseData['CustStatus'] = 'update or Create'
             logger.info(str(responseData['CustStatus']))
             logger.info('boto3 setup')
-            dms_client = boto3.client('dms')
-            rds_client = boto3.client('rds')
-            cw_client = boto3.client('cloudwatch')
-
-            # Get RI information
-            ri_id = ''
-            ri_ips = []
-            ri_response = dms_client.describe_replication_instances(
-                Filters=[
-                    {
-                        'Name': 'replication-instance-arn',
-                        'Values': [
-                            riArn
-                        ]
-                    }
-                ]
-            )
-            if len(ri_response['ReplicationInstances']) > 0:
-                responseData['CustStatus'] = 'Replication instance found'
-                logger.info(str(responseData['CustStatus']))
-                ri_id = ri_response['ReplicationInstances'][0]['ReplicationInstanceIdentifier']
-                ri_ips = ri_response['ReplicationInstances'][0]['ReplicationInstancePublicIpAddresses'] + \
-                    ri_response['ReplicationInstances'][0]['ReplicationInstancePrivateIpAddresses']
-                if None in ri_ips:
-                    ri_ips.remove(None)
-
-            # Get task information for the given RI
-            task_response = dms_client.describe_replication_tasks(
-                Filters=[
-                    {
-                        'Name': 'replication-instance-arn',
-                        'Values': [
-                            riArn
-                        ]
-                    }
-                ],
-                MaxRecords=100,
-                WithoutSettings=True
-            )
-            # put target endpoints into set(), loop in set(), for each, put in {"endpoint":"engine_type"}
-            # {"task_external_id":["endpoint_arn","endpoint_type","server_name","user_name","instance_id_extracted"]}
-            tasks_endponts = {}
-            task_external_ids = []  # sorted by date
-            target_endpoints = set()  # distinct target endpoint ARNs
-            target_endpoint_ids = []  # distinct target endpoint ids, can be null
-            target_cluster_ids = {}  # {"instance_id_extracted":"aurora_cluster_id"}, can be null
-
-            if len(task_response['ReplicationTasks']) > 0:
-                responseData['CustStatus'] = 'Replication tasks found'
-                logger.info(str(responseData['CustStatus']))
-                tz = None
-                for task in task_response['ReplicationTasks']:
-                    if 'ReplicationTaskCreationDate' in task:
-                        tz = task['ReplicationTaskCreationDate'].tzinfo
-                        break
-                # use ReplicationTaskCreationDate to determine the latest task to monitor
-                tasks = sorted(task_response['ReplicationTasks'], key=lambda x: x.get(
-                    'ReplicationTaskCreationDate', datetime.now(tz)), reverse=True)
-                num = 0
-                for task in tasks:
-                    if num < int(numTasks) and num < len(tasks):
-                        task_id = task['ReplicationTaskArn'].split(':')[-1]
-                        task_external_ids.append(task_id)
-                        tasks_endponts[task_id] = [
-                            task['TargetEndpointArn']]
-                        target_endpoints.add(task['TargetEndpointArn'])
-                        num = num + 1
-                    else:
-                        break
-
-            endpoint_response = {}
-            if len(target_endpoints) > 0:
-                endpoint_response = dms_client.describe_endpoints(
-                    Filters=[
-                        {
-                            'Name': 'endpoint-arn',
-                            'Values': list(target_endpoints)
-                        }
-                    ]
-                )
-            # {"endpoint_arn":["endpoint_type","server_name","user_name","instance_id_extracted"]}
-            endpoints = {}
-            target_supported = set(
-                ["mysql", "postgres", "mariadb", "aurora", "aurora-postgresql", "kinesis"])
-            if len(endpoint_response['Endpoints']) > 0:
-                responseData['CustStatus'] = 'DMS endpoints found'
-                logger.info(str(responseData['CustStatus']))
-                for endpoint in endpoint_response['Endpoints']:
-                    endpoints[endpoint['EndpointArn']] = [
-                        endpoint['EngineName']]
-                    if 'ServerName' in endpoint:
-                        instance_id_extracted = endpoint['ServerName'].split('.')[
-                            0]
-                        endpoints[endpoint['EndpointArn']].extend(
-                            [endpoint['ServerName'], endpoint['Username'], instance_id_extracted])
-                        if endpoint['EngineName'] in target_supported:
-                            target_endpoint_ids.append(
-                                instance_id_extracted)
-                    else:
-                        logger.info(
-                            'Endpoint' + str(endpoint['EndpointArn']) + ' uses AWS Secrete Manager or IAM role for connection. Skip from printing DB logs.')
-                        endpoints[endpoint['EndpointArn']].extend(
-                            [-1, -1, -1])
-                for task in tasks_endponts:
-                    tasks_endponts[task].extend(
-                        endpoints[tasks_endponts[task][0]])
-
-            # Get RDS cluster endpoint
-            # Customer can select a mysql or postgresql for aurora endpoints, and specify instance endpiont for aurora target endpoints
-            if len(target_endpoint_ids) != 0:
-                rds_response = rds_client.describe_db_instances(
-                    Filters=[
-                        {
-                            'Name': 'db-instance-id',
-                            'Values': target_endpoint_ids
-                        }
-                    ]
-                )
-                if len(rds_response['DBInstances']) > 0:
-                    responseData['CustStatus'] = 'RDS instances found via instance identifier'
-                    logger.info(str(responseData['CustStatus']))
-                    for rds in rds_response['DBInstances']:
-                        if 'DBClusterIdentifier' in rds:
-                            target_cluster_ids[rds['DBInstanceIdentifier']
-                                                ] = rds['DBClusterIdentifier']
-                else:
-                    responseData['CustStatus'] = 'RDS instances not found via server name specified for the DMS endpoint'
-                    logger.info(str(responseData['CustStatus']))
-
-                # Customer can also specify cluster endpiont for aurora target endpoints
-                rds_response = rds_client.describe_db_instances(
-                    Filters=[
-                        {
-                            'Name': 'db-cluster-id',
-                            'Values': target_endpoint_ids
-                        }
-                    ]
-                )
-                if len(rds_response['DBInstances']) > 0:
-                    responseData['CustStatus'] = 'RDS instances found via cluster identifier'
-                    logger.info(str(responseData['CustStatus']))
-                    for rds in rds_response['DBInstances']:
-                        if 'DBClusterIdentifier' in rds:
-                            target_cluster_ids[rds['DBInstanceIdentifier']
-                                                ] = rds['DBClusterIdentifier']
-                else:
-                    responseData['CustStatus'] = 'RDS instances not found via server name specified for the DMS endpoint'
-                    logger.info(str(responseData['CustStatus']))
+            dms_client = clients.get_client('dms')
+            rds_client = clients.get_client('rds')
+            cw_client = clients.get_client('cloudwatch')
+
+            # Discover the RI, its tasks, their target endpoints and the RDS resources behind them.
+            # Independent describe calls run concurrently, see discover_dms_config
+            discovered, timings = discover_dms_config(dms_client, rds_client)
+            ri_id, ri_ips = discovered['replication_instance']
+            task_external_ids, tasks_endponts = discovered['targets']
+            target_cluster_ids = discovered['target_clusters']
+            # the details go to the log, responseData keeps to totals as the custom resource
+            # response is limited to 4 KB whatever the number of tasks
+            responseData['DiscoveryMs'] = timings['Total']['DurationMs']
+            logger.info('Discovery timings: {}'.format(timings))
 
             logger.info(tasks_endponts)
             logger.info(task_external_ids)
-            logger.info(target_endpoints)
-            logger.info(target_endpoint_ids)
             logger.info(target_cluster_ids)
 
             if len(tasks_endponts) > 0:
-                # Generate RI metrics
-                ri_metrics = generate_ri_metrics(current_y, ri_id)
-                # Generate validation metrics
-                val_metrics = generate_validation_metrics(current_y, ri_id)
-                # Generate task metrics for CloudWatch Dashboard JSON
-                task_metrics = generate_task_metrics(
-                    current_y, ri_id, task_external_ids)
-                # Generate a table of DMS warnings and errors per log component
-                task_log_recap = generate_task_logs(current_y, ri_id)
-                # Generate JSON for displaying DMS warnings and errors, and error logs from target database
-                task_db_logs = logs_by_tasks(
-                    current_y, ri_id, tasks_endponts, target_cluster_ids, ri_ips)
-                dashboard = ri_metrics+val_metrics+task_metrics+task_log_recap+task_db_logs+']}'
-                logger.info("Dashboard json")
-                logger.info(dashboard)
-                dashboard_json = json.dumps(
-                    json.loads(dashboard, strict=False))
-                logger.info(dashboard_json)
-
-                cw_response = cw_client.put_dashboard(
-                    DashboardName='CFN-' +
-                    stackName +'-DMS-Dashboard',
-                    DashboardBody=dashboard_json
-                )
-                logger.info(cw_response)
-                if len(cw_response['DashboardValidationMessages']) == 0:
+                # serialised once per dashboard, fails here if a shard cannot fit the PutDashboard limits
+                dashboards = generate_dashboards(
+                    ri_id, task_external_ids, tasks_endponts, target_cluster_ids, ri_ips)
+                dashboard_names = [name for name, _, _ in dashboards]
+                logger.info('Dashboards: {}'.format(dashboard_names))
+                responseData['DashboardCount'] = len(dashboard_names)
+                responseData['DashboardNamesHash'] = hashlib.sha256(
+                    ','.join(dashboard_names).encode('utf-8')).hexdigest()[:16]
+                responseData['DashboardWidgets'] = sum(len(dashboard.widgets) for _, dashboard, _ in dashboards)
+                responseData['DashboardBodyBytes'] = max(len(body.encode('utf-8')) for _, _, body in dashboards)
+
+                validation_messages = []
+                decisions = {}
+                for name, dashboard, dashboard_json in dashboards:
+                    logger.info("Dashboard {} json: {} widgets, {} bytes".format(
+                        name, len(dashboard.widgets), len(dashboard_json.encode('utf-8'))))
+                    logger.info(dashboard_json)
+                    decisions[name], messages = put_dashboard_if_changed(cw_client, name, dashboard_json)
+                    validation_messages.extend(messages)
+                logger.info('Dashboard updates: {}'.format(json.dumps(decisions, sort_keys=True)))
+                responseData['DashboardsChanged'] = str(sum(1 for d in decisions.values() if d != 'unchanged'))
+                delete_stale_dashboards(cw_client, dashboard_names)
+
+                if len(validation_messages) == 0:
                     responseData['CustStatus'] = 'DMS Dashboard created successfully'
                     logger.info(str(responseData['CustStatus']))
                     responseData['DashboardName'] = stackName + \
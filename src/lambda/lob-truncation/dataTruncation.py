@@ -1,7 +1,13 @@
-import boto3, json 
+import alarm_coalescer
+import clients
 from botocore.exceptions import ClientError
 import datetime  
-import logging, sys, os
+import logging, sys, os, threading
+import instrumentation
+import knowledge_base
+import lob_profile
+import log_scanner
+import notification_renderer
 
 def set_logger(logger_level):
     global logger 
@@ -12,105 +18,115 @@ def set_logger(logger_level):
         logger.setLevel(logging.CRITICAL)
     return logger
 
-def get_error_treatment(bucket_issue_resolution,issue_resolution,expression):
-    s3_client = boto3.client('s3')   
-    
-    ## load from central DB, which is now S3
+## seconds between ETag checks of the issue resolution CSV; ISSUE_RESOLUTION_FILE reads a local copy instead of S3
+ISSUE_RESOLUTION_REFRESH = int(os.environ.get('ISSUE_RESOLUTION_REFRESH', knowledge_base.DEFAULT_REFRESH_SECONDS))
+ISSUE_RESOLUTION_FILE = os.environ.get('ISSUE_RESOLUTION_FILE')
+
+def get_error_treatment(bucket_issue_resolution,issue_resolution,issue_type):
+    ## load from central DB, which is now S3, once per container and look the issue type up in memory
     global error_treatment
     try:
-        results = s3_client.select_object_content(
-            Bucket=bucket_issue_resolution,
-            Key=issue_resolution,
-            Expression=expression,
-            ExpressionType='SQL',
-            InputSerialization={
-                'CSV': {
-                    'FileHeaderInfo': 'USE',
-                    ##'QuoteEscapeCharacter': 'string',
-                    'RecordDelimiter': '\n',
-                    'FieldDelimiter': ',',
-                    ##'QuoteCharacter': 'string',
-                    'AllowQuotedRecordDelimiter': True
-                }
-            },
-            OutputSerialization={
-                'JSON': {
-                    'RecordDelimiter': '\n'
-                }
-            }
-        )
-        
-        for result in results['Payload']:
-            if 'Records' in result:
-                error_treatment = str(result['Records']['Payload'].decode('utf-8'))
-                logging.info(error_treatment)
-                error_treatment = json.loads(error_treatment)
-                logging.info(error_treatment['Log_Filter_Pattern'])
-                break
-                
+        resolutions = knowledge_base.get_knowledge_base(bucket_issue_resolution, issue_resolution, ISSUE_RESOLUTION_FILE, ISSUE_RESOLUTION_REFRESH)
+        error_treatment = resolutions.treatment(issue_type)
+        if error_treatment is None:
+            logger.info('No resolution for issue type '+issue_type+' in '+str(resolutions.source))
+            sys.exit()
+        logging.info(error_treatment['Log_Filter_Pattern'])
         return error_treatment
 
     except ClientError as e:
         logger.info(format(str(e)))
         sys.exit()
 
-def generate_customer_message (sns_message_parameters, error_type):
-    customer_message_head = ''
-    customer_message_body = ''
-    customer_message_recommendation = ''
-    customer_message_foot = ''
-
-    ## create Custom message and change timestamps
-    customer_message_head='You are receiving this email because your Amazon CloudWatch Alarm "'+sns_message_parameters['alarm_name']+'" in the '+sns_message_parameters['alarm_region']+' region has entered the '+sns_message_parameters['alarm_state']+' state, because "'+sns_message_parameters['alarm_reason']+'" at '+sns_message_parameters['alarm_timestamp'] +'.\n'
-    
-    ## add Console link https://us-east-1.console.aws.amazon.com/dms/v2/home?region=us-east-1#replicationInstanceDetails/dms-346-2
-    customer_message_head=customer_message_head+'\nView DMS tasks associated with this alarm in the AWS Management Console: \n'+ 'https://'+sns_message_parameters['alarm_region']+'.console.aws.amazon.com/dms/v2/home?region='+sns_message_parameters['alarm_region']+'#replicationInstanceDetails/'+sns_message_parameters['ri_name']+'\n'
-
-    if error_type == 'TRUNCATION':
-        ## add log examples
-        customer_message_body = '\nLog examples:\n'+json.dumps(sns_message_parameters['logs_examples_truncated'],indent=4)+'\n'
-        
-        ## add LOB related settings
-        for task in sns_message_parameters['tasks']: ## extract task_external_id of each task in question
-            customer_message_body = customer_message_body + '\nTask ARN: '+sns_message_parameters['tasks'][task]['task_arn'] +':\n'
-            customer_message_body = customer_message_body + 'If LOB is enabled for task: '+str(sns_message_parameters['tasks'][task]['task_settings']['SupportLobs'])+'\n'
-            if sns_message_parameters['tasks'][task]['task_settings']['SupportLobs']:                
-                customer_message_body = customer_message_body + 'If LimitedSizeLobMode is used: '+str(sns_message_parameters['tasks'][task]['task_settings']['LimitedSizeLobMode'])+'\n'
-                customer_message_body = customer_message_body + 'LobMaxSize used: '+str(sns_message_parameters['tasks'][task]['task_settings']['LobMaxSize'])+' KB\n'
-            if "lob_setting_in_table_mapping" in sns_message_parameters['tasks'][task]:
-                customer_message_body = customer_message_body + 'Individual LOB setting in table mapping rules:\n'+json.dumps(sns_message_parameters['tasks'][task]['lob_setting_in_table_mapping'],indent=4)+'\n'
-                if "less_max_lob_in_table_mapping" in sns_message_parameters['tasks'][task]['task_settings'] and sns_message_parameters['tasks'][task]['task_settings']['less_max_lob_in_table_mapping']:
-                    customer_message_body = customer_message_body + 'Note: If both task setting and table mapping specified, table mapping overrides tasks setting. Note that the max LOB is smaller than the LobMaxSize in task setting, to which LOB is truncated to.\n'
-
-        ## add recommendations for LOB truncation errors. retrieve from the central database with the error signature. 
-        customer_message_recommendation = error_treatment['Resolution'] 
+## message size budget in bytes, within the SNS limit; when the message is cut and a location such as
+## s3://bucket/prefix/ is set, the complete report is stored there and linked from the message
+NOTIFICATION_BUDGET_BYTES = int(os.environ.get('NOTIFICATION_BUDGET_BYTES', notification_renderer.DEFAULT_BUDGET_BYTES))
+NOTIFICATION_REPORT_LOCATION = os.environ.get('NOTIFICATION_REPORT_LOCATION')
 
+def generate_customer_message (sns_message_parameters, error_type, coalesced=None):
+    ## add recommendations for LOB truncation errors. retrieve from the central database with the error signature. 
+    resolution = error_treatment['Resolution'] if error_type == 'TRUNCATION' else ''
     ## elif error_type == '':
         ## to do for other error cases
-    else:
-        customer_message_body = '\nLog examples:\n'+json.dumps(sns_message_parameters['logs_examples_truncated'],indent=4)+'\n'
-        customer_message_recommendation = ''
+    if error_type != 'TRUNCATION':
+        sns_message_parameters = dict(sns_message_parameters, tasks={})
+
+    customer_message, omitted = notification_renderer.render_message(sns_message_parameters, resolution, coalesced, budget=NOTIFICATION_BUDGET_BYTES)
+    if (omitted['tasks'] or omitted['examples']) and NOTIFICATION_REPORT_LOCATION:
+        logger.info('Notification cut to '+str(NOTIFICATION_BUDGET_BYTES)+' bytes, left out: '+str(omitted))
+        try:
+            report, _ = notification_renderer.render_message(sns_message_parameters, resolution, coalesced, budget=None)
+            report_link = notification_renderer.upload_report(
+                NOTIFICATION_REPORT_LOCATION, sns_message_parameters['ri_name']+'/'+sns_message_parameters['alarm_timestamp']+'.txt',
+                report, sns_message_parameters['alarm_region'])
+            customer_message, _ = notification_renderer.render_message(sns_message_parameters, resolution, coalesced, report_link, budget=NOTIFICATION_BUDGET_BYTES)
+        except ClientError as e: ## the cut message is still sent
+            logger.info(format(str(e)))
 
-    customer_message = customer_message_head + customer_message_body + customer_message_recommendation + customer_message_foot
-    
     return customer_message
 
 def send_cust_sns_message (subject, customer_message, sns_topic_data_truncation):
-    sns_dms = boto3.resource('sns')
+    sns_dms = clients.get_resource('sns')
     platform_endpoint = sns_dms.PlatformEndpoint(sns_topic_data_truncation)
 
     try:
         response = platform_endpoint.publish(
             Message=customer_message,
-            Subject=subject
+            Subject=notification_renderer.bounded_subject(subject)
         )
         logger.info(response)
     except ClientError as e:
         logger.info(format(str(e)))
         sys.exit()
 
+def send_merged_alarms(coalescer, coalesce_key, owner, sns_message_parameters, sns_topic_data_truncation):
+    ## completes the window of an owner whose diagnosis ended early and lists the alarms merged into it;
+    ## a no-op once the window is completed
+    coalesced = coalescer.complete(coalesce_key, owner)
+    if coalesced['Count'] <= 1:
+        return
+    subject = sns_message_parameters['alarm_state']+': '+sns_message_parameters['alarm_name']+' in '+sns_message_parameters['alarm_region']+' ('+str(coalesced['Count'])+' alarms)'
+    send_cust_sns_message (subject, notification_renderer.render_alarms_notice(sns_message_parameters, coalesced), sns_topic_data_truncation)
+
+## alarms for the same replication instance and issue type raised while one of them is diagnosed are
+## merged into its notification; the next alarm after that notification opens a new window. The window
+## length only bounds how long an owner that never completes holds the window. The store (memory,
+## file, s3 or dynamodb) decides whether the merge spans containers
+COALESCE_WINDOW_SECONDS = int(os.environ.get('COALESCE_WINDOW_SECONDS', alarm_coalescer.DEFAULT_WINDOW_SECONDS))
+COALESCE_STORE = os.environ.get('COALESCE_STORE', 'memory')
+COALESCE_LOCATION = os.environ.get('COALESCE_LOCATION')
+## seconds before the Lambda timeout at which an owner still diagnosing sends the merged alarms
+COALESCE_NOTICE_MARGIN_SECONDS = int(os.environ.get('COALESCE_NOTICE_MARGIN_SECONDS', 5))
+
+def get_coalescer():
+    ## None when coalescing is off; a misconfigured store is logged and the alarm handled on its own
+    if COALESCE_WINDOW_SECONDS <= 0:
+        return None
+    try:
+        store = alarm_coalescer.get_coalesce_store(COALESCE_STORE, COALESCE_LOCATION, COALESCE_WINDOW_SECONDS)
+    except ValueError as e:
+        logger.info('Invalid coalesce store, the alarm is not coalesced: '+str(e))
+        return None
+    return alarm_coalescer.AlarmCoalescer(store, COALESCE_WINDOW_SECONDS)
+
+def watch_merged_alarms(context, *notice):
+    ## sends the merged alarms shortly before the Lambda timeout, which ends the owner without running
+    ## its cleanup; the owner cancels the timer once it has completed the window itself
+    delay = context.get_remaining_time_in_millis() / 1000 - COALESCE_NOTICE_MARGIN_SECONDS
+    watchdog = threading.Timer(max(0, delay), send_merged_alarms, notice)
+    watchdog.daemon = True
+    watchdog.start()
+    return watchdog
+
+## auto picks Logs Insights for wide windows or many task streams, scan pages through FilterLogEvents
+LOG_SCAN_BACKEND = os.environ.get('LOG_SCAN_BACKEND', log_scanner.BACKEND_AUTO)
+## sub-ranges of the alarm window and concurrent FilterLogEvents calls used by the log scan
+LOG_SCAN_SLICES = int(os.environ.get('LOG_SCAN_SLICES', 4))
+LOG_SCAN_WORKERS = int(os.environ.get('LOG_SCAN_WORKERS', 8))
+LOG_SCAN_TIME_BUDGET = int(os.environ.get('LOG_SCAN_TIME_BUDGET', 30))
+
 def dms_log_filter_by_alarm (alarm_time, ri_name, pattern, time_interval):
-    cw_log_client = boto3.client('logs') 
+    cw_log_client = clients.get_client('logs') 
 
     filter_pattern = ''
     ## lambda does not support 3.10 yet where switch case is implemented in python
@@ -125,20 +141,32 @@ def dms_log_filter_by_alarm (alarm_time, ri_name, pattern, time_interval):
         logger.info('No filter pre-defined')
 
     try:
-        return cw_log_client.filter_log_events(
-                logGroupName='dms-tasks-'+ri_name,
-                logStreamNamePrefix='dms-task',
-                startTime=int((alarm_time - datetime.timedelta(minutes=time_interval)).timestamp())*1000, ## epoch alarm_time_epoch - 5 min
-                endTime=int((alarm_time + datetime.timedelta(minutes=time_interval)).timestamp())*1000, ## epoch alarm_time_epoch + 5 min, assuming find log first, than alarm
-                filterPattern=filter_pattern,
-                limit=100
+        ## either one Logs Insights query or every page of every task stream in the window read concurrently,
+        ## the first event of each stream is enough for the notification
+        alarm_log = log_scanner.find_log_events(
+                cw_log_client,
+                'dms-tasks-'+ri_name,
+                int((alarm_time - datetime.timedelta(minutes=time_interval)).timestamp())*1000, ## epoch alarm_time_epoch - 5 min
+                int((alarm_time + datetime.timedelta(minutes=time_interval)).timestamp())*1000, ## epoch alarm_time_epoch + 5 min, assuming find log first, than alarm
+                filter_pattern=filter_pattern,
+                stream_prefix='dms-task',
+                backend=LOG_SCAN_BACKEND,
+                slices=LOG_SCAN_SLICES,
+                max_workers=LOG_SCAN_WORKERS,
+                time_budget=LOG_SCAN_TIME_BUDGET
             )
+        if not alarm_log['scan'].get('Complete', True):
+            logger.info('Log scan stopped after '+str(LOG_SCAN_TIME_BUDGET)+' s, tasks found so far are reported')
+        return alarm_log
     except ClientError as e:
         logger.info(format(str(e)))
         sys.exit()
 
+## seconds a task's LOB settings are reused by later alarms handled in the same container
+LOB_PROFILE_TTL = int(os.environ.get('LOB_PROFILE_TTL', lob_profile.DEFAULT_TTL_SECONDS))
+
 def dms_check_truncation (sns_message_parameters, ri_name, arn_prefix, alarm_log):
-    dms_client = boto3.client('dms') 
+    dms_client = clients.get_client('dms') 
 
     tasks_truncated_logs_all = alarm_log['events'] ## array
 
@@ -167,63 +195,45 @@ def dms_check_truncation (sns_message_parameters, ri_name, arn_prefix, alarm_log
             ## record task info for each tasks identified with LOB truncation
             sns_message_parameters['tasks'] = {}
             
+            ## describe table mapping, task setting for LOB of every task at once
+            task_arns = {task: arn_prefix+':task:'+task.removeprefix('dms-task-') for task in tasks_truncated}
+            profiles = lob_profile.fetch_lob_profiles(dms_client, list(task_arns.values()), lob_profile.LobProfileCache(LOB_PROFILE_TTL))
+
             for task in tasks_truncated: 
                 ## to do: construct message for SNS
                 ## no table name in MySQL, not sure SQL Server
-                ## describe table mapping, task setting for LOB
-                task_arn = arn_prefix+':task:'+task.removeprefix('dms-task-')
+                task_arn = task_arns[task]
                 task_external_id = task.removeprefix('dms-task-')
-                task_truncated_lob_settings = dms_client.describe_replication_tasks(
-                    Filters=[
-                        {
-                            'Name': 'replication-task-arn',
-                            'Values': [
-                                task_arn
-                            ]
-                        }
-                    ],
-                    WithoutSettings=False
-                )
-                task_settings = json.loads(task_truncated_lob_settings['ReplicationTasks'][0]['ReplicationTaskSettings'])
-                lob_max_size_table_mapping = float('inf')
-                lob_max_size_task_setting = 0
+                if task_arn not in profiles:
+                    logger.info('Task '+task_arn+' not found, it may have been deleted')
+                    continue
+                profile = profiles[task_arn]
                 
                 sns_message_parameters['tasks'][task_external_id] = {}
                 
                 sns_message_parameters['tasks'][task_external_id]['task_arn'] = task_arn
-                sns_message_parameters['tasks'][task_external_id]['task_settings'] = {"SupportLobs": task_settings['TargetMetadata']['SupportLobs']}
-
-                if task_settings['TargetMetadata']['SupportLobs'] == True:   
-                    if task_settings['TargetMetadata']['LimitedSizeLobMode'] == True:
-                        lob_max_size_task_setting = task_settings['TargetMetadata']['LobMaxSize']
+                sns_message_parameters['tasks'][task_external_id]['task_settings'] = {"SupportLobs": profile.support_lobs}
 
+                if profile.support_lobs:   
+                    if profile.limited_size_lob_mode:
                         ## record LOB truncation related task settings
-                        sns_message_parameters['tasks'][task_external_id]['task_settings'].update({"LimitedSizeLobMode": task_settings['TargetMetadata']['LimitedSizeLobMode'],"LobMaxSize":task_settings['TargetMetadata']['LobMaxSize']})
-                        logger.info('Task ARN: '+task_arn+' LimitedSizeLobMode: '+str(task_settings['TargetMetadata']['LimitedSizeLobMode']))
-                        logger.info('Task ARN: '+task_arn+' LobMaxSize: '+ str(task_settings['TargetMetadata']['LobMaxSize']))
+                        sns_message_parameters['tasks'][task_external_id]['task_settings'].update({"LimitedSizeLobMode": True,"LobMaxSize":profile.lob_max_size})
+                        logger.info('Task ARN: '+task_arn+' LimitedSizeLobMode: True')
+                        logger.info('Task ARN: '+task_arn+' LobMaxSize: '+ str(profile.lob_max_size))
 
-                    elif task_settings['TargetMetadata']['FullLobMode'] == True:
+                    elif profile.full_lob_mode:
                         logger.info('There should not be LOB truncation under "FullLobMode". Issue a support case if LOB truncation is seen under "FullLobMode".')
 
                 else:
                     logger.info('If there is LOB in tables migrated by '+ task_arn +', trun on LOB support for the task by setting "SupportLobs" to true')
                 
-                task_table_mapping = json.loads(task_truncated_lob_settings['ReplicationTasks'][0]['TableMappings'])
-                task_setting_rules = task_table_mapping['rules'] ## array of rules
-
-                for rule in task_setting_rules:
-                    if 'lob-settings' in rule:
-                        if 'bulk-max-size' in rule['lob-settings']:
-                            if 'mode' not in rule['lob-settings'] or rule['lob-settings']['mode'] == 'limited':
-                                lob_max_size_table_mapping = int(rule['lob-settings']['bulk-max-size'])
-                                sns_message_parameters['tasks'][task_external_id]['lob_setting_in_table_mapping']=rule
-                            else:
-                                logger.info('No limited LOB mode specified for individual tables in the task ' + task_arn + '. Check LOB setting in task setting for LOB truncation.')
-                    else:
-                        logger.info('No lob-settings in this task rule '+rule['rule-id']+' in '+task_arn)
+                if profile.table_mapping_rule is not None:
+                    sns_message_parameters['tasks'][task_external_id]['lob_setting_in_table_mapping']=profile.table_mapping_rule
+                else:
+                    logger.info('No limited LOB mode specified for individual tables in the task ' + task_arn + '. Check LOB setting in task setting for LOB truncation.')
                 
                 ## if both task setting and table mapping specified, table mapping overrides tasks setting. compare LobMaxSize and bulk-max-size
-                if lob_max_size_table_mapping < lob_max_size_task_setting:
+                if profile.less_max_lob_in_table_mapping:
                     sns_message_parameters['tasks'][task_external_id]['task_settings'].update({"less_max_lob_in_table_mapping": True})
                     logger.info('If both task setting and table mapping specified, table mapping overrides tasks setting. Note that the max LOB is smaller than the LobMaxSize in task setting.')
                     ## to do: handler    
@@ -238,6 +248,7 @@ def dms_check_truncation (sns_message_parameters, ri_name, arn_prefix, alarm_log
         logger.info(format(str(e)))
         sys.exit()
 
+@instrumentation.instrumented
 def lambda_handler(event, context):
     
     set_logger('INFO')
@@ -245,8 +256,6 @@ def lambda_handler(event, context):
     ## logger.info(str(context))
     ## logger.info(str(event))
 
-    dms_client = boto3.client('dms') 
-    
     try:
         ## get from CFN as environment variable
         logger.info("environment variable: " + os.environ['RiARN'])  
@@ -280,19 +289,38 @@ def lambda_handler(event, context):
         ## different error types have different treatments
         if sns_message_parameters['alarm_name'] == alarm_name: ## CFN creates this alarm
             issue_type = 'TRUNCATION'           
-            ## load from central DB, which is now S3
-            expression = """SELECT * FROM s3object s where s.Issue_Type='TRUNCATION' LIMIT 1"""
-            error_treatment = get_error_treatment(bucket_issue_resolution, issue_resolution, expression)
-            logger.info('Got from s3 for this type of error: ')
-            logger.info(error_treatment)
-            ## log filter for truncation
-            alarm_log = dms_log_filter_by_alarm (alarm_time, ri_name, issue_type, 10)
-            ## check DMS task settings related to LOB truncation
-            sns_message_parameters = dms_check_truncation (sns_message_parameters, ri_name, arn_prefix, alarm_log)
-            ## generate customized SNS message for LOB truncation
-            customer_message = generate_customer_message (sns_message_parameters, issue_type)
-            ## send customize message with LOB truncation info checked above
-            send_cust_sns_message (sns_message_parameters['subject'], customer_message, sns_topic_data_truncation)
+            ## merge into an alarm storm already being handled, skipping the diagnosis
+            coalesce_key = alarm_coalescer.coalesce_key(ri_arn, issue_type)
+            coalescer = get_coalescer()
+            if coalescer is not None:
+                alarm = {'AlarmName': sns_message_parameters['alarm_name'], 'Time': sns_message_parameters['alarm_timestamp'], 'Reason': sns_message_parameters['alarm_reason']}
+                if not coalescer.join(coalesce_key, alarm, context.aws_request_id):
+                    return
+                watchdog = watch_merged_alarms(context, coalescer, coalesce_key, context.aws_request_id, sns_message_parameters, sns_topic_data_truncation)
+            coalesced = None
+            try:
+                ## load from central DB, which is now S3
+                error_treatment = get_error_treatment(bucket_issue_resolution, issue_resolution, issue_type)
+                logger.info('Got from s3 for this type of error: ')
+                logger.info(error_treatment)
+                ## log filter for truncation
+                alarm_log = dms_log_filter_by_alarm (alarm_time, ri_name, issue_type, 10)
+                ## check DMS task settings related to LOB truncation
+                sns_message_parameters = dms_check_truncation (sns_message_parameters, ri_name, arn_prefix, alarm_log)
+                ## generate customized SNS message for LOB truncation
+                if coalescer is not None:
+                    coalesced = coalescer.complete(coalesce_key, context.aws_request_id)
+                    if coalesced['Count'] > 1:
+                        sns_message_parameters['subject'] = sns_message_parameters['subject']+' ('+str(coalesced['Count'])+' alarms)'
+                customer_message = generate_customer_message (sns_message_parameters, issue_type, coalesced)
+                ## send customize message with LOB truncation info checked above
+                send_cust_sns_message (sns_message_parameters['subject'], customer_message, sns_topic_data_truncation)
+            finally:
+                ## when the diagnosis ended early, whatever the reason, the alarms merged into the window meanwhile are still notified
+                if coalescer is not None:
+                    watchdog.cancel()
+                    if coalesced is None:
+                        send_merged_alarms(coalescer, coalesce_key, context.aws_request_id, sns_message_parameters, sns_topic_data_truncation)
         ## elif pattern == '':
             ## to do for other error cases
         else:
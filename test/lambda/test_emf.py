@@ -0,0 +1,51 @@
+import datetime
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'src', 'lambda', 'dms-common-py', 'layer', 'common'))
+
+import emf  # noqa: E402
+
+TIMESTAMP = datetime.datetime(2024, 5, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+def metric_data():
+    datums = []
+    for task in ('task-a', 'task-b', 'task-c'):
+        dimensions = [{'Name': 'ReplicationInstanceIdentifier', 'Value': 'ri-1'},
+                      {'Name': 'ReplicationTaskIdentifier', 'Value': task}]
+        for i in range(120):
+            datums.append({'MetricName': 'Metric{:03d}'.format(i), 'Dimensions': dimensions,
+                           'Timestamp': TIMESTAMP, 'Value': i * 1.5, 'Unit': 'Count'})
+    datums.append({'MetricName': 'Tasks', 'Dimensions': [{'Name': 'ReplicationInstanceIdentifier', 'Value': 'ri-1'}],
+                   'Timestamp': TIMESTAMP, 'Value': 3, 'Unit': 'Count'})
+    return datums
+
+
+def test_format_emf_documents_is_deterministic():
+    first = metric_data()
+    second = metric_data()
+    random.Random(7).shuffle(second)
+    assert first != second
+
+    expected = emf.format_emf_documents('CustomMetrics/DMS', first)
+    documents = emf.format_emf_documents('CustomMetrics/DMS', second)
+
+    assert '\n'.join(documents).encode('utf-8') == '\n'.join(expected).encode('utf-8')
+    # 3 tasks with 120 metrics split at 100 per document, plus the instance document
+    assert len(documents) == 7
+
+
+def test_emit_emf_writes_the_same_bytes():
+    streams = []
+    for seed in (1, 2):
+        datums = metric_data()
+        random.Random(seed).shuffle(datums)
+        stream = io.StringIO()
+        emf.emit_emf('CustomMetrics/DMS', datums, stream)
+        streams.append(stream.getvalue().encode('utf-8'))
+
+    assert streams[0] == streams[1]
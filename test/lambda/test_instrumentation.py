@@ -0,0 +1,39 @@
+import os
+import sys
+
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'src', 'lambda', 'dms-common-py', 'layer', 'common'))
+
+import clients  # noqa: E402
+import instrumentation  # noqa: E402
+
+
+def call(client, operation, response):
+    with Stubber(client) as stubber:
+        stubber.add_response(operation, response)
+        getattr(client, operation)()
+
+
+def test_install_hooks_registry_clients_created_before_and_after(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(clients, '_hooks', [])
+    clients.clear()
+    instrumentation.reset()
+
+    sns = clients.get_client('sns')
+    dynamodb = clients.get_resource('dynamodb')
+    instrumentation.install()
+    instrumentation.install()
+    s3 = clients.get_client('s3')
+
+    call(sns, 'list_topics', {'Topics': []})
+    call(dynamodb.meta.client, 'list_tables', {'TableNames': []})
+    call(s3, 'list_buckets', {'Buckets': []})
+
+    calls = {operation: stats['Calls'] for operation, stats in instrumentation.summary().items()}
+    assert calls == {'sns.ListTopics': 1, 'dynamodb.ListTables': 1, 's3.ListBuckets': 1}
+    clients.clear()
@@ -0,0 +1,68 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'src', 'lambda', 'dms-common-py', 'layer', 'common'))
+
+import log_classifier  # noqa: E402
+import log_scanner  # noqa: E402
+
+
+class FakeLogs:
+    # FilterLogEvents over in-memory streams, evaluating term based patterns the way
+    # CloudWatch Logs does and returning one event per page
+    def __init__(self, streams):
+        self.streams = streams
+        self.patterns = []
+
+    def filter_log_events(self, logGroupName, startTime, endTime, filterPattern, logStreamNames, nextToken=None):
+        self.patterns.append(filterPattern)
+        required, optional, excluded = log_scanner.filter_terms(filterPattern)
+        events = [event for stream in logStreamNames for event in self.streams[stream]
+                  if all(t in event['message'] for t in required)
+                  and not any(t in event['message'] for t in excluded)
+                  and (not optional or any(t in event['message'] for t in optional))]
+        position = int(nextToken or 0)
+        response = {'events': events[position:position + 1]}
+        if position + 1 < len(events):
+            response['nextToken'] = str(position + 1)
+        return response
+
+
+def event(stream, timestamp, message):
+    return {'logStreamName': stream, 'timestamp': timestamp, 'message': message, 'eventId': stream + str(timestamp)}
+
+
+def scan(classifier, streams):
+    logs = FakeLogs(streams)
+    result = log_scanner.scan_log_events(logs, 'dms-tasks-ri', 0, 1000, classifier.filter_pattern, slices=1,
+                                         max_workers=1, streams=list(streams),
+                                         first_per_stream=classifier.first_per_stream)
+    return logs, classifier.classify(result['events'])
+
+
+def test_single_signature_is_scanned_with_its_own_pattern():
+    classifier = log_classifier.LogClassifier({'TRUNCATION': 'ERROR -DATA_STRUCTURE'})
+    # the first event of the stream holds the required term but also the excluded one
+    streams = {'dms-task-a': [event('dms-task-a', 1, 'ERROR DATA_STRUCTURE near miss'),
+                              event('dms-task-a', 2, 'ERROR column truncated'),
+                              event('dms-task-a', 3, 'ERROR column truncated again')]}
+
+    logs, issues = scan(classifier, streams)
+
+    assert logs.patterns[0] == 'ERROR -DATA_STRUCTURE'
+    assert classifier.first_per_stream
+    assert [e['message'] for e in issues['TRUNCATION']] == ['ERROR column truncated']
+
+
+def test_union_of_signatures_reads_every_event():
+    classifier = log_classifier.LogClassifier({'TRUNCATION': 'ERROR truncated', 'OTHER': '?"W:  Other"'})
+    streams = {'dms-task-a': [event('dms-task-a', 1, 'column truncated without error'),
+                              event('dms-task-a', 2, 'W:  Other warning'),
+                              event('dms-task-a', 3, 'ERROR column truncated')]}
+
+    logs, issues = scan(classifier, streams)
+
+    assert not classifier.first_per_stream
+    assert [e['message'] for e in issues['TRUNCATION']] == ['ERROR column truncated']
+    assert [e['message'] for e in issues['OTHER']] == ['W:  Other warning']
@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                                'src', 'lambda', 'dms-switch-py', 'layer', 'utils'))
+
+import utils  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeContext:
+    # a Lambda context whose remaining time runs down with the fake clock
+    def __init__(self, clock, remaining_ms):
+        self.clock = clock
+        self.end_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return int(self.end_ms - self.clock.now * 1000)
+
+
+def wait(clock, statuses, context=None, **kwargs):
+    polls = iter(statuses)
+    return utils.wait_for_all_status(lambda: {'arn': next(polls)}, 'stopped', context, clock=clock,
+                                     sleep=clock.sleep, rng=lambda: 1.0, **kwargs)
+
+
+def test_wait_uses_the_lambda_time_left_rather_than_the_timeout():
+    clock = FakeClock()
+    # 15 minutes of Lambda time, stopped after about 10 minutes of polling
+    statuses = ['stopping'] * 12 + ['stopped']
+
+    assert wait(clock, statuses, FakeContext(clock, 15 * 60 * 1000), timeout=240) == {'arn': 'stopped'}
+    assert clock.now > 240
+
+
+def test_wait_caps_the_last_delay_at_the_deadline():
+    clock = FakeClock()
+    context = FakeContext(clock, 100 * 1000)
+
+    with pytest.raises(Exception, match='not stopped'):
+        wait(clock, ['stopping'] * 10, context, safety_margin_ms=15000)
+
+    # 5 + 10 + 20 + 40 s, then 10 s to end on the 85 s deadline instead of 60 s past it
+    assert clock.sleeps == [5, 10, 20, 40, 10]
+    assert context.get_remaining_time_in_millis() == 15000
+
+
+def test_wait_without_context_uses_the_timeout():
+    clock = FakeClock()
+
+    with pytest.raises(Exception, match='after 30 s'):
+        wait(clock, ['stopping'] * 10, timeout=30)
+
+    assert clock.now == 30
+
+
+class FakeDms:
+    # describe_replication_tasks through the paginator, returning only the tasks it knows
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Filters, **kwargs):
+        arns = Filters[0]['Values']
+        yield {'ReplicationTasks': [{'ReplicationTaskArn': arn, 'Status': self.statuses[arn]}
+                                    for arn in arns if arn in self.statuses]}
+
+
+def is_complete_event(request_type):
+    response = utils.pending_response('pre-dms', 'task', ['arn:aws:dms:us-east-1:1:task:A',
+                                                          'arn:aws:dms:us-east-1:1:task:B'], 'stopped')
+    return dict(response, RequestType=request_type)
+
+
+def test_check_complete_fails_at_once_on_a_missing_task():
+    dms = FakeDms({'arn:aws:dms:us-east-1:1:task:A': 'stopping'})
+
+    with pytest.raises(Exception, match='task:B'):
+        utils.check_complete(dms, is_complete_event('Update'))
+
+
+def test_check_complete_ignores_a_missing_task_on_delete():
+    dms = FakeDms({'arn:aws:dms:us-east-1:1:task:A': 'stopping'})
+    assert utils.check_complete(dms, is_complete_event('Delete')) == {'IsComplete': False}
+
+    dms.statuses['arn:aws:dms:us-east-1:1:task:A'] = 'stopped'
+    assert utils.check_complete(dms, is_complete_event('Delete')) == {'IsComplete': True}